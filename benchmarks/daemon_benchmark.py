@@ -0,0 +1,96 @@
+"""Benchmark of the daemon mode against in-process mock backends, with recordings arriving while it runs.
+
+New recordings are added to the mock Miralix at a steady rate, and the benchmark reports the p50/p99 latency
+from the arrival of each recording to the end of its upload, the number of Miralix requests and the
+number of polls. Polling faster lowers the latency at the cost of more listing requests while idle.
+
+Run from the repository root, e.g.:
+    python -m benchmarks.daemon_benchmark --seconds 30 --arrivals-per-second 2 --interval 2 --max-interval 16
+"""
+
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+from robot_framework import config
+from robot_framework import process
+
+from benchmarks.mock_servers import MB, MockBackends, ServerBehaviour, make_size_sampler
+from benchmarks.transfer_benchmark import QUEUE_NAMES, create_orchestrator, percentile, point_config_at
+
+
+def add_arrivals(backends: MockBackends, args: argparse.Namespace, arrivals: dict[int, float], stop: threading.Event) -> None:
+    """Add a recording to Miralix every 1 / arrivals_per_second seconds until stopped, noting when each arrived."""
+    size_sampler = make_size_sampler(args.sizes, args.seed)
+    while not stop.wait(1 / args.arrivals_per_second):
+        call_id = max(backends.miralix.recordings, default=0) + 1
+        arrivals[call_id] = time.perf_counter()
+        backends.miralix.add_recordings(1, size_sampler, call_id)
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Run the benchmark once and return the results."""
+    backends = MockBackends.start(QUEUE_NAMES, 0, size_spec=args.sizes,
+                                  miralix_behaviour=ServerBehaviour(args.latency, args.bandwidth * MB),
+                                  get_organized_behaviour=ServerBehaviour(args.latency, args.bandwidth * MB),
+                                  seed=args.seed)
+    orchestrator_connection = create_orchestrator({
+        "case_number": "EMN-0000-000000", "target_queues": QUEUE_NAMES,
+        "daemon": {"interval_seconds": args.interval, "max_interval_seconds": args.max_interval, "run_minutes": args.seconds / 60}
+    })
+
+    arrivals = {}
+    stop = threading.Event()
+    error = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        point_config_at(backends, work_dir)
+        feeder = threading.Thread(target=add_arrivals, args=(backends, args, arrivals, stop), daemon=True)
+        feeder.start()
+        try:
+            process.process(orchestrator_connection)
+        # The benchmark reports errors instead of stopping.
+        # pylint: disable-next = broad-exception-caught
+        except Exception as exception:
+            error = repr(exception)
+        finally:
+            stop.set()
+            feeder.join()
+    backends.stop()
+
+    latencies = [events["upload_finished"] - arrivals[call_id] for call_id, events in backends.miralix.events.items()
+                 if "upload_finished" in events and call_id in arrivals]
+    return {
+        "seconds": args.seconds,
+        "arrived": len(arrivals),
+        "uploaded": len(latencies),
+        "latency_p50": round(percentile(latencies, 0.5), 2) if latencies else None,
+        "latency_p99": round(percentile(latencies, 0.99), 2) if latencies else None,
+        "miralix_requests": backends.miralix.request_count,
+        "duplicate_uploads": backends.get_organized.upload_count - len(backends.get_organized.documents),
+        "polls_with_recordings": sum(1 for _, message in orchestrator_connection.logs if message.startswith("Run summary")),
+        "failed_polls": sum(1 for _, message in orchestrator_connection.logs if message.startswith("Poll of")),
+        "error": error
+    }
+
+
+def main():
+    """Parse arguments, run the benchmark and print the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=30, help="How long the daemon runs.")
+    parser.add_argument("--arrivals-per-second", type=float, default=2, help="New recordings per second, spread over the queues.")
+    parser.add_argument("--interval", type=float, default=2, help="Seconds between polls of a queue with new recordings.")
+    parser.add_argument("--max-interval", type=float, default=16, help="Highest number of seconds between polls of an idle queue.")
+    parser.add_argument("--sizes", default="uniform:1:5", help="Recording sizes in MB: fixed:S, uniform:MIN:MAX or lognormal:MU:SIGMA.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency per request on both backends.")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="MB per second per connection. 0 is unlimited.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config.DAEMON_MAX_FAILED_POLLS = 10**9
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
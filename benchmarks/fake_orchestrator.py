@@ -0,0 +1,181 @@
+"""An in-memory stand-in for OpenOrchestrator's OrchestratorConnection.
+
+It implements the methods used by the robot with the same signatures and semantics,
+and counts the calls made so database chatter can be measured.
+"""
+
+import dataclasses
+import threading
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from OpenOrchestrator.database.queues import QueueStatus
+
+
+@dataclass
+class FakeQueueElement:  # pylint: disable=too-many-instance-attributes
+    """A queue element with the fields of OpenOrchestrator's QueueElement."""
+    queue_name: str
+    reference: str | None = None
+    data: str | None = None
+    created_by: str | None = None
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    status: QueueStatus = QueueStatus.NEW
+    created_date: datetime = field(default_factory=datetime.now)
+    start_date: datetime | None = None
+    end_date: datetime | None = None
+    message: str | None = None
+
+
+@dataclass
+class FakeCredential:
+    """A credential with a username and a password."""
+    name: str
+    username: str
+    password: str
+
+
+@dataclass
+class FakeConstant:
+    """A constant with a value."""
+    name: str
+    value: str
+
+
+class FakeOrchestratorConnection:  # pylint: disable=too-many-instance-attributes
+    """An in-memory OrchestratorConnection. It can be shared between threads."""
+
+    def __init__(self, process_name: str, process_arguments: str, credentials: dict[str, tuple[str, str]] | None = None,
+                 constants: dict[str, str] | None = None):
+        """Create a connection.
+
+        Args:
+            process_name: The name of the process.
+            process_arguments: The process arguments as a JSON string.
+            credentials: A dict of credential names to (username, password).
+            constants: A dict of constant names to values.
+        """
+        self.process_name = process_name
+        self.process_arguments = process_arguments
+        self.credentials = {name: FakeCredential(name, *login) for name, login in (credentials or {}).items()}
+        self.constants = {name: FakeConstant(name, value) for name, value in (constants or {}).items()}
+        self.queue_elements: dict[str, FakeQueueElement] = {}
+        self.logs: list[tuple[str, str]] = []
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+
+    def log_trace(self, message: str) -> None:
+        """Log a message with level 'trace'."""
+        self._count("log_trace")
+        self.logs.append(("trace", message))
+
+    def log_info(self, message: str) -> None:
+        """Log a message with level 'info'."""
+        self._count("log_info")
+        self.logs.append(("info", message))
+
+    def log_error(self, message: str) -> None:
+        """Log a message with level 'error'."""
+        self._count("log_error")
+        self.logs.append(("error", message))
+
+    def get_constant(self, constant_name: str) -> FakeConstant:
+        """Get a constant. Raises ValueError if it doesn't exist."""
+        self._count("get_constant")
+        if constant_name not in self.constants:
+            raise ValueError(f"No constant with name '{constant_name}' was found.")
+        return self.constants[constant_name]
+
+    def update_constant(self, constant_name: str, new_value: str) -> None:
+        """Update an existing constant. Raises ValueError if it doesn't exist."""
+        self._count("update_constant")
+        if constant_name not in self.constants:
+            raise ValueError(f"No constant with name '{constant_name}' was found.")
+        self.constants[constant_name].value = new_value
+
+    def get_credential(self, credential_name: str) -> FakeCredential:
+        """Get a credential. Raises ValueError if it doesn't exist."""
+        self._count("get_credential")
+        if credential_name not in self.credentials:
+            raise ValueError(f"No credential with name '{credential_name}' was found.")
+        return self.credentials[credential_name]
+
+    def create_queue_element(self, queue_name: str, reference: str | None = None, data: str | None = None, created_by: str | None = None) -> FakeQueueElement:
+        """Add a queue element to a queue."""
+        self._count("create_queue_element")
+        queue_element = FakeQueueElement(queue_name, None if reference is None else str(reference), data, created_by)
+        with self._lock:
+            self.queue_elements[queue_element.id] = queue_element
+        return queue_element
+
+    def bulk_create_queue_elements(self, queue_name: str, references: tuple[str | None, ...], data: tuple[str | None, ...],
+                                   created_by: str | None = None) -> None:
+        """Insert multiple queue elements into a queue."""
+        self._count("bulk_create_queue_elements")
+        if len(references) == 0 or len(data) == 0 or len(references) != len(data):
+            raise ValueError("The references and data must be non-empty and of equal length.")
+        with self._lock:
+            for reference, element_data in zip(references, data):
+                queue_element = FakeQueueElement(queue_name, reference, element_data, created_by)
+                self.queue_elements[queue_element.id] = queue_element
+
+    def get_next_queue_element(self, queue_name: str, reference: str | None = None, set_status: bool = True) -> FakeQueueElement | None:
+        """Get the oldest 'New' element of a queue, and mark it in progress if 'set_status'."""
+        self._count("get_next_queue_element")
+        with self._lock:
+            candidates = sorted((queue_element for queue_element in self.queue_elements.values()
+                                 if queue_element.queue_name == queue_name and queue_element.status == QueueStatus.NEW
+                                 and (reference is None or queue_element.reference == reference)),
+                                key=lambda queue_element: queue_element.created_date)
+            if not candidates:
+                return None
+            if set_status:
+                candidates[0].status = QueueStatus.IN_PROGRESS
+                candidates[0].start_date = datetime.now()
+            return candidates[0]
+
+    # The signature matches OrchestratorConnection.
+    # pylint: disable-next = too-many-positional-arguments
+    def get_queue_elements(self, queue_name: str, reference: str | None = None, status: QueueStatus | None = None,
+                           offset: int = 0, limit: int = 100, from_date: datetime | None = None, to_date: datetime | None = None) -> tuple[FakeQueueElement, ...]:
+        """Get queue elements from a queue, newest first."""
+        self._count("get_queue_elements")
+        with self._lock:
+            queue_elements = [queue_element for queue_element in self.queue_elements.values()
+                              if queue_element.queue_name == queue_name
+                              and (reference is None or queue_element.reference == reference)
+                              and (status is None or queue_element.status == status)
+                              and (from_date is None or queue_element.created_date >= from_date)
+                              and (to_date is None or queue_element.created_date <= to_date)]
+        queue_elements.sort(key=lambda queue_element: queue_element.created_date, reverse=True)
+        #  Copies, like the rows of a database query
+        return tuple(dataclasses.replace(queue_element) for queue_element in queue_elements[offset:offset+limit])
+
+    def set_queue_element_status(self, element_id: str, status: QueueStatus, message: str | None = None) -> None:
+        """Set the status of a queue element and note the start or end date."""
+        self._count("set_queue_element_status")
+        with self._lock:
+            queue_element = self.queue_elements[str(element_id)]
+            queue_element.status = status
+            if status == QueueStatus.IN_PROGRESS:
+                queue_element.start_date = datetime.now()
+            elif status in (QueueStatus.DONE, QueueStatus.FAILED, QueueStatus.ABANDONED):
+                queue_element.end_date = datetime.now()
+            if message is not None:
+                queue_element.message = message
+
+    def delete_queue_element(self, element_id: str) -> None:
+        """Delete a queue element."""
+        self._count("delete_queue_element")
+        with self._lock:
+            del self.queue_elements[str(element_id)]
+
+    def status_counts(self, queue_name: str) -> Counter:
+        """Count the elements of a queue by status."""
+        return Counter(queue_element.status for queue_element in self.queue_elements.values() if queue_element.queue_name == queue_name)
@@ -0,0 +1,419 @@
+"""In-process stand-ins for the Miralix and GetOrganized APIs used by the robot.
+
+The servers implement the endpoints called by miralix_api and get_organized_api,
+with configurable latency, bandwidth, error injection and recording sizes.
+Recordings are generated on the fly and uploads are counted without being kept,
+so the servers add little to the memory use of the process they run in.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# The query parameter limiting a page of a queue listing, like config.MIRALIX_PAGE_SIZE_PARAMETER.
+PAGE_SIZE_PARAMETER = "pageSize"
+# The bytes per second of conversation of a recording, so the listed durations match the sizes like config.PLAN_BYTES_PER_SECOND.
+AUDIO_BYTES_PER_SECOND = 16000
+
+
+@dataclass
+class ServerBehaviour:
+    """How a mock server responds.
+
+    Attributes:
+        latency: Seconds before each response is sent.
+        bandwidth: Bytes per second when sending or receiving bodies. 0 means unlimited.
+        error_rate: The probability of answering a request with status 503.
+        max_concurrency: The number of requests handled at once before answering 429 with Retry-After. 0 means unlimited.
+        retry_after: The seconds in the Retry-After header of a 429.
+        listing_seconds_per_call: Extra seconds per call in a queue listing, for the time Miralix takes to build big listings.
+        missing_call_ids: Call IDs that are listed, but whose recordings are answered with status 404.
+        max_page_size: The most calls on a page of a queue listing, whatever page size is asked for. 0 means unlimited.
+    """
+    latency: float = 0.0
+    bandwidth: float = 0.0
+    error_rate: float = 0.0
+    max_concurrency: int = 0
+    retry_after: int = 1
+    listing_seconds_per_call: float = 0.0
+    missing_call_ids: tuple[int, ...] = ()
+    max_page_size: int = 0
+
+
+def make_size_sampler(spec: str, seed: int = 0) -> Callable[[], int]:
+    """Create a function that draws recording sizes in bytes.
+
+    Args:
+        spec: The distribution in MB: 'fixed:SIZE', 'uniform:MIN:MAX' or 'lognormal:MU:SIGMA'.
+            Lognormal sizes are capped at 200 MB.
+        seed: Seed of the random generator.
+
+    Returns:
+        A function returning a size in bytes.
+    """
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    rng = random.Random(seed)
+    if kind == "fixed":
+        return lambda: int(values[0] * MB)
+    if kind == "uniform":
+        return lambda: int(rng.uniform(values[0], values[1]) * MB)
+    if kind == "lognormal":
+        return lambda: int(min(rng.lognormvariate(values[0], values[1]), 200) * MB)
+    raise ValueError(f"Unknown size distribution '{spec}'.")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Base request handler applying the behaviour of the server."""
+    protocol_version = "HTTP/1.1"
+    server: "_MockServer"
+    _counted = False
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def parse_request(self) -> bool:
+        parsed = super().parse_request()
+        if parsed:
+            with self.server.lock:
+                self.server.active_requests += 1
+            self._counted = True
+        return parsed
+
+    def handle_one_request(self):
+        self._counted = False
+        try:
+            super().handle_one_request()
+        finally:
+            if self._counted:
+                with self.server.lock:
+                    self.server.active_requests -= 1
+
+    def _delay_or_fail(self) -> bool:
+        """Apply latency, the concurrency limit and error injection. Returns True if an error was sent."""
+        behaviour = self.server.behaviour
+        if behaviour.latency:
+            time.sleep(behaviour.latency)
+        if behaviour.max_concurrency and self.server.active_requests > behaviour.max_concurrency:
+            self._drain_body()
+            self.server.throttled_count += 1
+            self._send_json({"Message": "Too many requests"}, status=429, headers={"Retry-After": str(behaviour.retry_after)})
+            return True
+        if behaviour.error_rate and random.random() < behaviour.error_rate:
+            self._drain_body()
+            self._send_json({"Message": "Injected error"}, status=503)
+            return True
+        return False
+
+    def _throttle(self, size: int) -> None:
+        if self.server.behaviour.bandwidth:
+            time.sleep(size / self.server.behaviour.bandwidth)
+
+    def _drain_body(self) -> tuple[int, bytes]:
+        """Read the request body in chunks. Returns the size and the first chunk."""
+        remaining = int(self.headers.get("Content-Length", 0))
+        size = 0
+        head = b""
+        while remaining:
+            chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            self._throttle(len(chunk))
+            head = head or chunk
+            size += len(chunk)
+            remaining -= len(chunk)
+        return size, head
+
+    def _send_json(self, body, status: int = 200, headers: dict[str, str] | None = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _MockServer(ThreadingHTTPServer):
+    """A threading HTTP server running in a daemon thread."""
+    daemon_threads = True
+
+    def __init__(self, handler: type, behaviour: ServerBehaviour):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.behaviour = behaviour
+        self.lock = threading.Lock()
+        self.active_requests = 0
+        self.throttled_count = 0
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "_MockServer":
+        """Start serving in the background."""
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+
+class _MiralixHandler(_Handler):
+    server: "MockMiralixServer"
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Answer HEAD requests for recordings with their size."""
+        match = re.fullmatch(r"/queues/calls/recordings/(\d+)", urlparse(self.path).path)
+        if not match or int(match.group(1)) not in self.server.recordings:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(self.server.recordings[int(match.group(1))]["size"]))
+        self.end_headers()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer the Miralix endpoints."""
+        self.server.count_request()
+        if self._delay_or_fail():
+            return
+
+        url = urlparse(self.path)
+        path = url.path
+
+        if path == "/queues":
+            self._send_json([{"Id": queue_id, "Name": name} for queue_id, name in self.server.queues.items()])
+            return
+
+        match = re.fullmatch(r"/queues/(\w+)/calls/recordings", path)
+        if match:
+            query = parse_qs(url.query)
+            from_call_id = int(query.get("fromQueueCallId", ["0"])[0])
+            page_size = int(query[PAGE_SIZE_PARAMETER][0]) if PAGE_SIZE_PARAMETER in query else None
+            if self.server.behaviour.max_page_size:
+                page_size = min(page_size or self.server.behaviour.max_page_size, self.server.behaviour.max_page_size)
+            queue_name = self.server.queues.get(match.group(1))
+            calls = [recording["listing"] for call_id, recording in sorted(self.server.recordings.items())
+                     if call_id > from_call_id and recording["listing"]["QueueName"] == queue_name][:page_size]
+            time.sleep(len(calls) * self.server.behaviour.listing_seconds_per_call)
+            self._send_json(calls)
+            return
+
+        match = re.fullmatch(r"/queues/calls/recordings/(\d+)", path)
+        if match and int(match.group(1)) in self.server.recordings and int(match.group(1)) not in self.server.behaviour.missing_call_ids:
+            self._send_recording(int(match.group(1)))
+            return
+
+        self._send_json({"Message": "Not found"}, status=404)
+
+    def _send_recording(self, call_id: int) -> None:
+        self.server.record_event(call_id, "download_started")
+        size = self.server.recordings[call_id]["size"]
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        chunk = bytes([call_id % 256]) * CHUNK_SIZE
+        remaining = size
+        while remaining:
+            part = chunk[:min(CHUNK_SIZE, remaining)]
+            self._throttle(len(part))
+            self.wfile.write(part)
+            remaining -= len(part)
+
+
+class MockMiralixServer(_MockServer):
+    """A stand-in for the Miralix API.
+
+    Recordings are spread round robin over the queues, with call IDs from 'first_call_id'.
+    Downloads return generated bytes of the sampled size.
+    """
+
+    def __init__(self, queue_names: list[str], recording_count: int, size_sampler: Callable[[], int],
+                 behaviour: ServerBehaviour | None = None, first_call_id: int = 1):
+        super().__init__(_MiralixHandler, behaviour or ServerBehaviour())
+        self.queues = {str(i + 1): queue_name for i, queue_name in enumerate(queue_names)}
+        self.recordings = {}
+        self.events = {}
+        self.request_count = 0
+        self.add_recordings(recording_count, size_sampler, first_call_id)
+
+    def add_recordings(self, count: int, size_sampler: Callable[[], int], first_call_id: int | None = None) -> None:
+        """Add new recordings to the queues.
+
+        Args:
+            count: The number of recordings to add.
+            size_sampler: Function drawing the size of each recording.
+            first_call_id: The call ID of the first new recording. Defaults to after the highest existing ID.
+        """
+        queue_names = list(self.queues.values())
+        first_call_id = first_call_id or max(self.recordings, default=0) + 1
+        with self.lock:
+            for call_id in range(first_call_id, first_call_id + count):
+                size = size_sampler()
+                duration = round(size / AUDIO_BYTES_PER_SECOND)
+                self.recordings[call_id] = {
+                    "size": size,
+                    "listing": {
+                        "QueueCallId": call_id,
+                        "QueueName": queue_names[call_id % len(queue_names)],
+                        "ConversationStartedUtc": f"2024-01-01T{call_id // 3600 % 24:02}:{call_id // 60 % 60:02}:{call_id % 60:02}.0000000Z",
+                        "ConversationDuration": f"{duration // 3600:02}:{duration // 60 % 60:02}:{duration % 60:02}",
+                        "AgentName": f"Agent {call_id % 7}",
+                        "Caller": f"8{call_id:07}"
+                    }
+                }
+
+    def count_request(self) -> None:
+        """Count a request."""
+        with self.lock:
+            self.request_count += 1
+
+    def record_event(self, call_id: int, event: str) -> None:
+        """Note the time of the first occurrence of an event for a call."""
+        with self.lock:
+            self.events.setdefault(call_id, {}).setdefault(event, time.perf_counter())
+
+
+class _GetOrganizedHandler(_Handler):
+    server: "MockGetOrganizedServer"
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer the GetOrganized endpoints used with POST."""
+        self.server.count_request()
+        if self._delay_or_fail():
+            return
+
+        path = urlparse(self.path).path
+        if path == "/_goapi/Documents/AddToCase":
+            size, head = self._drain_body()
+            match = re.search(rb'"FileName": "([^"]*)"', head)
+            filename = match.group(1).decode("utf-8") if match else ""
+            doc_id = self.server.add_document(filename, size)
+            self._send_json({"DocId": doc_id})
+            return
+
+        self._drain_body()
+        if path == "/_goapi/Documents/Finalize/ByDocumentId":
+            self.server.count_finalize()
+        if path in ("/_goapi/Documents/Finalize/ByDocumentId", "/_goapi/Documents/UnmarkFinalizedByDocumentId",
+                    "/_goapi/Cases/", "/_goapi/Cases/CloseCase", "/_goapi/administration/Log"):
+            self._send_json({})
+            return
+
+        self._send_json({"Message": "Not found"}, status=404)
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Answer the HEAD request opening a connection, see get_organized_api.GetOrganizedClient.preauthenticate."""
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        """Answer the GetOrganized endpoints used with DELETE."""
+        self.server.count_request()
+        if self._delay_or_fail():
+            return
+        self._drain_body()
+        if urlparse(self.path).path == "/_goapi/Documents/ByDocumentId":
+            self._send_json({})
+            return
+        self._send_json({"Message": "Not found"}, status=404)
+
+
+class MockGetOrganizedServer(_MockServer):
+    """A stand-in for the GetOrganized API.
+    Uploads are counted by filename without keeping their content. No authentication is required.
+    """
+
+    def __init__(self, behaviour: ServerBehaviour | None = None, on_upload: Callable[[str], None] | None = None):
+        super().__init__(_GetOrganizedHandler, behaviour or ServerBehaviour())
+        self.documents = {}
+        self.upload_count = 0
+        self.finalize_count = 0
+        self.request_count = 0
+        self.on_upload = on_upload
+
+    def count_request(self) -> None:
+        """Count a request."""
+        with self.lock:
+            self.request_count += 1
+
+    def count_finalize(self) -> None:
+        """Count a finalized document."""
+        with self.lock:
+            self.finalize_count += 1
+
+    def add_document(self, filename: str, size: int) -> int:
+        """Register an uploaded document and return its document ID."""
+        with self.lock:
+            self.upload_count += 1
+            doc_id = self.documents.get(filename, {}).get("doc_id", len(self.documents) + 1)
+            self.documents[filename] = {"doc_id": doc_id, "body_size": size}
+        if self.on_upload:
+            self.on_upload(filename)
+        return doc_id
+
+
+@dataclass
+class MockBackends:
+    """A running pair of mock Miralix and GetOrganized servers, linked so upload times are noted per call."""
+    miralix: MockMiralixServer
+    get_organized: MockGetOrganizedServer
+    queue_names: list[str] = field(default_factory=list)
+
+    @classmethod
+    def start(cls, queue_names: list[str], recording_count: int, *, size_spec: str = "uniform:1:50",
+              miralix_behaviour: ServerBehaviour | None = None, get_organized_behaviour: ServerBehaviour | None = None,
+              seed: int = 0) -> "MockBackends":
+        """Start both servers.
+
+        Args:
+            queue_names: The names of the Miralix queues.
+            recording_count: The number of recordings in Miralix.
+            size_spec: The size distribution of recordings, see make_size_sampler.
+            miralix_behaviour: The behaviour of the Miralix server.
+            get_organized_behaviour: The behaviour of the GetOrganized server.
+            seed: Seed of the size distribution.
+
+        Returns:
+            The running backends.
+        """
+        miralix = MockMiralixServer(queue_names, recording_count, make_size_sampler(size_spec, seed), miralix_behaviour)
+
+        def on_upload(filename: str):
+            match = re.search(r"_(\d+)\.mp3$", filename)
+            if match:
+                miralix.record_event(int(match.group(1)), "upload_finished")
+
+        get_organized = MockGetOrganizedServer(get_organized_behaviour, on_upload)
+        return cls(miralix.start(), get_organized.start(), queue_names)
+
+    def latencies(self) -> list[float]:
+        """Get the seconds from the start of each download to the end of its first upload."""
+        return [events["upload_finished"] - events["download_started"] for events in self.miralix.events.values()
+                if "upload_finished" in events and "download_started" in events]
+
+    def first_upload(self) -> float | None:
+        """Get the perf_counter time when the first upload finished, or None if nothing was uploaded."""
+        return min((events["upload_finished"] for events in self.miralix.events.values() if "upload_finished" in events), default=None)
+
+    def stop(self) -> None:
+        """Stop both servers."""
+        self.miralix.stop()
+        self.get_organized.stop()
@@ -0,0 +1,388 @@
+"""Checks of robot behaviour that needs a particular setup or several runs, against in-process mock backends.
+
+Each check runs process.process with the fake OpenOrchestrator connection and prints whether it passed.
+The script exits with status 1 if any check fails.
+
+Run from the repository root, all checks or the named ones, e.g.:
+    python -m benchmarks.scenario_checks
+    python -m benchmarks.scenario_checks dry_run
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+from OpenOrchestrator.orchestrator_connection.connection import QueueStatus
+
+from robot_framework import config
+from robot_framework import leases
+from robot_framework import outbox
+from robot_framework import process
+from robot_framework import queue_util
+from robot_framework import sharding
+from robot_framework import upload_index
+from robot_framework import watermark
+from robot_framework.exceptions import BusinessError
+
+from benchmarks.mock_servers import MockBackends, ServerBehaviour
+from benchmarks.transfer_benchmark import QUEUE_NAMES, create_orchestrator, point_config_at
+
+CASE_NUMBER = "EMN-0000-000000"
+
+CHECKS: dict[str, Callable[[], list[str]]] = {}
+
+
+def check(function: Callable[[], list[str]]) -> Callable[[], list[str]]:
+    """Register a check. A check returns a description of each failure, and nothing if it passed."""
+    CHECKS[function.__name__] = function
+    return function
+
+
+@contextlib.contextmanager
+def mock_environment(recordings: int, miralix_behaviour: ServerBehaviour | None = None,
+                     get_organized_behaviour: ServerBehaviour | None = None) -> Iterator[MockBackends]:
+    """Start mock backends with some small recordings, and point the config at them and a temporary work directory."""
+    backends = MockBackends.start(QUEUE_NAMES, recordings, size_spec="fixed:0.1", miralix_behaviour=miralix_behaviour,
+                                  get_organized_behaviour=get_organized_behaviour)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            point_config_at(backends, work_dir)
+            yield backends
+    finally:
+        backends.stop()
+
+
+def raises_business_error(process_arguments: dict) -> bool:
+    """Check that a run with the process arguments stops with a BusinessError."""
+    try:
+        process.process(create_orchestrator(process_arguments))
+    except BusinessError:
+        return True
+    return False
+
+
+@check
+def dry_run() -> list[str]:
+    """A dry run of the plan transfers nothing and creates no queue elements on any engine,
+    and is rejected where it can't be honored.
+    """
+    failures = []
+    engines = {"threads": {}, "async": {"engine": "async"}, "outbox": {"outbox": True}}
+    for engine, arguments in engines.items():
+        with mock_environment(20) as backends:
+            orchestrator_connection = create_orchestrator({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES,
+                                                           "plan": {"dry_run": True}, **arguments})
+            process.process(orchestrator_connection)
+            if backends.get_organized.upload_count:
+                failures.append(f"{engine}: {backends.get_organized.upload_count} uploads in a dry run")
+            if sum(orchestrator_connection.status_counts(config.QUEUE_NAME).values()):
+                failures.append(f"{engine}: queue elements were created in a dry run")
+            if not any(message.startswith("Run plan") for _, message in orchestrator_connection.logs):
+                failures.append(f"{engine}: no plan was logged")
+
+    with mock_environment(20) as backends:
+        if not raises_business_error({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES,
+                                      "plan": {"dry_run": True}, "backfill": {"to_call_id": 100}}):
+            failures.append("backfill: a plan with a backfill wasn't rejected")
+        if not raises_business_error({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES,
+                                      "plan": {"dry_run": True}, "daemon": {"run_minutes": 0.1}}):
+            failures.append("daemon: a dry run in daemon mode wasn't rejected")
+        if backends.get_organized.upload_count:
+            failures.append(f"backfill and daemon: {backends.get_organized.upload_count} uploads in a dry run")
+    return failures
+
+
+@check
+def permanent_failure() -> list[str]:
+    """A recording that always fails is given up after config.MAX_TRANSFER_ATTEMPTS runs, so the watermark moves past it
+    and later runs neither list it again nor upload anything twice.
+    """
+    failures = []
+    missing_call_id = 4
+    max_attempts, abandon_after_hours = config.MAX_TRANSFER_ATTEMPTS, config.ABANDON_AFTER_HOURS
+    config.MAX_TRANSFER_ATTEMPTS, config.ABANDON_AFTER_HOURS = 3, 0
+    try:
+        with mock_environment(12, ServerBehaviour(missing_call_ids=(missing_call_id,))) as backends:
+            orchestrator_connection = create_orchestrator({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES})
+            for run in range(1, config.MAX_TRANSFER_ATTEMPTS + 2):
+                try:
+                    process.process(orchestrator_connection)
+                    error = None
+                except RuntimeError as exception:
+                    error = exception
+                if run <= config.MAX_TRANSFER_ATTEMPTS and error is None:
+                    failures.append(f"run {run}: the failing recording didn't fail the run")
+                if run > config.MAX_TRANSFER_ATTEMPTS and error is not None:
+                    failures.append(f"run {run}: the given up recording was tried again: {error!r}")
+
+            queue_elements = orchestrator_connection.get_queue_elements(config.QUEUE_NAME, reference=str(missing_call_id))
+            if not any(queue_element.status == QueueStatus.ABANDONED for queue_element in queue_elements):
+                failures.append(f"the failing recording wasn't given up: {[queue_element.message for queue_element in queue_elements]}")
+            queue_name = backends.miralix.recordings[missing_call_id]["listing"]["QueueName"]
+            watermarks = watermark.load_watermarks(sharding.create_watermark_store(orchestrator_connection, None), QUEUE_NAMES, orchestrator_connection)
+            if watermarks.get(queue_name, 0) <= missing_call_id:
+                failures.append(f"the watermark of '{queue_name}' is stuck at {watermarks.get(queue_name)}")
+            if backends.get_organized.upload_count != len(backends.get_organized.documents):
+                failures.append(f"{backends.get_organized.upload_count - len(backends.get_organized.documents)} duplicate uploads")
+            if len(backends.get_organized.documents) != len(backends.miralix.recordings) - 1:
+                failures.append(f"{len(backends.get_organized.documents)} documents uploaded of {len(backends.miralix.recordings) - 1}")
+    finally:
+        config.MAX_TRANSFER_ATTEMPTS, config.ABANDON_AFTER_HOURS = max_attempts, abandon_after_hours
+    return failures
+
+
+@check
+def lease_takeover_race() -> list[str]:
+    """Of several workers taking over the same expired lease at once, at most one keeps it."""
+    failures = []
+    orchestrator_connection = create_orchestrator({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES})
+    queue_element = orchestrator_connection.create_queue_element(config.QUEUE_NAME, reference="1")
+    orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.IN_PROGRESS, leases.lease_message("stalled worker"))
+    orchestrator_connection.queue_elements[str(queue_element.id)].start_date = datetime.now() - timedelta(seconds=2 * config.LEASE_SECONDS)
+    listed = orchestrator_connection.get_queue_elements(config.QUEUE_NAME, reference="1")[0]
+
+    #  The reads take as long as a database query to return, so the workers read the expired lease before any of them writes
+    read = orchestrator_connection.get_queue_elements
+
+    def slow_read(*args, **kwargs):
+        queue_elements = read(*args, **kwargs)
+        time.sleep(0.2)
+        return queue_elements
+    orchestrator_connection.get_queue_elements = slow_read
+
+    keepers = [leases.LeaseKeeper(orchestrator_connection, f"worker {i}") for i in range(4)]
+    with ThreadPoolExecutor(max_workers=len(keepers)) as executor:
+        taken = list(executor.map(lambda keeper: keeper.acquire(listed), keepers))
+    if sum(taken) != 1:
+        failures.append(f"{sum(taken)} workers took over the expired lease, instead of one")
+    return failures
+
+
+@check
+def backfill_range_end() -> list[str]:
+    """A backfill with a "to_call_id" or a "to_date" transfers the recordings before it and stops listing there
+    instead of listing up to the present.
+    """
+    failures = []
+    recordings, to_call_id = 240, 25
+    #  The mock recordings start a second apart from midnight, by call ID
+    ranges = {"to_call_id": {"to_call_id": to_call_id}, "to_date": {"to_date": f"2024-01-01T00:00:{to_call_id}"}}
+    page_size = config.MIRALIX_PAGE_SIZE
+    config.MIRALIX_PAGE_SIZE = 5
+    try:
+        for name, backfill_range in ranges.items():
+            with mock_environment(recordings) as backends:
+                process.process(create_orchestrator({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES, "backfill": backfill_range}))
+                if len(backends.get_organized.documents) != to_call_id - 1:
+                    failures.append(f"{name}: {len(backends.get_organized.documents)} documents uploaded of {to_call_id - 1}")
+                #  The requests that aren't downloads of the uploaded recordings are listings
+                listing_requests = backends.miralix.request_count - backends.get_organized.upload_count
+                if listing_requests >= recordings / config.MIRALIX_PAGE_SIZE / 2:
+                    failures.append(f"{name}: {listing_requests} listing requests, the listing didn't stop at the end of the range")
+    finally:
+        config.MIRALIX_PAGE_SIZE = page_size
+    return failures
+
+
+@check
+def backfill_windows() -> list[str]:
+    """The windows of a backfill are each listed from their own first call ID and checkpointed when transferred,
+    so a backfill that is run again lists nothing.
+    """
+    failures = []
+    arguments = {"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES, "backfill": {"to_call_id": 101, "window_size": 20}}
+    with mock_environment(240) as backends:
+        process.process(create_orchestrator(arguments))
+        if len(backends.get_organized.documents) != 100:
+            failures.append(f"{len(backends.get_organized.documents)} documents uploaded of 100")
+        requests = backends.miralix.request_count
+        process.process(create_orchestrator(arguments))
+        if backends.miralix.request_count != requests:
+            failures.append(f"the finished backfill made {backends.miralix.request_count - requests} requests when run again")
+    return failures
+
+
+@check
+def short_listing_pages() -> list[str]:
+    """Every recording is transferred when Miralix returns shorter pages than asked for, on both engines."""
+    failures = []
+    page_size = config.MIRALIX_PAGE_SIZE
+    config.MIRALIX_PAGE_SIZE = 10
+    try:
+        for engine in ("threads", "async"):
+            with mock_environment(60, ServerBehaviour(max_page_size=4)) as backends:
+                process.process(create_orchestrator({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES, "engine": engine}))
+                if len(backends.get_organized.documents) != 60:
+                    failures.append(f"{engine}: {len(backends.get_organized.documents)} documents uploaded of 60")
+    finally:
+        config.MIRALIX_PAGE_SIZE = page_size
+    return failures
+
+
+@check
+def shared_upload_index() -> list[str]:
+    """Runs sharing the upload index, e.g. a backfill and the regular run, keep each other's uploads when they save."""
+    failures = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "go_upload_index.json")
+        earlier = upload_index.UploadIndex(path)
+        earlier.add(CASE_NUMBER, "earlier.mp3", "0" * 64, 1, 1)
+        earlier.save()
+
+        backfill_index, nightly_index = upload_index.UploadIndex(path), upload_index.UploadIndex(path)
+        backfill_index.add(CASE_NUMBER, "backfill.mp3", "1" * 64, 2, 2)
+        nightly_index.add(CASE_NUMBER, "nightly.mp3", "2" * 64, 3, 3)
+        backfill_index.save()
+        nightly_index.save()
+
+        saved = upload_index.UploadIndex(path).entries
+        for filename in ("earlier.mp3", "backfill.mp3", "nightly.mp3"):
+            if upload_index.UploadIndex.key(CASE_NUMBER, filename) not in saved:
+                failures.append(f"{filename} is missing from the saved index")
+        if os.path.exists(f"{path}.lock"):
+            failures.append("the lock file was left behind")
+    return failures
+
+
+@check
+def outbox_full() -> list[str]:
+    """When the outbox stays full, only the recordings already waiting for space wait out config.OUTBOX_FULL_TIMEOUT,
+    and the rest are left for the next run right away. The files of the outbox are named by the case and the call ID.
+    """
+    failures = []
+    settings = config.OUTBOX_MAX_BYTES, config.OUTBOX_FULL_TIMEOUT, config.OUTBOX_DRAIN_TIMEOUT, config.MIRALIX_DOWNLOAD_WORKERS
+    config.OUTBOX_MAX_BYTES, config.OUTBOX_FULL_TIMEOUT, config.OUTBOX_DRAIN_TIMEOUT, config.MIRALIX_DOWNLOAD_WORKERS = 250_000, 1, 1, 2
+    try:
+        #  GetOrganized fails every upload, so the outbox never empties
+        with mock_environment(30, get_organized_behaviour=ServerBehaviour(error_rate=1.0)):
+            orchestrator_connection = create_orchestrator({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES, "outbox": True})
+            process.process(orchestrator_connection)
+            postponed = [queue_element.message for queue_element in orchestrator_connection.get_queue_elements(config.QUEUE_NAME)
+                         if queue_element.message and "outbox" in queue_element.message]
+            waited = sum(1 for message in postponed if "no space" in message)
+            if not postponed:
+                failures.append("no recordings were left for the next run")
+            if waited > config.MIRALIX_DOWNLOAD_WORKERS:
+                failures.append(f"{waited} recordings waited for space, more than the {config.MIRALIX_DOWNLOAD_WORKERS} storing at once")
+            names = os.listdir(os.path.join(config.OUTBOX_DIR, "0"))
+            if not names or not all(name.startswith(f"{CASE_NUMBER}_") for name in names):
+                failures.append(f"the outbox files aren't named by the case: {sorted(names)}")
+    finally:
+        config.OUTBOX_MAX_BYTES, config.OUTBOX_FULL_TIMEOUT, config.OUTBOX_DRAIN_TIMEOUT, config.MIRALIX_DOWNLOAD_WORKERS = settings
+    return failures
+
+
+@check
+def outbox_shared_folder() -> list[str]:
+    """Processes sharing the folder of the outbox each keep their own entries and files,
+    and the entries of a process that stopped are taken over by the next process to open the outbox.
+    """
+    failures = []
+    recording = {"QueueCallId": 1}
+    with tempfile.TemporaryDirectory() as directory:
+        first, second = outbox.Outbox(directory), outbox.Outbox(directory)
+        first.put(recording, CASE_NUMBER, b"data")
+        if first.directory == second.directory:
+            failures.append("two outboxes share a slot")
+        if second.claim(CASE_NUMBER, 0):
+            failures.append("an entry of one outbox was claimed by another")
+        with open(os.path.join(second.directory, "partial.tmp"), "wb") as file:
+            file.write(b"data being stored")
+
+        first.close()
+        third = outbox.Outbox(directory)
+        entry = third.claim(CASE_NUMBER, 0)
+        if not entry:
+            failures.append("the entries of a closed outbox weren't taken over")
+        else:
+            #  Evicting an entry whose files are gone doesn't fail
+            os.remove(third._paths(entry)[0])  # pylint: disable=protected-access
+            third.complete(entry)
+        if not os.path.exists(os.path.join(second.directory, "partial.tmp")):
+            failures.append("opening an outbox removed a file of another process")
+        second.close()
+        third.close()
+    return failures
+
+
+@check
+def daemon_outbox() -> list[str]:
+    """In daemon mode with the outbox, the polls go on while GetOrganized is down instead of each draining the outbox."""
+    failures = []
+    drain_timeout = config.OUTBOX_DRAIN_TIMEOUT
+    config.OUTBOX_DRAIN_TIMEOUT = 2
+    try:
+        with mock_environment(6, get_organized_behaviour=ServerBehaviour(error_rate=1.0)):
+            orchestrator_connection = create_orchestrator({"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES, "outbox": True,
+                                                           "daemon": {"interval_seconds": 0.2, "max_interval_seconds": 0.4,
+                                                                      "jitter": 0, "run_minutes": 0.05}})
+            process.process(orchestrator_connection)
+            stopped = [message for _, message in orchestrator_connection.logs if message.startswith("Daemon stopped")]
+            #  Draining on every poll allows only one or two polls in 3 seconds
+            if not stopped or int(stopped[0].split()[3]) < 5:
+                failures.append(f"the polls waited for the outbox to drain: {stopped}")
+    finally:
+        config.OUTBOX_DRAIN_TIMEOUT = drain_timeout
+    return failures
+
+
+@check
+def daemon_failing_recording() -> list[str]:
+    """In daemon mode a recording that keeps failing doesn't fail the polls, and its queue backs off like an idle queue.
+    The job queue is scanned once instead of on every poll.
+    """
+    failures = []
+    missing_call_id = 4
+    max_failed_polls = config.DAEMON_MAX_FAILED_POLLS
+    config.DAEMON_MAX_FAILED_POLLS = 2
+    try:
+        with mock_environment(12, ServerBehaviour(missing_call_ids=(missing_call_id,))) as backends:
+            queue_name = backends.miralix.recordings[missing_call_id]["listing"]["QueueName"].strip()
+            orchestrator_connection = create_orchestrator({"case_number": CASE_NUMBER, "target_queues": [queue_name],
+                                                           "daemon": {"interval_seconds": 0.1, "max_interval_seconds": 0.8,
+                                                                      "jitter": 0, "run_minutes": 0.05}})
+            try:
+                process.process(orchestrator_connection)
+            except RuntimeError as error:
+                failures.append(f"the failing recording stopped the daemon: {error!r}")
+
+            queue_elements = orchestrator_connection.get_queue_elements(config.QUEUE_NAME, reference=str(missing_call_id))
+            attempts = [queue_element.message for queue_element in queue_elements]
+            #  Backing off from 0.1 to 0.8 seconds allows about 7 polls in 3 seconds, against 30 at the base interval
+            if not queue_elements or queue_util.failed_attempts(queue_elements[0]) > 10:
+                failures.append(f"the queue of the failing recording didn't back off: {attempts}")
+            scans = orchestrator_connection.calls["get_queue_elements"]
+            if scans > 10:
+                failures.append(f"the job queue was read {scans} times")
+    finally:
+        config.DAEMON_MAX_FAILED_POLLS = max_failed_polls
+    return failures
+
+
+def main():
+    """Parse arguments, run the checks and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("checks", nargs="*", metavar="CHECK", help=f"The checks to run, of {', '.join(CHECKS)}. Defaults to all.")
+    args = parser.parse_args()
+    unknown = set(args.checks) - set(CHECKS)
+    if unknown:
+        parser.error(f"Unknown checks: {', '.join(sorted(unknown))}")
+
+    failed = False
+    for name in args.checks or CHECKS:
+        failures = CHECKS[name]()
+        print(f"{name}: {'FAILED' if failures else 'passed'}")
+        for failure in failures:
+            print(f"  {failure}")
+        failed |= bool(failures)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
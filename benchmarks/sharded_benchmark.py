@@ -0,0 +1,152 @@
+"""Benchmark of several sharded robot workers sharing a job queue in a local SQLite OpenOrchestrator database.
+
+Each worker is a separate process running process.process with its own "shard" process argument,
+against the same mock Miralix and GetOrganized servers. The benchmark reports recordings per second
+and counts duplicate uploads, which should be 0.
+
+With --stalled N, N recordings of the first shard are left 'In Progress' by a worker that never
+finishes them, and the first shard isn't run. The second shard should take them over once the lease expires.
+
+Run from the repository root, e.g.:
+    python -m benchmarks.sharded_benchmark --workers 3 --recordings 300 --latency 0.02
+    python -m benchmarks.sharded_benchmark --workers 3 --recordings 300 --stalled 10 --lease-seconds 2
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from OpenOrchestrator.orchestrator_connection.connection import QueueStatus
+
+from robot_framework import config
+from robot_framework import leases
+from robot_framework import process
+from robot_framework import sharding
+
+from benchmarks import sqlite_orchestrator
+from benchmarks.mock_servers import MB, MockBackends, ServerBehaviour
+from benchmarks.transfer_benchmark import QUEUE_NAMES
+
+CASE_NUMBER = "EMN-0000-000000"
+
+
+def run_worker(conn_string: str, crypto_key: str, process_arguments: dict, urls: tuple[str, str], work_dir: str, *,
+               lease_seconds: float) -> dict:
+    """Run one worker in this process. Each worker keeps its local files in its own folder, like a separate host."""
+    os.makedirs(work_dir, exist_ok=True)
+    config.MIRALIX_BASE_URL, config.GO_API = urls
+    config.WATERMARK_BACKEND = "constant"
+    config.LEASE_SECONDS = lease_seconds
+    config.MIRALIX_QUEUE_CACHE_FILE = os.path.join(work_dir, "miralix_queues.json")
+    config.METRICS_DIR = os.path.join(work_dir, "run_metrics")
+    config.GO_UPLOAD_INDEX_FILE = os.path.join(work_dir, "go_upload_index.json")
+
+    orchestrator_connection = sqlite_orchestrator.connect(conn_string, crypto_key, process_arguments)
+    start = time.perf_counter()
+    error = None
+    try:
+        process.process(orchestrator_connection)
+    # The benchmark reports errors instead of stopping.
+    # pylint: disable-next = broad-exception-caught
+    except Exception as exception:
+        error = repr(exception)
+    return {"shard": process_arguments["shard"]["index"], "seconds": round(time.perf_counter() - start, 2), "error": error}
+
+
+def stall_recordings(conn_string: str, crypto_key: str, backends: MockBackends, shard: sharding.Shard, count: int) -> list[str]:
+    """Leave the first recordings of a shard 'In Progress', leased by a worker that has stopped.
+
+    Returns:
+        The references of the stalled queue elements.
+    """
+    orchestrator_connection = sqlite_orchestrator.connect(conn_string, crypto_key, {})
+    references = [str(call_id) for call_id, recording in sorted(backends.miralix.recordings.items())
+                  if shard.owns(recording["listing"])][:count]
+    orchestrator_connection.bulk_create_queue_elements(config.QUEUE_NAME, tuple(references), tuple(references), "stalled-worker")
+    for queue_element in orchestrator_connection.get_queue_elements(config.QUEUE_NAME, limit=len(references)):
+        orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.IN_PROGRESS, leases.lease_message("stalled-worker"))
+    return references
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Run the benchmark once and return the results."""
+    backends = MockBackends.start(QUEUE_NAMES, args.recordings, size_spec=args.sizes,
+                                  miralix_behaviour=ServerBehaviour(args.latency, args.bandwidth * MB),
+                                  get_organized_behaviour=ServerBehaviour(args.latency, args.bandwidth * MB),
+                                  seed=args.seed)
+    shards = [sharding.Shard(i, args.workers, args.by, f"worker-{i + 1}") for i in range(args.workers)]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        #  Every shard starts from call ID 0 in every queue
+        conn_string, crypto_key = sqlite_orchestrator.create_database(
+            os.path.join(work_dir, "orchestrator.db"),
+            credentials={config.MIRALIX_SHARED_KEY: ("", "shared key"), config.GO_CREDENTIALS: ("user", "password")},
+            constants={config.ERROR_EMAIL: "robot@example.com",
+                       **{f"{config.WATERMARK_CONSTANT} {shard.label}": json.dumps(dict.fromkeys(QUEUE_NAMES, 0)) for shard in shards}})
+
+        running = shards
+        stalled = []
+        if args.stalled:
+            stalled = stall_recordings(conn_string, crypto_key, backends, shards[0], args.stalled)
+            running = shards[1:]
+            time.sleep(args.lease_seconds)
+
+        start = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=len(running), mp_context=context) as executor:
+            futures = [executor.submit(run_worker, conn_string, crypto_key,
+                                       {"case_number": CASE_NUMBER, "target_queues": QUEUE_NAMES,
+                                        "shard": {"index": shard.index, "count": shard.count, "by": shard.by, "worker_id": shard.worker_id}},
+                                       (backends.miralix.url, backends.get_organized.url), os.path.join(work_dir, shard.label),
+                                       lease_seconds=args.lease_seconds)
+                       for shard in running]
+            workers = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+        orchestrator_connection = sqlite_orchestrator.connect(conn_string, crypto_key, {})
+        statuses = {status.value: len(orchestrator_connection.get_queue_elements(config.QUEUE_NAME, status=status, limit=10**9))
+                    for status in QueueStatus}
+    backends.stop()
+
+    expected = sum(1 for recording in backends.miralix.recordings.values()
+                   if any(shard.owns(recording["listing"]) for shard in running))
+    uploaded = len(backends.get_organized.documents)
+    return {
+        "workers": len(running),
+        "shard_by": args.by,
+        "recordings": args.recordings,
+        "expected_uploads": expected + len(stalled),
+        "seconds": round(elapsed, 2),
+        "recordings_per_second": round(uploaded / elapsed, 2),
+        "documents": uploaded,
+        "duplicate_uploads": backends.get_organized.upload_count - uploaded,
+        "stalled_taken_over": sum(1 for reference in stalled
+                                  if any(document.endswith(f"_{reference}.mp3") for document in backends.get_organized.documents)),
+        "statuses": statuses,
+        "worker_results": workers
+    }
+
+
+def main():
+    """Parse arguments, run the benchmark and print the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3, help="Number of workers, one per shard.")
+    parser.add_argument("--by", choices=sharding.SHARD_KEYS, default="call_id", help="What the recordings are sharded by.")
+    parser.add_argument("--recordings", type=int, default=300, help="Number of recordings in Miralix.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the recording sizes.")
+    parser.add_argument("--sizes", default="uniform:1:5", help="Recording sizes in MB: fixed:S, uniform:MIN:MAX or lognormal:MU:SIGMA.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency per request on both backends.")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="MB per second per connection. 0 is unlimited.")
+    parser.add_argument("--stalled", type=int, default=0, help="Number of recordings of the first shard left 'In Progress' by a stopped worker.")
+    parser.add_argument("--lease-seconds", type=float, default=2.0, help="The length of a lease.")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""A local OpenOrchestrator database in SQLite, for running several robot workers against a shared job queue.
+
+Unlike benchmarks/fake_orchestrator.py this is the real OrchestratorConnection, so queue elements,
+constants and logs are shared between processes like they are with an OpenOrchestrator server.
+"""
+
+import json
+
+from OpenOrchestrator.common import crypto_util
+from OpenOrchestrator.database import db_util
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+
+def create_database(path: str, credentials: dict[str, tuple[str, str]], constants: dict[str, str]) -> tuple[str, str]:
+    """Create an OpenOrchestrator database in a SQLite file.
+
+    Args:
+        path: The path of the database file.
+        credentials: A dict of credential names to usernames and passwords.
+        constants: A dict of constant names to values.
+
+    Returns:
+        The connection string and the crypto key of the database.
+    """
+    conn_string = f"sqlite:///{path}"
+    crypto_key = crypto_util.generate_key().decode()
+    connect(conn_string, crypto_key, {})
+    db_util.initialize_database()
+    for name, (username, password) in credentials.items():
+        db_util.create_credential(name, username, password)
+    for name, value in constants.items():
+        db_util.create_constant(name, value)
+    return conn_string, crypto_key
+
+
+def connect(conn_string: str, crypto_key: str, process_arguments: dict, process_name: str = "Miralix Benchmark") -> OrchestratorConnection:
+    """Connect to an OpenOrchestrator database, like OpenOrchestrator does when it starts a robot.
+
+    Args:
+        conn_string: The connection string of the database.
+        crypto_key: The crypto key of the database.
+        process_arguments: The process arguments of the robot.
+        process_name: The name of the process.
+
+    Returns:
+        The connection.
+    """
+    return OrchestratorConnection(process_name, conn_string, crypto_key, json.dumps(process_arguments))
@@ -0,0 +1,170 @@
+"""End-to-end benchmark of process.process against in-process mock backends.
+
+Reports recordings per second, p50/p99 latency per recording (from the start of its
+download to the end of its upload) and peak RSS of the process.
+
+Run from the repository root, e.g.:
+    python -m benchmarks.transfer_benchmark --recordings 200 --sizes uniform:1:10 --latency 0.05
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from robot_framework import config
+from robot_framework import process
+from robot_framework import rate_limit
+
+from benchmarks.fake_orchestrator import FakeOrchestratorConnection
+from benchmarks.mock_servers import MB, MockBackends, ServerBehaviour
+
+QUEUE_NAMES = [f"8940000{i} Benchmark queue {i}" for i in range(6)]
+
+
+def peak_rss_bytes() -> int | None:
+    """Get the peak resident set size of this process in bytes, if the platform supports it."""
+    if sys.platform == "win32":
+        # pylint: disable-next = import-outside-toplevel
+        import ctypes
+        from ctypes import wintypes  # pylint: disable=import-outside-toplevel
+
+        class ProcessMemoryCounters(ctypes.Structure):  # pylint: disable=too-few-public-methods
+            """PROCESS_MEMORY_COUNTERS from psapi.h."""
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD), ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t), ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t), ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t), ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters(cb=ctypes.sizeof(ProcessMemoryCounters))
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return None
+
+    try:
+        # pylint: disable-next = import-outside-toplevel
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Get a percentile of a list of values using the nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def create_orchestrator(process_arguments: dict) -> FakeOrchestratorConnection:
+    """Create a fake OpenOrchestrator connection with the credentials and constants the robot needs."""
+    return FakeOrchestratorConnection("Miralix Benchmark", json.dumps(process_arguments),
+                                      credentials={config.MIRALIX_SHARED_KEY: ("", "shared key"),
+                                                   config.GO_CREDENTIALS: ("user", "password")},
+                                      constants={config.WATERMARK_CONSTANT: "", config.ERROR_EMAIL: "robot@example.com"})
+
+
+def point_config_at(backends: MockBackends, work_dir: str) -> None:
+    """Point the robot's config at the mock backends and keep local files in a work directory."""
+    config.MIRALIX_BASE_URL = backends.miralix.url
+    config.GO_API = backends.get_organized.url
+    config.MIRALIX_QUEUE_CACHE_FILE = os.path.join(work_dir, "miralix_queues.json")
+    config.WATERMARK_FILE = os.path.join(work_dir, "miralix_watermark.json")
+    config.METRICS_DIR = os.path.join(work_dir, "run_metrics")
+    config.GO_UPLOAD_INDEX_FILE = os.path.join(work_dir, "go_upload_index.json")
+    config.OUTBOX_DIR = os.path.join(work_dir, "miralix_outbox")
+    config.BACKFILL_CHECKPOINT_FILE = os.path.join(work_dir, "miralix_backfill.json")
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Run the benchmark once and return the results."""
+    backends = MockBackends.start(QUEUE_NAMES, args.recordings, size_spec=args.sizes,
+                                  miralix_behaviour=ServerBehaviour(args.latency, args.bandwidth * MB, args.miralix_error_rate,
+                                                                    args.max_concurrency, listing_seconds_per_call=args.listing_ms_per_call / 1000),
+                                  get_organized_behaviour=ServerBehaviour(args.latency, args.bandwidth * MB, args.go_error_rate,
+                                                                          args.max_concurrency),
+                                  seed=args.seed)
+    process_arguments = {"case_number": "EMN-0000-000000", "target_queues": QUEUE_NAMES}
+    if args.engine == "async":
+        process_arguments["engine"] = "async"
+    if args.journalize:
+        process_arguments["journalize"] = True
+    if args.outbox:
+        process_arguments["outbox"] = True
+    if args.plan:
+        process_arguments["plan"] = {"estimate": args.plan, "dry_run": args.dry_run}
+    orchestrator_connection = create_orchestrator(process_arguments)
+    config.MIRALIX_PAGE_SIZE = args.page_size
+
+    error = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        point_config_at(backends, work_dir)
+        start = time.perf_counter()
+        try:
+            process.process(orchestrator_connection)
+        # The benchmark reports errors instead of stopping.
+        # pylint: disable-next = broad-exception-caught
+        except Exception as exception:
+            error = repr(exception)
+        elapsed = time.perf_counter() - start
+    first_upload = backends.first_upload()
+    backends.stop()
+
+    latencies = backends.latencies()
+    total_bytes = sum(recording["size"] for recording in backends.miralix.recordings.values())
+    statuses = orchestrator_connection.status_counts(config.QUEUE_NAME)
+    peak_rss = peak_rss_bytes()
+    return {
+        "engine": args.engine,
+        "recordings": args.recordings,
+        "seconds": round(elapsed, 2),
+        "recordings_per_second": round(args.recordings / elapsed, 2),
+        "mb_per_second": round(total_bytes / MB / elapsed, 2),
+        "first_upload_seconds": round(first_upload - start, 3) if first_upload else None,
+        "latency_p50": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "latency_p99": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "latency_mean": round(statistics.mean(latencies), 3) if latencies else None,
+        "peak_rss_mb": round(peak_rss / MB, 1) if peak_rss else None,
+        "uploads": backends.get_organized.upload_count,
+        "journalized": backends.get_organized.finalize_count,
+        "statuses": {status.value: count for status, count in statuses.items()},
+        "orchestrator_calls": dict(orchestrator_connection.calls),
+        "miralix_requests": backends.miralix.request_count,
+        "get_organized_requests": backends.get_organized.request_count,
+        "throttled_requests": backends.miralix.throttled_count + backends.get_organized.throttled_count,
+        "limits": rate_limit.snapshots(),
+        "plan": next((message for _, message in orchestrator_connection.logs if message.startswith("Run plan")), None),
+        "error": error
+    }
+
+
+def main():
+    """Parse arguments, run the benchmark and print the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recordings", type=int, default=100, help="Number of recordings in Miralix.")
+    parser.add_argument("--sizes", default="uniform:1:10", help="Recording sizes in MB: fixed:S, uniform:MIN:MAX or lognormal:MU:SIGMA.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency per request on both backends.")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="MB per second per connection. 0 is unlimited.")
+    parser.add_argument("--miralix-error-rate", type=float, default=0.0, help="Probability of a 503 from Miralix.")
+    parser.add_argument("--go-error-rate", type=float, default=0.0, help="Probability of a 503 from GetOrganized.")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests per backend at once before it answers 429. 0 is unlimited.")
+    parser.add_argument("--engine", choices=("threads", "async"), default="threads")
+    parser.add_argument("--journalize", action="store_true", help="Journalize the uploaded documents after the run.")
+    parser.add_argument("--outbox", action="store_true", help="Transfer through the outbox.")
+    parser.add_argument("--plan", choices=("duration", "head"), help="Plan the run largest first, estimating sizes this way.")
+    parser.add_argument("--dry-run", action="store_true", help="Only log the plan. Needs --plan.")
+    parser.add_argument("--listing-ms-per-call", type=float, default=0.0, help="Extra milliseconds per call in a Miralix queue listing.")
+    parser.add_argument("--page-size", type=int, default=config.MIRALIX_PAGE_SIZE, help="Recordings per page of the Miralix listing.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
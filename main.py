@@ -1,17 +1,154 @@
 """The main file of the robot which will install all requirements in
 a virtual environment and then start the actual process.
+
+The virtual environment is reused between runs as long as the fingerprint of
+pyproject.toml, any lock files and the Python interpreter is unchanged.
+On a mismatch it's rebuilt in a new folder which is then swapped in,
+so a failed install never leaves a broken .venv behind. If .venv is in use and can't be swapped,
+the new folder is used until a later start swaps it in. Builds hold a lock file naming the process,
+so runs that start at the same time don't build or clean up over each other.
 """
 
-import subprocess
+import hashlib
 import os
+import shutil
+import subprocess
 import sys
+import time
+
+# Only the standard library can be used before the virtual environment exists, which robot_framework.locks keeps to
+from robot_framework import locks
+
+VENV_DIR = ".venv"
+FINGERPRINT_FILE = "bootstrap_fingerprint.txt"
+FINGERPRINTED_FILES = ("pyproject.toml", "requirements.txt", "requirements.lock", "pylock.toml", "uv.lock")
+BUILD_LOCK = ".venv.lock"
+# The folder of a build that couldn't be swapped in, used until it is.
+FALLBACK_FILE = ".venv-fallback.txt"
+# Folders left by earlier builds are removed once they are this old, since a run may still be running from one.
+STALE_BUILD_SECONDS = 24 * 60 * 60
+# A build lock whose process has stopped is taken over at once. One taken on another machine sharing the folder
+# is taken over once it's older than a build takes.
+STALE_BUILD_LOCK_SECONDS = 30 * 60
+
+
+def venv_python(venv_dir: str) -> str:
+    """Get the path of the Python executable in a virtual environment."""
+    if os.name == "nt":
+        return os.path.join(venv_dir, "Scripts", "python.exe")
+    return os.path.join(venv_dir, "bin", "python")
+
+
+def fingerprint() -> str:
+    """Get a hash of the files defining the dependencies and of the Python interpreter."""
+    hasher = hashlib.sha256(f"{sys.executable}\n{sys.version}\n".encode("utf-8"))
+    for name in FINGERPRINTED_FILES:
+        if os.path.exists(name):
+            hasher.update(name.encode("utf-8"))
+            with open(name, "rb") as file:
+                hasher.update(file.read())
+    return hasher.hexdigest()
+
+
+def read_fingerprint(venv_dir: str) -> str | None:
+    """Read the fingerprint a virtual environment was built with, if it's complete."""
+    path = os.path.join(venv_dir, FINGERPRINT_FILE)
+    if not os.path.exists(path) or not os.path.exists(venv_python(venv_dir)):
+        return None
+    with open(path, encoding="utf-8") as file:
+        return file.read().strip()
+
+
+def build_venv(venv_dir: str, new_fingerprint: str) -> None:
+    """Create a virtual environment, install the robot in it and write its fingerprint last."""
+    shutil.rmtree(venv_dir, ignore_errors=True)
+    subprocess.run([sys.executable, "-m", "venv", venv_dir], check=True)
+    # pip is run as a module, since console scripts keep the path of the folder they were built in
+    subprocess.run([venv_python(venv_dir), "-m", "pip", "install", "."], check=True)
+    with open(os.path.join(venv_dir, FINGERPRINT_FILE), "w", encoding="utf-8") as file:
+        file.write(new_fingerprint)
+
+
+def swap_venv(new_dir: str) -> str:
+    """Replace .venv with a newly built virtual environment. If .venv is in use and can't be moved,
+    the new folder is kept in FALLBACK_FILE, so the next start runs from it and tries the swap again.
+
+    Returns:
+        The folder to run from. This is the new folder itself if .venv can't be moved.
+    """
+    old_dir = f"{VENV_DIR}-old-{os.getpid()}"
+    try:
+        if os.path.exists(VENV_DIR):
+            os.rename(VENV_DIR, old_dir)
+        os.rename(new_dir, VENV_DIR)
+    except OSError as error:
+        print(f"Couldn't swap in the new virtual environment, running from {new_dir}: {error}")
+        with open(FALLBACK_FILE, "w", encoding="utf-8") as file:
+            file.write(new_dir)
+        return new_dir
+    if os.path.exists(FALLBACK_FILE):
+        os.remove(FALLBACK_FILE)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return VENV_DIR
+
+
+def read_fallback() -> str | None:
+    """Read the folder of a build that couldn't be swapped in, if any."""
+    if not os.path.exists(FALLBACK_FILE):
+        return None
+    with open(FALLBACK_FILE, encoding="utf-8") as file:
+        return file.read().strip()
+
+
+def remove_stale_builds() -> None:
+    """Remove folders left behind by earlier builds that crashed or couldn't be swapped in,
+    once they are older than STALE_BUILD_SECONDS.
+    """
+    for name in os.listdir("."):
+        if name.startswith((f"{VENV_DIR}-new-", f"{VENV_DIR}-old-")) and time.time() - os.path.getmtime(name) > STALE_BUILD_SECONDS:
+            shutil.rmtree(name, ignore_errors=True)
+
+
+def bootstrap() -> tuple[str, bool]:
+    """Make sure an up to date virtual environment exists.
+
+    Returns:
+        The folder of the virtual environment and whether it was rebuilt.
+    """
+    new_fingerprint = fingerprint()
+    if read_fingerprint(VENV_DIR) == new_fingerprint:
+        return VENV_DIR, False
+
+    with locks.FileLock(BUILD_LOCK, STALE_BUILD_LOCK_SECONDS):
+        #  Another run may have built it while this one waited for the lock
+        if read_fingerprint(VENV_DIR) == new_fingerprint:
+            return VENV_DIR, False
+        #  A build that couldn't be swapped in is swapped in now if .venv is free, and run from otherwise
+        fallback = read_fallback()
+        if fallback and read_fingerprint(fallback) == new_fingerprint:
+            return swap_venv(fallback), False
+        remove_stale_builds()
+        new_dir = f"{VENV_DIR}-new-{os.getpid()}"
+        build_venv(new_dir, new_fingerprint)
+        return swap_venv(new_dir), True
+
+
+def main() -> None:
+    """Bootstrap the virtual environment and run the robot in it with the arguments of this script."""
+    script_directory = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(script_directory)
+
+    start = time.perf_counter()
+    venv_dir, rebuilt = bootstrap()
+    bootstrap_seconds = time.perf_counter() - start
+    print(f"Bootstrap took {bootstrap_seconds:.1f} seconds ({'rebuilt' if rebuilt else 'reused'} {venv_dir}).")
 
-script_directory = os.path.dirname(os.path.realpath(__file__))
-os.chdir(script_directory)
+    #  The robot logs the startup time to OpenOrchestrator, see initialize.py
+    environment = dict(os.environ, ROBOT_BOOTSTRAP_SECONDS=f"{bootstrap_seconds:.2f}", ROBOT_BOOTSTRAP_REBUILT=str(rebuilt))
+    command_args = [venv_python(venv_dir), "-m", "robot_framework"] + sys.argv[1:]
 
-subprocess.run("python -m venv .venv", check=True)
-subprocess.run(r'.venv\Scripts\pip install .', check=True)
+    subprocess.run(command_args, check=True, env=environment)
 
-command_args = [r".venv\Scripts\python", "-m", "robot_framework"] + sys.argv[1:]
 
-subprocess.run(command_args, check=True)
+if __name__ == "__main__":
+    main()
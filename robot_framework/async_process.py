@@ -0,0 +1,208 @@
+"""This module contains an asyncio version of the main process of the robot.
+It's selected with "engine": "async" in the process arguments.
+"""
+
+# The async code mirrors the threaded code line for line in places.
+# pylint: disable=duplicate-code
+
+import asyncio
+import functools
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework.miralix import miralix_async
+from robot_framework.get_organized import get_organized_api, get_organized_async
+from robot_framework import config
+from robot_framework import metrics
+from robot_framework import pipeline
+from robot_framework import retry
+from robot_framework import sharding
+from robot_framework import transfer
+from robot_framework import transfer_run
+from robot_framework import upload_index
+from robot_framework import watermark
+
+
+class AsyncBytesBudget:
+    """Keeps track of the number of bytes downloaded but not yet uploaded, like pipeline.BytesBudget."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def wait(self) -> None:
+        """Wait until the number of bytes in flight is below the limit."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+
+    def add(self, size: int) -> None:
+        """Add a number of bytes to the bytes in flight."""
+        self.in_flight += size
+
+    async def release(self, size: int) -> None:
+        """Remove a number of bytes from the bytes in flight and wake up waiting downloads."""
+        async with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
+
+class AsyncRecordingTransfer(transfer.TransferBase):
+    """Downloads recordings from Miralix and uploads them to a case in GetOrganized on the event loop,
+    like transfer.RecordingTransfer.
+    """
+
+    def __init__(self, case_number: str, miralix_client: miralix_async.AsyncMiralixClient,
+                 get_organized_client: get_organized_async.AsyncGetOrganizedClient, run_metrics: metrics.RunMetrics | None = None,
+                 index: upload_index.UploadIndex | None = None):
+        """Create a transfer.
+
+        Args:
+            case_number: The GetOrganized case to upload to.
+            miralix_client: Async client for the Miralix API.
+            get_organized_client: Async client for the GetOrganized API.
+            run_metrics: The metrics to record timings, sizes and retries in.
+            index: The index of uploaded documents. If None the index in config.GO_UPLOAD_INDEX_FILE is loaded.
+        """
+        super().__init__(case_number, miralix_client, run_metrics, index)
+        self.get_organized_client = get_organized_client
+
+    async def download(self, recording: dict) -> bytes | BinaryIO:
+        """Download a recording from Miralix and keep the SHA-256 hash of the content in recording["Sha256"].
+
+        Args:
+            recording: The recording to download.
+
+        Returns:
+            The file content, as a spooled file if config.MIRALIX_STREAM_DOWNLOADS is set.
+        """
+        call_id = recording["QueueCallId"]
+        with self.run_metrics.time_stage("download", call_id):
+            file_data = await retry.async_retry_call(self._download_attempt, recording, breaker=self.miralix_breaker,
+                                                     on_retry=self.retry_counter("download", call_id))
+        self.run_metrics.add_bytes(call_id, pipeline.size_of(file_data))
+        return file_data
+
+    async def _download_attempt(self, recording: dict) -> bytes | BinaryIO:
+        hasher = hashlib.sha256()
+        if config.MIRALIX_STREAM_DOWNLOADS:
+            file_data = await miralix_async.download_file_stream(recording["QueueCallId"], self.miralix_client, hasher=hasher)
+        else:
+            file_data = await miralix_async.download_file(recording["QueueCallId"], self.miralix_client)
+            hasher.update(file_data)
+        recording["Sha256"] = hasher.hexdigest()
+        return file_data
+
+    async def upload(self, recording: dict, file_data: bytes | BinaryIO) -> None:
+        """Upload a recording to GetOrganized, unless an identical document is already in the case.
+
+        Args:
+            recording: The recording to upload.
+            file_data: The file content.
+        """
+        size = pipeline.size_of(file_data)
+        if self.skip_identical_upload(recording, size):
+            return
+        with self.run_metrics.time_stage("upload", recording["QueueCallId"]):
+            doc_id = await retry.async_retry_call(self._upload_attempt, recording, file_data, breaker=self.get_organized_breaker,
+                                                  on_retry=self.retry_counter("upload", recording["QueueCallId"]))
+        self.index_upload(recording, size, doc_id)
+
+    async def _upload_attempt(self, recording: dict, file_data: bytes | BinaryIO) -> int | None:
+        if hasattr(file_data, "seek"):
+            file_data.seek(0)
+        text = await self.get_organized_client.upload_document(file=file_data, **transfer.upload_arguments(recording, self.case_number))
+        return get_organized_api.get_document_id(text)
+
+
+async def async_process(orchestrator_connection: OrchestratorConnection, run_metrics: metrics.RunMetrics | None = None) -> None:
+    """Do the primary process of the robot with up to config.ASYNC_MAX_TRANSFERS concurrent transfers.
+    Downloads run on the event loop, while uploads are offloaded to a pool of NTLM sessions.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        run_metrics: The metrics to record timings, sizes and retries in.
+    """
+    run_metrics = run_metrics or metrics.RunMetrics()
+    orchestrator_connection.log_trace("Running async process.")
+
+    case_number = json.loads(orchestrator_connection.process_arguments)["case_number"]
+
+    #  Get the highest call ID previously downloaded from each queue, by this shard and by the shard it takes over from
+    shard = sharding.Shard.from_arguments(json.loads(orchestrator_connection.process_arguments))
+    watermark_store = sharding.create_watermark_store(orchestrator_connection, shard)
+    queue_names = json.loads(orchestrator_connection.process_arguments)["target_queues"]
+    last_downloads = watermark.load_watermarks(watermark_store, queue_names, orchestrator_connection)
+    rescued_watermarks = sharding.load_rescued_watermarks(orchestrator_connection, shard)
+
+    #  The run updates OpenOrchestrator with blocking calls, so they're made off the event loop,
+    #  on a thread of their own since a TransferRun is used from one thread
+    bookkeeping = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Bookkeeping")
+
+    async def bookkeep(func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(bookkeeping, functools.partial(func, *args))
+
+    try:
+        async with (miralix_async.AsyncMiralixClient.from_orchestrator(orchestrator_connection) as miralix_client,
+                    get_organized_async.AsyncGetOrganizedClient.from_orchestrator(orchestrator_connection) as get_organized_client):
+            #  List the recordings that have a higher ID than the previous highest, sorted by call ID, a page at a time
+            listing = miralix_async.iter_recording_pages(orchestrator_connection, sharding.listing_watermarks(last_downloads, rescued_watermarks),
+                                                         miralix_client, run_metrics)
+            run = await bookkeep(functools.partial(transfer_run.TransferRun, shard=shard, rescued_watermarks=rescued_watermarks),
+                                 orchestrator_connection, watermark_store, last_downloads, run_metrics)
+
+            recording_transfer = AsyncRecordingTransfer(case_number, miralix_client, get_organized_client, run_metrics)
+            budget = AsyncBytesBudget(config.MAX_BYTES_IN_FLIGHT)
+            slots = asyncio.Semaphore(config.ASYNC_MAX_TRANSFERS)
+
+            async def transfer_recording(recording: dict) -> tuple[dict, Exception | None]:
+                try:
+                    await budget.wait()
+                    file_data = await recording_transfer.download(recording)
+                    size = pipeline.size_of(file_data)
+                    budget.add(size)
+                    try:
+                        await recording_transfer.upload(recording, file_data)
+                    finally:
+                        if hasattr(file_data, "close"):
+                            file_data.close()
+                        await budget.release(size)
+                    return recording, None
+                # Any error is reported back for the recording.
+                # pylint: disable-next = broad-exception-caught
+                except Exception as error:
+                    return recording, error
+                finally:
+                    slots.release()
+
+            #  Queue elements are updated on the bookkeeping thread while the transfers run
+            tasks = set()
+            try:
+                async for page in listing:
+                    recordings = run.start(page)
+                    while (recording := await bookkeep(next, recordings, None)) is not None:
+                        await slots.acquire()
+                        tasks.add(asyncio.create_task(transfer_recording(recording)))
+                        for task in [task for task in tasks if task.done()]:
+                            tasks.remove(task)
+                            await bookkeep(run.finish, *task.result())
+
+                for task in asyncio.as_completed(tasks):
+                    await bookkeep(run.finish, *await task)
+                tasks.clear()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await listing.aclose()
+                await bookkeep(run.flush)
+                await bookkeep(recording_transfer.upload_index.save)
+    finally:
+        bookkeeping.shutdown()
+
+    journal_results = await asyncio.to_thread(transfer.journalize_uploads, orchestrator_connection, recording_transfer)
+    run.raise_for_failures()
+    get_organized_api.raise_for_failures("Journalizing", journal_results)
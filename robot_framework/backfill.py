@@ -0,0 +1,292 @@
+"""This module contains the backfill mode of the robot, which transfers the recordings in a range of call IDs or dates.
+It's selected with "backfill" in the process arguments.
+"""
+
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework.miralix import miralix_api
+from robot_framework.get_organized import get_organized_api
+from robot_framework import config
+from robot_framework import metrics
+from robot_framework import pipeline
+from robot_framework import transfer
+
+
+@dataclass(frozen=True)
+class BackfillRange:
+    """A range of recordings split into windows, given by "backfill" in the process arguments, e.g.
+    {"from_call_id": 1, "to_call_id": 500000, "window_size": 10000} or
+    {"from_date": "2024-01-01", "to_date": "2025-01-01", "window_days": 7}.
+    Call IDs and dates can be combined. The lower bounds are inclusive and the upper bounds exclusive.
+    Windows are cut by date if "window_days" is given, and by call ID otherwise.
+    """
+    from_call_id: int = 1
+    to_call_id: int | None = None
+    from_date: str | None = None
+    to_date: str | None = None
+    window_size: int | None = None
+    window_days: int | None = None
+    max_minutes: float | None = None
+
+    def __post_init__(self):
+        if self.window_days and not self.from_date:
+            raise ValueError("A backfill with 'window_days' needs a 'from_date'.")
+
+    def includes(self, recording: dict) -> bool:
+        """Check if a recording is in the range."""
+        call_id = recording["QueueCallId"]
+        if call_id < self.from_call_id or (self.to_call_id is not None and call_id >= self.to_call_id):
+            return False
+        started = recording_date(recording)
+        return ((self.from_date is None or started >= datetime.fromisoformat(self.from_date))
+                and (self.to_date is None or started < datetime.fromisoformat(self.to_date)))
+
+    def is_past(self, recording: dict) -> bool:
+        """Check if a recording comes after the range by call ID or date, so the rest of a listing sorted by call ID does too."""
+        return ((self.to_call_id is not None and recording["QueueCallId"] >= self.to_call_id)
+                or (self.to_date is not None and recording_date(recording) >= datetime.fromisoformat(self.to_date)))
+
+    def window_of(self, recording: dict) -> int:
+        """Get the index of the window a recording in the range belongs to."""
+        if self.window_days:
+            return (recording_date(recording) - datetime.fromisoformat(self.from_date)).days // self.window_days
+        return (recording["QueueCallId"] - self.from_call_id) // (self.window_size or config.BACKFILL_WINDOW_SIZE)
+
+    def window_label(self, window: int) -> str:
+        """Describe a window for the log."""
+        if self.window_days:
+            start = datetime.fromisoformat(self.from_date) + timedelta(days=window * self.window_days)
+            return f"{start:%Y-%m-%d} to {start + timedelta(days=self.window_days - 1):%Y-%m-%d}"
+        window_size = self.window_size or config.BACKFILL_WINDOW_SIZE
+        start = self.from_call_id + window * window_size
+        return f"call IDs {start} to {start + window_size - 1}"
+
+    def window_call_ids(self, window: int) -> tuple[int, int]:
+        """Get the first call ID of a window by call ID, and the first call ID after it."""
+        window_size = self.window_size or config.BACKFILL_WINDOW_SIZE
+        start = self.from_call_id + window * window_size
+        return start, start + window_size
+
+    def window_count(self) -> int | None:
+        """Get the number of windows by call ID in the range, or None if the range has no upper call ID."""
+        if self.to_call_id is None:
+            return None
+        window_size = self.window_size or config.BACKFILL_WINDOW_SIZE
+        return max(0, -(-(self.to_call_id - self.from_call_id) // window_size))
+
+
+def recording_date(recording: dict) -> datetime:
+    """Get the start of the conversation of a recording, without the time zone and fractions of a second."""
+    return datetime.fromisoformat(recording["ConversationStartedUtc"][:19])
+
+
+class BackfillCheckpoint:
+    """Keeps the finished windows of each backfill in a local JSON file.
+    Backfills are told apart by a hash of the case, the queues and the range, so a changed backfill starts over.
+    The file is replaced atomically, so a crash never leaves a partial file behind.
+    """
+
+    def __init__(self, key: str, path: str | None = None):
+        """Create a checkpoint.
+
+        Args:
+            key: The key of the backfill.
+            path: The path of the checkpoint file. Defaults to config.BACKFILL_CHECKPOINT_FILE.
+        """
+        self.key = key
+        self.path = path or config.BACKFILL_CHECKPOINT_FILE
+
+    def _read(self) -> dict[str, list[int]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def load(self) -> set[int]:
+        """Load the finished windows of the backfill."""
+        return set(self._read().get(self.key, []))
+
+    def save(self, done_windows: set[int]) -> None:
+        """Replace the finished windows of the backfill."""
+        checkpoints = self._read()
+        checkpoints[self.key] = sorted(done_windows)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False) as file:
+            json.dump(checkpoints, file)
+        os.replace(file.name, self.path)
+
+
+def backfill_key(case_number: str, queue_names: list[str], backfill_range: BackfillRange) -> str:
+    """Get the key identifying a backfill in the checkpoint file. The time limit isn't part of it."""
+    description = json.dumps([case_number, sorted(queue_name.strip() for queue_name in queue_names),
+                              dict(asdict(backfill_range), max_minutes=None)])
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:16]
+
+
+def list_windows(orchestrator_connection: OrchestratorConnection, backfill_range: BackfillRange, done_windows: set[int],
+                 client: miralix_api.MiralixClient, run_metrics: metrics.RunMetrics) -> Iterator[tuple[int, list[dict], bool]]:
+    """List the windows of a backfill that aren't done, in order.
+    Windows by call ID are each listed from their own first call ID, up to config.BACKFILL_LISTING_WORKERS windows at once,
+    so the next windows are listed while the first ones transfer. Windows by date can't be mapped to call IDs before listing,
+    so they're listed in one pass from 'from_call_id', and each window is given once the listing has moved past it.
+    Listing stops at the first recording past the range.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        backfill_range: The range of the backfill.
+        done_windows: The windows to skip.
+        client: The Miralix client to list with.
+        run_metrics: The metrics to record the time of each page in.
+
+    Yields:
+        Each window with its recordings in the range, and whether the listing moved past the window,
+        so no recordings are added to it later.
+    """
+    if backfill_range.window_days:
+        yield from _list_date_windows(orchestrator_connection, backfill_range, done_windows, client, run_metrics)
+        return
+
+    def list_window(window: int) -> tuple[int, list[dict], bool]:
+        start, end = backfill_range.window_call_ids(window)
+        recordings = []
+        listing = miralix_api.iter_recordings_for_process(orchestrator_connection, start - 1, client, run_metrics)
+        with contextlib.closing(listing):
+            for recording in listing:
+                if recording["QueueCallId"] >= end or backfill_range.is_past(recording):
+                    return window, recordings, True
+                if backfill_range.includes(recording):
+                    recordings.append(recording)
+        return window, recordings, False
+
+    windows = (window for window in itertools.islice(itertools.count(), backfill_range.window_count()) if window not in done_windows)
+    executor = ThreadPoolExecutor(max_workers=config.BACKFILL_LISTING_WORKERS)
+    try:
+        listings = deque(executor.submit(list_window, window) for window in itertools.islice(windows, config.BACKFILL_LISTING_WORKERS))
+        while listings:
+            window, recordings, closed = listings.popleft().result()
+            yield window, recordings, closed
+            #  A window the listing didn't move past reaches the present, so the windows after it are empty
+            if not closed:
+                return
+            if (window := next(windows, None)) is not None:
+                listings.append(executor.submit(list_window, window))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _list_date_windows(orchestrator_connection: OrchestratorConnection, backfill_range: BackfillRange, done_windows: set[int],
+                       client: miralix_api.MiralixClient, run_metrics: metrics.RunMetrics) -> Iterator[tuple[int, list[dict], bool]]:
+    """List the windows by date of a backfill in one pass, see list_windows."""
+    windows = {}
+    next_window = 0
+    listing = miralix_api.iter_recordings_for_process(orchestrator_connection, backfill_range.from_call_id - 1, client, run_metrics)
+    with contextlib.closing(listing):
+        for recording in listing:
+            if backfill_range.is_past(recording):
+                break
+            if not backfill_range.includes(recording):
+                continue
+            window = backfill_range.window_of(recording)
+            #  The listing is sorted by call ID, which follows the start of the conversations, so the earlier windows are listed
+            for passed in range(next_window, window):
+                if passed not in done_windows:
+                    yield passed, windows.pop(passed, []), True
+            next_window = max(next_window, window)
+            if window not in done_windows:
+                windows.setdefault(window, []).append(recording)
+        else:
+            #  The listing reached the present, so the last windows may get more recordings
+            for window in sorted(windows):
+                yield window, windows[window], False
+            return
+    for window in sorted(windows):
+        yield window, windows[window], True
+
+
+def backfill(orchestrator_connection: OrchestratorConnection, run_metrics: metrics.RunMetrics) -> None:
+    """Transfer the recordings in the range given by "backfill" in the process arguments.
+    The windows are listed concurrently, see list_windows, and fed into one pipeline as they are listed,
+    with config.BACKFILL_DOWNLOAD_WORKERS and config.BACKFILL_UPLOAD_WORKERS threads as the limit across all windows.
+    A window is checkpointed when all its recordings are transferred and the listing has moved past it, and windows
+    in the checkpoint are skipped when the backfill is run again.
+
+    The backfill doesn't touch the watermarks or the job queue, so it can run from its own trigger next to the regular runs.
+    With "max_minutes" it stops starting new recordings after that many minutes, to be resumed by the next run.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        run_metrics: The metrics to record timings, sizes and retries in.
+
+    Raises:
+        RuntimeError: If any recording failed to transfer.
+        BulkOperationError: If "journalize" is set and any uploaded document failed to be journalized.
+    """
+    process_arguments = json.loads(orchestrator_connection.process_arguments)
+    backfill_range = BackfillRange(**process_arguments["backfill"])
+    case_number = process_arguments["case_number"]
+    checkpoint = BackfillCheckpoint(backfill_key(case_number, process_arguments["target_queues"], backfill_range))
+    done_windows = checkpoint.load()
+
+    miralix_client = miralix_api.MiralixClient.from_orchestrator(orchestrator_connection)
+    recording_transfer = transfer.RecordingTransfer(orchestrator_connection, case_number, miralix_client, run_metrics)
+
+    orchestrator_connection.log_info(f"Backfilling, {len(done_windows)} windows were done already.")
+
+    deadline = time.monotonic() + backfill_range.max_minutes * 60 if backfill_range.max_minutes else None
+    #  The recordings left of each window, and the windows the listing has moved past
+    pending = Counter()
+    closed_windows = set()
+
+    def start():
+        for window, recordings, closed in list_windows(orchestrator_connection, backfill_range, done_windows, miralix_client, run_metrics):
+            if closed and not recordings:
+                done_windows.add(window)
+                checkpoint.save(done_windows)
+                continue
+            if closed:
+                closed_windows.add(window)
+            pending[window] += len(recordings)
+            orchestrator_connection.log_info(f"Backfilling {len(recordings)} recordings of {backfill_range.window_label(window)}.")
+            for recording in recordings:
+                if deadline and time.monotonic() >= deadline:
+                    orchestrator_connection.log_info(f"Backfill stopped after {backfill_range.max_minutes} minutes. It continues on the next run.")
+                    return
+                run_metrics.start_recording(recording)
+                yield recording
+
+    failed_windows = set()
+    try:
+        for recording, error in pipeline.run_pipeline(start(), recording_transfer.download, recording_transfer.upload,
+                                                      download_workers=config.BACKFILL_DOWNLOAD_WORKERS,
+                                                      upload_workers=config.BACKFILL_UPLOAD_WORKERS,
+                                                      max_bytes_in_flight=config.MAX_BYTES_IN_FLIGHT):
+            run_metrics.finish_recording(recording["QueueCallId"], error)
+            window = backfill_range.window_of(recording)
+            pending[window] -= 1
+            if error:
+                failed_windows.add(window)
+            elif pending[window] == 0 and window in closed_windows and window not in failed_windows:
+                done_windows.add(window)
+                checkpoint.save(done_windows)
+                orchestrator_connection.log_info(f"Backfilled {backfill_range.window_label(window)}.")
+    finally:
+        recording_transfer.upload_index.save()
+
+    journal_results = transfer.journalize_uploads(orchestrator_connection, recording_transfer)
+    failed_call_ids = run_metrics.failed_call_ids()
+    if failed_call_ids:
+        raise RuntimeError(f"{len(failed_call_ids)} recordings failed to backfill: {failed_call_ids}")
+    get_organized_api.raise_for_failures("Journalizing", journal_results)
@@ -10,6 +10,10 @@ FAIL_ROBOT_ON_TOO_MANY_ERRORS = True
 SMTP_SERVER = "smtp.aarhuskommune.local"
 SMTP_PORT = 25
 SCREENSHOT_SENDER = "robot@friend.dk"
+# Errors are mailed as one digest at the end of each run. Screenshots are taken of at most
+# ERROR_SCREENSHOT_LIMIT distinct errors, and the digest lists at most ERROR_DIGEST_LIMIT.
+ERROR_SCREENSHOT_LIMIT = 3
+ERROR_DIGEST_LIMIT = 20
 
 # Constant/Credential names
 ERROR_EMAIL = "Error Email"
@@ -18,11 +22,162 @@ ERROR_EMAIL = "Error Email"
 MIRALIX_SHARED_KEY = "Miralix Shared Key"
 MIRALIX_BASE_URL = "https://webrequest-aarhus.miralix.online/mot/12986"
 MIRALIX_TIMEOUT = 60
+# The number of pooled keep-alive connections to Miralix.
+MIRALIX_POOL_SIZE = 8
+# Retries of connection errors, and of listings with exponential backoff on status 429 and 5xx.
+# Downloads are retried by the transfer instead, see RETRY_ATTEMPTS.
+MIRALIX_RETRIES = 3
+MIRALIX_BACKOFF_FACTOR = 1
+# The number of queues listed concurrently.
+MIRALIX_LISTING_WORKERS = 6
+# Queues are listed in pages of MIRALIX_PAGE_SIZE recordings, asked for with the query parameter MIRALIX_PAGE_SIZE_PARAMETER.
+# Miralix may return shorter pages, so a queue is listed until an empty page, or a page shorter than Miralix has returned
+# before a later page. Recordings are transferred as the pages arrive, and queue elements are created a page at a time.
+MIRALIX_PAGE_SIZE = 500
+MIRALIX_PAGE_SIZE_PARAMETER = "pageSize"
+# The file caching the index of Miralix queue names to IDs, and the number of seconds it's valid.
+MIRALIX_QUEUE_CACHE_FILE = "miralix_queues.json"
+MIRALIX_QUEUE_CACHE_TTL = 24 * 60 * 60
+# Whether recordings are streamed to a spooled file instead of being read into memory.
+MIRALIX_STREAM_DOWNLOADS = True
+# The number of bytes of a streamed recording kept in memory before it's spooled to disk.
+MIRALIX_SPOOL_SIZE = 8 * 1024 * 1024
 
 # GetOrganized
 GO_API = "https://ad.go.aarhuskommune.dk"
 GO_CREDENTIALS = "GetOrganized Login"
 GO_TIMEOUT = 60
+# The number of NTLM-authenticated connections kept open to GetOrganized, and so of concurrent calls.
+# Should be at least GO_UPLOAD_WORKERS and GO_BULK_WORKERS.
+GO_POOL_SIZE = 8
+# How recordings are encoded when uploaded: 'base64', 'stream' or 'list' (compatibility only).
+GO_UPLOAD_ENCODING = "stream"
+# Whether uploads are skipped when a document with the same name and SHA-256 hash is already in the case.
+# Uploaded documents are indexed in GO_UPLOAD_INDEX_FILE.
+GO_SKIP_IDENTICAL_UPLOADS = True
+GO_UPLOAD_INDEX_FILE = "go_upload_index.json"
+# Runs sharing the upload index merge their uploads into it under a lock file, GO_UPLOAD_INDEX_FILE with ".lock" added.
+# A save waits up to GO_UPLOAD_INDEX_LOCK_SECONDS for the lock, and a lock file older than that is left by a crashed run.
+GO_UPLOAD_INDEX_LOCK_SECONDS = 30
+# The number of concurrent calls of bulk operations on documents, e.g. journalizing the documents of a run.
+GO_BULK_WORKERS = 8
+
+# Transfer pipeline
+# The number of threads downloading from Miralix and uploading to GetOrganized.
+MIRALIX_DOWNLOAD_WORKERS = 4
+GO_UPLOAD_WORKERS = 4
+# The number of bytes downloaded but not yet uploaded before downloads pause.
+MAX_BYTES_IN_FLIGHT = 256 * 1024 * 1024
+
+# The number of concurrent transfers when running with "engine": "async".
+# Uploads are still limited to GO_UPLOAD_WORKERS threads because of NTLM.
+ASYNC_MAX_TRANSFERS = 100
+
+# Adaptive concurrency and timeouts
+# Concurrent calls to each backend start from the initial concurrency, grow by one per round of successful calls
+# and are halved when the backend answers 429 or 503 or a call times out. A Retry-After header holds back new calls.
+# The concurrency is capped by MIRALIX_MAX_CONCURRENCY and GO_MAX_CONCURRENCY whatever the engine, since the limiters
+# are kept between runs, and the threaded engine by its worker threads as well. MIRALIX_TIMEOUT and GO_TIMEOUT are used until the latency of a backend is known,
+# after which timeouts are TIMEOUT_FACTOR times the expected duration of a call, within MIN_TIMEOUT and MAX_TIMEOUT.
+MIRALIX_INITIAL_CONCURRENCY = 8
+MIRALIX_MAX_CONCURRENCY = 32
+GO_INITIAL_CONCURRENCY = 4
+GO_MAX_CONCURRENCY = 8
+TIMEOUT_FACTOR = 4
+MIN_TIMEOUT = 10
+MAX_TIMEOUT = 600
+
+# Retries of each recording, with exponential backoff and jitter between attempts.
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 60
+# The number of consecutive failures before calls to a backend are stopped, and the seconds before trying again.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 120
+# Queue elements left NEW, IN_PROGRESS or FAILED within this number of days are resumed.
+RECLAIM_DAYS = 14
+# A recording that has failed MAX_TRANSFER_ATTEMPTS times, and was first listed at least ABANDON_AFTER_HOURS ago,
+# is given up: its queue element is set 'Abandoned' and the watermark moves past it.
+# Keep ABANDON_AFTER_HOURS well below RECLAIM_DAYS, so recordings are given up while their queue elements are reclaimed.
+MAX_TRANSFER_ATTEMPTS = 5
+ABANDON_AFTER_HOURS = 48
+
+# Queue status changes and log lines are written to OpenOrchestrator in batches,
+# every QUEUE_FLUSH_INTERVAL seconds or when QUEUE_FLUSH_SIZE changes are pending.
+QUEUE_FLUSH_INTERVAL = 10
+QUEUE_FLUSH_SIZE = 100
+
+# Watermark
+# Where the highest transferred call ID per Miralix queue is kept: 'constant' or 'json'.
+WATERMARK_BACKEND = "constant"
+# The OpenOrchestrator constant used by the 'constant' backend.
+WATERMARK_CONSTANT = "Miralix Watermark"
+# The file used by the 'json' backend.
+WATERMARK_FILE = "miralix_watermark.json"
+
+# Outbox
+# With "outbox" in the process arguments, downloaded recordings are stored in OUTBOX_DIR and uploaded from there
+# by their own workers, so downloads go on at full speed while GetOrganized is slow or down.
+# The outbox holds at most OUTBOX_MAX_BYTES. A download waits up to OUTBOX_FULL_TIMEOUT seconds for space,
+# after which the rest of the run is left for the next run without waiting. When the downloads are done, uploads go on until
+# the outbox is empty or OUTBOX_DRAIN_TIMEOUT seconds pass without a successful upload, or when the daemon stops in daemon mode.
+# Each process keeps its entries in a numbered slot folder of OUTBOX_DIR of its own, and each shard has its own OUTBOX_DIR/<shard>.
+OUTBOX_DIR = "miralix_outbox"
+OUTBOX_MAX_BYTES = 10 * 1024 * 1024 * 1024
+OUTBOX_FULL_TIMEOUT = 300
+OUTBOX_DRAIN_TIMEOUT = 300
+
+# Sharding
+# In sharded mode ("shard" in the process arguments) the queue element of each recording being transferred
+# is leased by its worker. A lease not renewed within LEASE_SECONDS expires, and is taken over by the next shard.
+# A lease that is taken over is read again LEASE_SETTLE_SECONDS after it's written, to check no other worker took it as well.
+# Only recordings that were being transferred are taken over. The rest of the backlog of a stopped shard waits until it runs again.
+LEASE_SECONDS = 15 * 60
+LEASE_SETTLE_SECONDS = 1
+
+# Backfill
+# A backfill ("backfill" in the process arguments) is split into windows of BACKFILL_WINDOW_SIZE call IDs,
+# unless windows by date are requested. Finished windows are kept in BACKFILL_CHECKPOINT_FILE.
+BACKFILL_WINDOW_SIZE = 10000
+BACKFILL_CHECKPOINT_FILE = "miralix_backfill.json"
+# The number of threads downloading and uploading in a backfill, across all windows.
+# Kept below the regular workers so a backfill leaves room for the regular runs.
+BACKFILL_DOWNLOAD_WORKERS = 2
+BACKFILL_UPLOAD_WORKERS = 2
+# The number of windows of a backfill listed at once, each from its own first call ID.
+BACKFILL_LISTING_WORKERS = 2
+
+# Daemon
+# With "daemon" in the process arguments the robot keeps polling the queues for DAEMON_RUN_MINUTES instead of running once.
+# A queue is polled every DAEMON_POLL_INTERVAL seconds while it has new recordings. The interval doubles each time
+# the queue is idle, up to DAEMON_MAX_POLL_INTERVAL, and each poll is moved by up to DAEMON_POLL_JITTER of the interval.
+DAEMON_POLL_INTERVAL = 60
+DAEMON_MAX_POLL_INTERVAL = 15 * 60
+DAEMON_POLL_JITTER = 0.2
+DAEMON_RUN_MINUTES = 12 * 60
+# The daemon stops with an error after this many failed polls in a row. A poll fails when listing, OpenOrchestrator,
+# or Miralix or GetOrganized as a whole fails, not when single recordings fail.
+DAEMON_MAX_FAILED_POLLS = 5
+
+# Run plan
+# With "plan" in the process arguments the listing is planned before the transfer: the size of each recording is estimated
+# and the recordings are transferred largest first, with a progress line and an ETA every PLAN_PROGRESS_INTERVAL seconds.
+# Sizes are estimated from the conversation duration at PLAN_BYTES_PER_SECOND (128 kbit/s MP3),
+# or PLAN_DEFAULT_SIZE without a duration, unless a HEAD request per recording is asked for.
+PLAN_BYTES_PER_SECOND = 16000
+PLAN_DEFAULT_SIZE = 5 * 1024 * 1024
+# The number of concurrent HEAD requests when estimating sizes.
+PLAN_HEAD_WORKERS = 8
+# The throughput the first ETA is based on when there's no earlier run summary in METRICS_DIR.
+PLAN_DEFAULT_MB_PER_SECOND = 5.0
+PLAN_PROGRESS_INTERVAL = 60
+
+# Run metrics
+# The folder where each run writes a summary (JSON), the timings of each recording (CSV)
+# and any profile enabled with "profile" in the process arguments.
+METRICS_DIR = "run_metrics"
+# The number of slowest recordings listed in the run summary.
+METRICS_SLOWEST_COUNT = 5
 
 # Queue specific configs
 # ----------------------
@@ -0,0 +1,205 @@
+"""This module contains the daemon mode of the robot, which keeps polling the queues instead of running once.
+It's selected with "daemon" in the process arguments.
+"""
+
+import functools
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework.miralix import miralix_api
+from robot_framework.get_organized import get_organized_api
+from robot_framework import config
+from robot_framework import metrics
+from robot_framework import outbox
+from robot_framework import planner
+from robot_framework import queue_util
+from robot_framework import sharding
+from robot_framework import transfer
+from robot_framework import transfer_run
+from robot_framework.exceptions import BusinessError
+
+
+@dataclass(frozen=True)
+class DaemonSettings:
+    """The settings of the daemon, given by "daemon" in the process arguments, e.g.
+    {"interval_seconds": 30, "max_interval_seconds": 600, "jitter": 0.1, "run_minutes": 480}.
+    Settings that are left out, or "daemon": true, use the defaults in config.py.
+    """
+    interval_seconds: float | None = None
+    max_interval_seconds: float | None = None
+    jitter: float | None = None
+    run_minutes: float | None = None
+
+    @classmethod
+    def from_arguments(cls, process_arguments: dict) -> "DaemonSettings":
+        """Get the settings from the process arguments."""
+        arguments = process_arguments.get("daemon")
+        return cls(**arguments) if isinstance(arguments, dict) else cls()
+
+
+class QueueSchedule:
+    """Keeps the time of the next poll of each queue. A queue is polled every 'interval' seconds while it has
+    new recordings, and the interval doubles each time it's idle, up to 'max_interval'. Each poll is moved
+    by a random part of the interval, up to 'jitter', so the queues spread out instead of being polled together.
+    All queues are due when the schedule is created.
+    """
+
+    def __init__(self, queue_names: list[str], settings: DaemonSettings, rng: random.Random | None = None):
+        """Create a schedule.
+
+        Args:
+            queue_names: The queues to poll.
+            settings: The settings of the daemon.
+            rng: The random generator of the jitter.
+        """
+        self.interval = settings.interval_seconds or config.DAEMON_POLL_INTERVAL
+        self.max_interval = max(self.interval, settings.max_interval_seconds or config.DAEMON_MAX_POLL_INTERVAL)
+        self.jitter = settings.jitter if settings.jitter is not None else config.DAEMON_POLL_JITTER
+        self.intervals = dict.fromkeys(queue_names, self.interval)
+        self._next_poll = dict.fromkeys(queue_names, time.monotonic())
+        self._random = rng or random.Random()
+
+    def due(self, now: float) -> list[str]:
+        """Get the queues due for a poll at the time 'now' of time.monotonic."""
+        return [queue_name for queue_name, next_poll in self._next_poll.items() if next_poll <= now]
+
+    def wait_seconds(self, now: float) -> float:
+        """Get the number of seconds from the time 'now' of time.monotonic until the next queue is due."""
+        return max(0.0, min(self._next_poll.values()) - now)
+
+    def polled(self, queue_name: str, found: bool, now: float) -> None:
+        """Schedule the next poll of a queue after a poll.
+
+        Args:
+            queue_name: The queue that was polled.
+            found: Whether the poll found new recordings in the queue.
+            now: The time of time.monotonic when the poll finished.
+        """
+        self.intervals[queue_name] = self.interval if found else min(self.max_interval, self.intervals[queue_name] * 2)
+        self._next_poll[queue_name] = now + self.intervals[queue_name] * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+TransferNew = Callable[..., transfer_run.TransferRun]
+
+
+def run_daemon(orchestrator_connection: OrchestratorConnection, transfer_new: TransferNew) -> None:
+    """Poll the target queues until the run time has passed, transferring the new recordings of the queues that are due
+    in small batches. The Miralix client, the GetOrganized connections, the upload index and the limiters are kept
+    between polls, so a poll doesn't pay for connecting and loading again.
+
+    The queue elements are indexed once and the index is kept between polls, see queue_util.QueueIndex.
+    With "outbox" the outbox is uploaded on its own threads for the whole run instead of being drained by each poll,
+    so a slow or unavailable GetOrganized doesn't hold up the polls. It's drained when the daemon stops.
+
+    Each poll that finds recordings reports its own metrics. Recordings that fail are logged and left to the attempts
+    of their queue elements, see queue_util.failure_status, so they're tried again by later polls until they're given up.
+    A poll that fails on its own, e.g. because listing or OpenOrchestrator fails, is logged, and the recordings it didn't
+    transfer are left after the watermark for the next poll of their queue.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        transfer_new: Function transferring the recordings after the watermarks of the given queues,
+            i.e. process.transfer_new_recordings. It's given the index of the queue elements as 'queue_index',
+            and the outbox uploader as 'outbox_uploader'.
+
+    Raises:
+        BusinessError: If a dry run of the plan is requested, since every poll would plan again without transferring anything.
+        Exception: The error of the last poll, if config.DAEMON_MAX_FAILED_POLLS polls fail in a row.
+            Recordings that fail don't fail the poll.
+    """
+    process_arguments = json.loads(orchestrator_connection.process_arguments)
+    if planner.PlanSettings.from_arguments(process_arguments).dry_run:
+        raise BusinessError("A dry run of the plan can't be combined with daemon mode.")
+    settings = DaemonSettings.from_arguments(process_arguments)
+    queue_names = [queue_name.strip() for queue_name in process_arguments["target_queues"]]
+    schedule = QueueSchedule(queue_names, settings)
+    stop_at = time.monotonic() + (settings.run_minutes or config.DAEMON_RUN_MINUTES) * 60
+
+    miralix_client = miralix_api.MiralixClient.from_orchestrator(orchestrator_connection)
+    recording_transfer = transfer.RecordingTransfer(orchestrator_connection, process_arguments["case_number"], miralix_client)
+    orchestrator_connection.log_info(f"Daemon started, polling {len(queue_names)} queues every {schedule.interval} to {schedule.max_interval} seconds.")
+
+    queue_index = queue_util.QueueIndex()
+    outbox_uploader = None
+    if process_arguments.get("outbox"):
+        box = outbox.Outbox(outbox.shard_directory(sharding.Shard.from_arguments(process_arguments)))
+        outbox_uploader = outbox.OutboxUploader(box, recording_transfer.case_number, recording_transfer.upload)
+        outbox_uploader.start()
+
+    polls = failed_polls = transferred = 0
+    try:
+        while (now := time.monotonic()) < stop_at:
+            due = schedule.due(now)
+            if not due:
+                time.sleep(min(schedule.wait_seconds(now), stop_at - now))
+                continue
+
+            polls += 1
+            try:
+                transferred += poll(orchestrator_connection, functools.partial(transfer_new, queue_index=queue_index, outbox_uploader=outbox_uploader),
+                                    recording_transfer, schedule, due)
+                failed_polls = 0
+            # The recordings of a failed poll are transferred by the next poll of their queues.
+            # pylint: disable-next = broad-exception-caught
+            except Exception as error:
+                failed_polls += 1
+                orchestrator_connection.log_error(f"Poll of {', '.join(due)} failed, {failed_polls} in a row: {error!r}")
+                if failed_polls >= config.DAEMON_MAX_FAILED_POLLS:
+                    raise
+                #  The index may have missed status changes of the failed poll, so it's loaded again
+                queue_index = queue_util.QueueIndex()
+    finally:
+        if outbox_uploader:
+            outbox.drain_uploader(orchestrator_connection, outbox_uploader, queue_index)
+
+    orchestrator_connection.log_info(f"Daemon stopped after {polls} polls and {transferred} recordings.")
+
+
+def poll(orchestrator_connection: OrchestratorConnection, transfer_new: TransferNew, recording_transfer: transfer.RecordingTransfer,
+         schedule: QueueSchedule, queue_names: list[str]) -> int:
+    """Transfer the new recordings of some queues, journalizing them if "journalize" is set,
+    and schedule the next poll of each queue by whether it transferred any recordings.
+    Recordings that fail are logged without failing the poll.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        transfer_new: Function transferring the recordings after the watermarks of the given queues.
+        recording_transfer: The transfer kept between polls.
+        schedule: The schedule of the queues.
+        queue_names: The queues to poll.
+
+    Returns:
+        The number of recordings transferred.
+
+    Raises:
+        RuntimeError: If recordings failed while the circuit breaker of Miralix or GetOrganized is open.
+        BulkOperationError: If any uploaded document failed to be journalized.
+    """
+    run_metrics = metrics.RunMetrics()
+    recording_transfer.start_run(run_metrics)
+    try:
+        transfer_new(orchestrator_connection, recording_transfer, queue_names)
+        journal_results = transfer.journalize_uploads(orchestrator_connection, recording_transfer)
+    finally:
+        #  A queue whose only recordings failed is polled less often, like an idle one
+        found = Counter(recording.get("queue") for recording in run_metrics.recordings.values() if not recording.get("error"))
+        for queue_name in queue_names:
+            schedule.polled(queue_name, found[queue_name] > 0, time.monotonic())
+        if run_metrics.recordings:
+            run_metrics.report(orchestrator_connection)
+
+    failed_call_ids = run_metrics.failed_call_ids()
+    #  Recordings failing because a backend is down fail the poll, since the backend fails them all
+    unavailable = [breaker.name for breaker in (recording_transfer.miralix_breaker, recording_transfer.get_organized_breaker) if breaker.is_open]
+    if failed_call_ids and unavailable:
+        raise RuntimeError(f"{' and '.join(unavailable)} unavailable, {len(failed_call_ids)} recordings failed to transfer: {failed_call_ids}")
+    if failed_call_ids:
+        orchestrator_connection.log_error(f"{len(failed_call_ids)} recordings failed in the poll of {', '.join(queue_names)}: {failed_call_ids}")
+    get_organized_api.raise_for_failures("Journalizing", journal_results)
+    return len(run_metrics.recordings) - len(failed_call_ids)
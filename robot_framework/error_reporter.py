@@ -0,0 +1,105 @@
+"""This module collects the errors of a run and mails them as one digest when the run ends."""
+
+import html
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework import error_screenshot
+
+
+@dataclass
+class ErrorReport:
+    """A distinct error of a run and the number of times it occurred."""
+    message: str
+    exception_type: str
+    exception_message: str
+    trace: str
+    count: int = 1
+    screenshot: Future | None = field(default=None, repr=False)
+
+
+class ErrorReporter:
+    """Collects errors during a run instead of mailing each one while it's handled.
+    Repeats of an error, by type and message, are counted in its first report.
+    Screenshots are captured when the first config.ERROR_SCREENSHOT_LIMIT distinct errors are reported,
+    so they show the desktop at the moment of the error, and encoded on a background thread.
+    They are skipped when there's no desktop.
+    """
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection):
+        """Create a reporter.
+
+        Args:
+            orchestrator_connection: Connection to OpenOrchestrator, used to get the error email and to log failed mails.
+        """
+        self.orchestrator_connection = orchestrator_connection
+        self.reports: dict[tuple[str, str], ErrorReport] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ErrorReporter")
+
+    def report(self, message: str, error: Exception) -> None:
+        """Add an error to the digest.
+
+        Args:
+            message: A message describing where the error happened.
+            error: The exception.
+        """
+        key = (type(error).__name__, str(error))
+        if key in self.reports:
+            self.reports[key].count += 1
+            return
+
+        error_report = ErrorReport(message, key[0], key[1], "".join(traceback.format_exception(error)))
+        if len(self.reports) < config.ERROR_SCREENSHOT_LIMIT and (screenshot := self._grab_screenshot()):
+            error_report.screenshot = self._executor.submit(error_screenshot.encode_screenshot, screenshot)
+        self.reports[key] = error_report
+
+    @staticmethod
+    def _grab_screenshot():
+        try:
+            return error_screenshot.grab_screenshot()
+        # A failed screenshot shouldn't stop the error from being reported.
+        # pylint: disable-next = broad-exception-caught
+        except Exception:
+            return None
+
+    def send_digest(self) -> None:
+        """Mail the collected errors, if any, as one email to the address in the error email constant.
+        At most config.ERROR_DIGEST_LIMIT distinct errors are included. A failed mail is logged instead of raised.
+        """
+        try:
+            if not self.reports:
+                return
+
+            reports = list(self.reports.values())
+            parts = [f"<p>{sum(error_report.count for error_report in reports)} errors, {len(reports)} distinct.</p>"]
+            for error_report in reports[:config.ERROR_DIGEST_LIMIT]:
+                screenshot = self._screenshot_of(error_report)
+                parts.append(f"<h3>{html.escape(error_report.message)}</h3>")
+                parts.append(error_screenshot.error_html(error_report.exception_type, error_report.exception_message,
+                                                         error_report.trace, screenshot, error_report.count))
+            if len(reports) > config.ERROR_DIGEST_LIMIT:
+                parts.append(f"<p>{len(reports) - config.ERROR_DIGEST_LIMIT} more distinct errors are in the OpenOrchestrator log.</p>")
+
+            error_email = self.orchestrator_connection.get_constant(config.ERROR_EMAIL).value
+            error_screenshot.send_html_mail(error_email, f"Error digest: {self.orchestrator_connection.process_name}", "\n".join(parts))
+            self.reports.clear()
+        # The digest must not hide the outcome of the run.
+        # pylint: disable-next = broad-exception-caught
+        except Exception as error:
+            self.orchestrator_connection.log_error(f"Couldn't send the error digest: {repr(error)}")
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _screenshot_of(self, error_report: ErrorReport) -> str | None:
+        if error_report.screenshot is None:
+            return None
+        try:
+            return error_report.screenshot.result()
+        # A failed screenshot shouldn't stop the rest of the digest.
+        # pylint: disable-next = broad-exception-caught
+        except Exception:
+            return None
@@ -3,51 +3,121 @@
 import smtplib
 from email.message import EmailMessage
 import base64
+import html
+import os
+import sys
 import traceback
 from io import BytesIO
-
-from PIL import ImageGrab
+from typing import Any
 
 from robot_framework import config
 
 
-def send_error_screenshot(to_address: str | list[str], exception: Exception, process_name: str):
-    """Sends an email with an error report, including a screenshot, when an exception occurs.
-    Configuration details such as SMTP server, port, sender email, etc., should be set in 'config' module.
+def is_headless() -> bool:
+    """Check if there's no desktop to take a screenshot of, eg. when running as a service."""
+    if sys.platform == "win32":
+        # pylint: disable-next = import-outside-toplevel
+        import ctypes
+        # Sessions without an interactive desktop can't open the input desktop
+        desktop = ctypes.windll.user32.OpenInputDesktop(0, False, 0)
+        if not desktop:
+            return True
+        ctypes.windll.user32.CloseDesktop(desktop)
+        return False
+    if sys.platform == "darwin":
+        return False
+    return not os.getenv("DISPLAY") and not os.getenv("WAYLAND_DISPLAY")
+
+
+def grab_screenshot() -> Any:
+    """Capture the desktop as it is now, without encoding it, see encode_screenshot.
+    PIL is imported on first use, so importing this module stays cheap.
+
+    Returns:
+        The screenshot as a PIL image, or None if there's no desktop.
+    """
+    if is_headless():
+        return None
+
+    # pylint: disable-next = import-outside-toplevel
+    from PIL import ImageGrab
+    try:
+        return ImageGrab.grab()
+    except OSError:
+        return None
+
+
+def encode_screenshot(screenshot: Any) -> str:
+    """Encode a screenshot from grab_screenshot as a base64 encoded PNG."""
+    buffer = BytesIO()
+    screenshot.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def take_screenshot() -> str | None:
+    """Take a screenshot of the desktop.
+
+    Returns:
+        The screenshot as a base64 encoded PNG, or None if there's no desktop.
+    """
+    screenshot = grab_screenshot()
+    return encode_screenshot(screenshot) if screenshot else None
+
+
+def error_html(exception_type: str, exception_message: str, trace: str, screenshot_base64: str | None, count: int = 1) -> str:
+    """Format an error as HTML for an error email.
 
     Args:
-        to_address: Email address or list of addresses to send the error report.
-        exception: The exception that triggered the error.
-        process_name: Name of the process from OpenOrchestrator.
+        exception_type: The name of the type of the exception.
+        exception_message: The message of the exception.
+        trace: The formatted traceback.
+        screenshot_base64: A base64 encoded PNG screenshot, if any.
+        count: The number of times the error occurred.
+
+    Returns:
+        The HTML.
+    """
+    parts = [f"<p>Error type: {html.escape(exception_type)}</p>",
+             f"<p>Error message: {html.escape(exception_message)}</p>"]
+    if count > 1:
+        parts.append(f"<p>Occurred {count} times.</p>")
+    parts.append(f"<pre>{html.escape(trace)}</pre>")
+    if screenshot_base64:
+        parts.append(f'<img src="data:image/png;base64,{screenshot_base64}" alt="Screenshot">')
+    return "\n".join(parts)
+
+
+def send_html_mail(to_address: str | list[str], subject: str, html_body: str) -> None:
+    """Send an HTML email through the SMTP server in config.
+
+    Args:
+        to_address: Email address or list of addresses.
+        subject: The subject of the email.
+        html_body: The contents of the body element.
     """
     # Create message
     msg = EmailMessage()
     msg['to'] = to_address
     msg['from'] = config.SCREENSHOT_SENDER
-    msg['subject'] = f"Error screenshot: {process_name}"
-
-    # Take screenshot and convert to base64
-    screenshot = ImageGrab.grab()
-    buffer = BytesIO()
-    screenshot.save(buffer, format='PNG')
-    screenshot_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-    # Create an HTML message with the exception and screenshot
-    html_message = f"""
-    <html>
-        <body>
-            <p>Error type: {type(exception).__name__}</p>
-            <p>Error message: {exception}</p>
-            <p>{traceback.format_exc()}</p>
-            <img src="data:image/png;base64,{screenshot_base64}" alt="Screenshot">
-        </body>
-    </html>
-    """
+    msg['subject'] = subject
 
     msg.set_content("Please enable HTML to view this message.")
-    msg.add_alternative(html_message, subtype='html')
+    msg.add_alternative(f"<html><body>{html_body}</body></html>", subtype='html')
 
     # Send message
     with smtplib.SMTP(config.SMTP_SERVER, config.SMTP_PORT) as smtp:
         smtp.starttls()
         smtp.send_message(msg)
+
+
+def send_error_screenshot(to_address: str | list[str], exception: Exception, process_name: str):
+    """Sends an email with an error report, including a screenshot, when an exception occurs.
+    Configuration details such as SMTP server, port, sender email, etc., should be set in 'config' module.
+
+    Args:
+        to_address: Email address or list of addresses to send the error report.
+        exception: The exception that triggered the error.
+        process_name: Name of the process from OpenOrchestrator.
+    """
+    body = error_html(type(exception).__name__, str(exception), traceback.format_exc(), take_screenshot())
+    send_html_mail(to_address, f"Error screenshot: {process_name}", body)
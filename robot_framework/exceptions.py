@@ -7,31 +7,37 @@ from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConn
 
 from robot_framework import config
 from robot_framework import error_screenshot
+from robot_framework.error_reporter import ErrorReporter
 
 
 class BusinessError(Exception):
     """An empty exception used to identify errors caused by breaking business rules"""
 
 
-def handle_error(message: str, error: Exception, queue_element: QueueElement | None, orchestrator_connection: OrchestratorConnection) -> None:
+def handle_error(message: str, error: Exception, queue_element: QueueElement | None, orchestrator_connection: OrchestratorConnection,
+                 reporter: ErrorReporter | None = None) -> None:
     """Handles an error caught during the process.
     Logs an error to OpenOrchestrator.
     Marks the queue element (if any) as failed.
-    Sends an error screenshot by email.
+    Adds the error to the digest of 'reporter', or sends an error screenshot by email right away if there's no reporter.
 
     Args:
         message: A message to prepend to the error message.
         error: The exception that should be handled.
         queue_element: The queue element to fail, if any.
         orchestrator_connection: A connection to OpenOrchestrator.
+        reporter: The error reporter of the run, if any.
     """
     error_msg = f"{message}: {repr(error)}\n\nTrace:\n{traceback.format_exc()}"
-    error_email = orchestrator_connection.get_constant(config.ERROR_EMAIL).value
 
     orchestrator_connection.log_error(error_msg)
     if queue_element:
         orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.FAILED, error_msg)
-    error_screenshot.send_error_screenshot(error_email, error, orchestrator_connection.process_name)
+    if reporter:
+        reporter.report(message, error)
+    else:
+        error_email = orchestrator_connection.get_constant(config.ERROR_EMAIL).value
+        error_screenshot.send_error_screenshot(error_email, error, orchestrator_connection.process_name)
 
 
 def log_exception(orchestrator_connection: OrchestratorConnection) -> callable:
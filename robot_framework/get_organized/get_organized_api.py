@@ -1,20 +1,55 @@
 """Functions for accessing the Miralix API."""
 
+import base64
 import json
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Iterator
 from urllib.parse import urljoin
 
-from requests import Session
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from requests import RequestException, Response, Session
+from requests.adapters import HTTPAdapter
 from requests_ntlm import HttpNtlmAuth
 from robot_framework import config
+from robot_framework import rate_limit
 
+# The ways a file can be encoded when uploaded, see build_upload_body.
+UPLOAD_ENCODINGS = ("base64", "stream", "list")
 
-def create_session(username: str, password: str) -> Session:
+# Chunk size when streaming a file into an upload body. Must be a multiple of 3 to keep base64 chunks aligned.
+UPLOAD_CHUNK_SIZE = 3 * 256 * 1024
+
+
+class BulkOperationError(Exception):
+    """Raised when some items of a bulk operation failed. The failed results are in 'failures'."""
+
+    def __init__(self, operation: str, failures: list["BulkResult"], total: int):
+        super().__init__(f"{operation} failed for {len(failures)} of {total} items: "
+                         + ", ".join(f"{failure.item} ({failure.error!r})" for failure in failures[:10]))
+        self.failures = failures
+
+
+@dataclass
+class BulkResult:
+    """The outcome of one item of a bulk operation: the response text, or the error raised for the item."""
+    item: Any
+    response: str | None = None
+    error: Exception | None = None
+
+
+def create_session(username: str, password: str, pool_size: int | None = None) -> Session:
     """Create a session for accessing GetOrganized API.
 
     Args:
-        apiurl: URL for the API.
         username: Username for login.
         password: Password for login.
+        pool_size: The number of pooled connections. Defaults to the requests default.
 
     Returns:
         Return the session object
@@ -22,27 +57,169 @@ def create_session(username: str, password: str) -> Session:
     session = Session()
     session.headers.setdefault("Content-Type", "application/json")
     session.auth = HttpNtlmAuth(username, password)
+    if pool_size:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
     return session
 
 
-def upload_document(*, apiurl: str, file: bytearray, case: str, filename: str, agent_name: str | None = None, date_string: str | None = None, session: Session) -> tuple[str, Session]:
-    """Upload a document to Get Organized.
+class GetOrganizedClient:
+    """A client for the GetOrganized API with a pool of NTLM-authenticated sessions.
+    NTLM authenticates a connection rather than each request, so each session keeps a single keep-alive connection
+    which stays authenticated between calls. A call checks out a session, so a handshake never spans two connections,
+    and at most 'pool_size' calls run at the same time. The client can be shared between threads.
+
+    Clients are shared per host and login in the process with get_client, so the authenticated connections
+    are kept between process attempts and runs.
+    """
+
+    def __init__(self, username: str, password: str, apiurl: str | None = None, pool_size: int = config.GO_POOL_SIZE):
+        """Create a client.
+
+        Args:
+            username: Username for login.
+            password: Password for login.
+            apiurl: URL for GetOrganized API. Defaults to config.GO_API.
+            pool_size: The number of sessions, and so of concurrent calls. Defaults to config.GO_POOL_SIZE.
+        """
+        self.username = username
+        self.password = password
+        self.apiurl = apiurl or config.GO_API
+        self.pool_size = pool_size
+        #  Idle sessions, the most recently used first since its connection is the most likely to be alive
+        self._idle = queue.LifoQueue()
+        self._available = threading.BoundedSemaphore(pool_size)
+
+    @classmethod
+    def from_orchestrator(cls, orchestrator_connection: OrchestratorConnection) -> "GetOrganizedClient":
+        """Get the shared client for the login stored in OpenOrchestrator, see get_client.
+
+        Args:
+            orchestrator_connection: Connection object to OpenOrchestrator.
+
+        Returns:
+            The client.
+        """
+        login = orchestrator_connection.get_credential(config.GO_CREDENTIALS)
+        return get_client(login.username, login.password)
+
+    @contextmanager
+    def session(self) -> Iterator[Session]:
+        """Check out a session for one or more calls, waiting for one if all are in use.
+
+        Yields:
+            A session which no other thread uses until the block ends.
+        """
+        with self._available:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                session = create_session(self.username, self.password, pool_size=1)
+            try:
+                yield session
+            finally:
+                self._idle.put(session)
+
+    def call(self, func: Callable[..., tuple[str, Session]], **kwargs) -> tuple[str, Session]:
+        """Call a function of this module with a checked out session, e.g. client.call(finalize_document, apiurl=..., doc_id=...).
+
+        Args:
+            func: The function, taking a 'session' keyword argument.
+            **kwargs: The other arguments of the function.
+
+        Returns:
+            The result of the function.
+        """
+        with self.session() as session:
+            return func(session=session, **kwargs)
+
+    def preauthenticate(self, connections: int | None = None) -> None:
+        """Open and authenticate connections ahead of the first calls, so the NTLM handshakes don't add to their latency.
+        Connections already open are reused, so this is cheap when the client was used in an earlier run.
+        Errors are left to the calls to report.
+
+        Args:
+            connections: The number of connections. Defaults to the pool size.
+        """
+        missing = min(connections or self.pool_size, self.pool_size) - self._idle.qsize()
+        if missing <= 0:
+            return
+
+        def authenticate(_):
+            with self.session() as session:
+                try:
+                    #  Any response will do, as long as the handshake is done
+                    session.head(self.apiurl, timeout=config.GO_TIMEOUT)
+                except RequestException:
+                    pass
+
+        #  Concurrent, so each call opens a connection of its own
+        with ThreadPoolExecutor(max_workers=missing, thread_name_prefix="GetOrganizedAuth") as executor:
+            list(executor.map(authenticate, range(missing)))
+
+    def close(self) -> None:
+        """Close the idle sessions and their connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_clients: dict[tuple[str, str], GetOrganizedClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(username: str, password: str, apiurl: str | None = None) -> GetOrganizedClient:
+    """Get the client of a host and login, creating it on first use.
+    Clients are kept between runs in the process, so their connections stay authenticated.
+
+    Args:
+        username: Username for login.
+        password: Password for login.
+        apiurl: URL for GetOrganized API. Defaults to config.GO_API.
+
+    Returns:
+        The client.
+    """
+    apiurl = apiurl or config.GO_API
+    with _clients_lock:
+        client = _clients.get((apiurl, username))
+        if client is not None and client.password != password:
+            client.close()
+            client = None
+        if client is None:
+            client = _clients[(apiurl, username)] = GetOrganizedClient(username, password, apiurl)
+        return client
+
+
+def build_upload_body(*, apiurl: str, file: bytes | BinaryIO | list[int], case: str, filename: str, agent_name: str | None = None, date_string: str | None = None, encoding: str = "base64") -> str | BinaryIO:
+    """Build the JSON body for the AddToCase endpoint.
+
+    The encodings are:
+        'base64': The file is sent as a base64 string. The body is built in memory.
+        'stream': The file is base64 encoded in chunks into a temporary file, which is sent as the body.
+            Memory use is constant no matter the size of the file.
+        'list': The file is sent as a JSON list of integers. Only kept for compatibility,
+            since it uses many times the size of the file in both memory and bandwidth.
 
     Args:
         apiurl: Base url for API.
-        session: Session token for request.
-        file: Bytearray of file to upload.
+        file: Bytes, binary file object or list of byte values of the file to upload.
         case: Case name already present in GO.
         filename: Name of file when saved in GO.
         agent_name: Agent name, used for creating a folder in GO. Defaults to None.
         date_string: A date to add as metadata to GetOrganized. Defaults to None.
+        encoding: How the file is encoded in the body. One of UPLOAD_ENCODINGS. Defaults to 'base64'.
 
     Returns:
-        Return response text and session token.
+        The body as a string, or as a binary file object positioned at the start for 'stream'.
     """
-    url = apiurl + "/_goapi/Documents/AddToCase"
+    if encoding not in UPLOAD_ENCODINGS:
+        raise ValueError(f"Unknown upload encoding '{encoding}'. Must be one of {UPLOAD_ENCODINGS}.")
+
     payload = {
-        "Bytes": file,
         "CaseId": case,
         "SiteUrl": urljoin(apiurl, f"/cases/EMN/{case}"),
         "ListName": "Dokumenter",
@@ -51,11 +228,116 @@ def upload_document(*, apiurl: str, file: bytearray, case: str, filename: str, a
         "Metadata": f"<z:row xmlns:z='#RowsetSchema' ows_Dato='{date_string}'/>",
         "Overwrite": True
     }
-    response = session.post(url, data=json.dumps(payload), timeout=config.GO_TIMEOUT)
+
+    if encoding == "stream":
+        return _stream_body(payload, file)
+
+    if hasattr(file, "read"):
+        file = file.read()
+
+    if encoding == "list":
+        payload["Bytes"] = list(file)
+    else:
+        payload["Bytes"] = base64.b64encode(bytes(file)).decode("ascii")
+    return json.dumps(payload)
+
+
+def _stream_body(payload: dict, file: bytes | BinaryIO | list[int]) -> BinaryIO:
+    """Write a JSON body with the file base64 encoded in chunks to a temporary file.
+
+    Args:
+        payload: The payload without the file.
+        file: Bytes, binary file object or list of byte values of the file.
+
+    Returns:
+        The temporary file positioned at the start.
+    """
+    if isinstance(file, list):
+        file = bytes(file)
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        view = memoryview(file)
+        chunks = (view[i:i+UPLOAD_CHUNK_SIZE] for i in range(0, len(view), UPLOAD_CHUNK_SIZE))
+    else:
+        chunks = iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b"")
+
+    body = tempfile.TemporaryFile()
+    # The payload is written without its closing brace, so the bytes can be appended as the last key.
+    body.write(json.dumps(payload)[:-1].encode("utf-8"))
+    body.write(b', "Bytes": "')
+    remainder = b""
+    for chunk in chunks:
+        chunk = remainder + bytes(chunk)
+        cut = len(chunk) - len(chunk) % 3
+        body.write(base64.b64encode(chunk[:cut]))
+        remainder = chunk[cut:]
+    body.write(base64.b64encode(remainder))
+    body.write(b'"}')
+    body.seek(0)
+    return body
+
+
+def upload_document(*, apiurl: str, file: bytes | BinaryIO | list[int], case: str, filename: str, agent_name: str | None = None, date_string: str | None = None, session: Session, encoding: str = "base64") -> tuple[str, Session]:
+    """Upload a document to Get Organized.
+
+    Args:
+        apiurl: Base url for API.
+        session: Session token for request.
+        file: Bytes, binary file object or list of byte values of the file to upload.
+        case: Case name already present in GO.
+        filename: Name of file when saved in GO.
+        agent_name: Agent name, used for creating a folder in GO. Defaults to None.
+        date_string: A date to add as metadata to GetOrganized. Defaults to None.
+        encoding: How the file is encoded in the request body, see build_upload_body. Defaults to 'base64'.
+
+    Returns:
+        Return response text and session token.
+    """
+    url = apiurl + "/_goapi/Documents/AddToCase"
+    body = build_upload_body(apiurl=apiurl, file=file, case=case, filename=filename,
+                             agent_name=agent_name, date_string=date_string, encoding=encoding)
+    try:
+        size = len(body) if isinstance(body, str) else os.fstat(body.fileno()).st_size
+        response = send(session, "POST", url, size=size, data=body)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
     response.raise_for_status()
     return response.text, session
 
 
+def send(session: Session, method: str, url: str, size: int | None = None, **kwargs) -> Response:
+    """Send a request to GetOrganized through the limiter of its host, with a timeout adapted to
+    the observed latency and throughput, see rate_limit.AdaptiveLimiter.
+
+    Args:
+        session: Session object used for logging in.
+        method: The HTTP method.
+        url: The URL of the endpoint.
+        size: The size of the body in bytes, if it contains a file.
+        **kwargs: Keyword arguments for session.request.
+
+    Returns:
+        The response.
+    """
+    limiter = rate_limit.get_limiter("GetOrganized", url, config.GO_INITIAL_CONCURRENCY, config.GO_MAX_CONCURRENCY, config.GO_TIMEOUT)
+    return limiter.send(lambda timeout: session.request(method, url, timeout=timeout, **kwargs), size)
+
+
+def get_document_id(response_text: str) -> int | None:
+    """Get the document ID from the response of upload_document.
+
+    Args:
+        response_text: The response text.
+
+    Returns:
+        The document ID, or None if the response doesn't contain one.
+    """
+    try:
+        return json.loads(response_text).get("DocId")
+    except (ValueError, AttributeError):
+        return None
+
+
 def delete_document(apiurl: str, document_id: int, session: Session) -> tuple[str, Session]:
     """Delete a document from GetOrganized.
 
@@ -71,11 +353,100 @@ def delete_document(apiurl: str, document_id: int, session: Session) -> tuple[st
     payload = {
         "DocId": document_id
     }
-    response = session.delete(url, data=json.dumps(payload), timeout=config.GO_TIMEOUT)
+    response = send(session, "DELETE", url, data=json.dumps(payload))
     response.raise_for_status()
     return response.text, session
 
 
+def bulk_call(func: Callable[[Any], tuple[str, Session]], items: list, max_workers: int) -> list[BulkResult]:
+    """Call a function for each item concurrently, collecting a result per item instead of stopping at the first error.
+
+    Args:
+        func: Function calling GetOrganized for an item and returning the response text and the session.
+        items: The items.
+        max_workers: The number of concurrent calls. Calls are further limited by the limiter of GetOrganized, see send.
+
+    Returns:
+        A result for each item, in the order of the items.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="GetOrganizedBulk") as executor:
+        futures = [executor.submit(func, item) for item in items]
+
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append(BulkResult(item, response=future.result()[0]))
+        # Every error is reported for its item.
+        # pylint: disable-next = broad-exception-caught
+        except Exception as error:
+            results.append(BulkResult(item, error=error))
+    return results
+
+
+def raise_for_failures(operation: str, results: list[BulkResult]) -> None:
+    """Raise an error if any item of a bulk operation failed.
+
+    Args:
+        operation: The name of the operation, for the error message.
+        results: The results of the operation.
+
+    Raises:
+        BulkOperationError: If any item failed.
+    """
+    failures = [result for result in results if result.error is not None]
+    if failures:
+        raise BulkOperationError(operation, failures, len(results))
+
+
+def finalize_documents(client: GetOrganizedClient, doc_ids: list[int], max_workers: int | None = None) -> list[BulkResult]:
+    """Finalize documents in GetOrganized concurrently, see finalize_document and bulk_call.
+
+    Args:
+        client: The client whose sessions the calls check out.
+        doc_ids: IDs of the documents to journalize.
+        max_workers: The number of concurrent calls. Defaults to config.GO_BULK_WORKERS.
+
+    Returns:
+        A result for each document ID.
+    """
+    return bulk_call(lambda doc_id: client.call(finalize_document, apiurl=client.apiurl, doc_id=doc_id), doc_ids,
+                     max_workers or config.GO_BULK_WORKERS)
+
+
+def delete_documents(client: GetOrganizedClient, doc_ids: list[int], max_workers: int | None = None) -> list[BulkResult]:
+    """Delete documents from GetOrganized concurrently, see delete_document and bulk_call.
+
+    Args:
+        client: The client whose sessions the calls check out.
+        doc_ids: IDs of the documents to delete.
+        max_workers: The number of concurrent calls. Defaults to config.GO_BULK_WORKERS.
+
+    Returns:
+        A result for each document ID.
+    """
+    return bulk_call(lambda doc_id: client.call(delete_document, apiurl=client.apiurl, document_id=doc_id), doc_ids,
+                     max_workers or config.GO_BULK_WORKERS)
+
+
+def upload_documents(client: GetOrganizedClient, documents: list[dict], encoding: str = "base64", max_workers: int | None = None) -> list[BulkResult]:
+    """Upload documents to GetOrganized concurrently, see upload_document and bulk_call.
+
+    Args:
+        client: The client whose sessions the calls check out.
+        documents: The keyword arguments of upload_document for each document: file, case, filename and optionally agent_name and date_string.
+        encoding: How the files are encoded in the request bodies, see build_upload_body. Defaults to 'base64'.
+        max_workers: The number of concurrent calls. Defaults to config.GO_BULK_WORKERS.
+
+    Returns:
+        A result for each document, with the filename as the item.
+    """
+    results = bulk_call(lambda document: client.call(upload_document, apiurl=client.apiurl, encoding=encoding, **document), documents,
+                        max_workers or config.GO_BULK_WORKERS)
+    for result, document in zip(results, documents):
+        result.item = document["filename"]
+    return results
+
+
 def create_case(apiurl: str, title: str, session: Session) -> tuple[str, Session]:
     """Create a case in GetOrganized.
 
@@ -93,7 +464,7 @@ def create_case(apiurl: str, title: str, session: Session) -> tuple[str, Session
         'MetadataXml': f'<z:row xmlns:z="#RowsetSchema" ows_Title="{title}" ows_CaseStatus="Åben"/>',
         'ReturnWhenCaseFullyCreated': False
     }
-    response = session.post(url, data=json.dumps(payload), timeout=config.GO_TIMEOUT)
+    response = send(session, "POST", url, data=json.dumps(payload))
     response.raise_for_status()
     return response.text, session
 
@@ -111,7 +482,7 @@ def close_case(apiurl: str, case_number: int, session: Session) -> tuple[str, Se
     """
     url = urljoin(apiurl, "/_goapi/Cases/CloseCase")
     payload = {"CaseId": case_number}
-    response = session.post(url, data=payload, timeout=config.GO_TIMEOUT)
+    response = send(session, "POST", url, data=payload)
     response.raise_for_status()
     return response.text, session
 
@@ -129,7 +500,7 @@ def finalize_document(apiurl: str, doc_id: int, session: Session) -> tuple[str,
     """
     url = urljoin(apiurl, "/_goapi/Documents/Finalize/ByDocumentId")
     payload = {"DocID": doc_id}
-    response = session.post(url, data=payload, timeout=config.GO_TIMEOUT)
+    response = send(session, "POST", url, data=payload)
     response.raise_for_status()
     return response.text, session
 
@@ -150,7 +521,7 @@ def unfinalize_documents(apiurl: str, doc_ids: list[int], session: Session) -> t
         "DocIDs": doc_ids,
         "OnlyUnfinalize": True
     }
-    response = session.post(url, data=payload)
+    response = send(session, "POST", url, data=payload)
     response.raise_for_status()
     return response.text, session
 
@@ -174,6 +545,6 @@ def log_to_getorganized(apiurl: str, message: str, session: Session) -> tuple[st
         "Message": message,
         "LogLevel": "1"
     }
-    response = session.post(url, json.dumps(data))
+    response = send(session, "POST", url, data=json.dumps(data))
     response.raise_for_status()
     return response, session
@@ -0,0 +1,93 @@
+"""Async wrappers for the GetOrganized API, mirroring get_organized_api.
+
+GetOrganized uses NTLM authentication, which isn't supported by the async HTTP clients.
+The calls are therefore offloaded to a pool of threads, using the authenticated sessions
+of the shared get_organized_api.GetOrganizedClient.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework.get_organized import get_organized_api
+
+
+class AsyncGetOrganizedClient:
+    """An async client for the GetOrganized API.
+    At most 'max_workers' calls run at the same time, each on a thread with a session checked out from get_organized_api.GetOrganizedClient.
+    The sessions are authenticated when the client is entered with 'async with'.
+    """
+
+    def __init__(self, username: str, password: str, max_workers: int = config.GO_UPLOAD_WORKERS):
+        """Create a client.
+
+        Args:
+            username: Username for login.
+            password: Password for login.
+            max_workers: The number of threads calling GetOrganized. Defaults to config.GO_UPLOAD_WORKERS.
+        """
+        self.client = get_organized_api.get_client(username, password)
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="GetOrganized")
+
+    @classmethod
+    def from_orchestrator(cls, orchestrator_connection: OrchestratorConnection) -> "AsyncGetOrganizedClient":
+        """Create a client using the login stored in OpenOrchestrator.
+
+        Args:
+            orchestrator_connection: Connection object to OpenOrchestrator.
+
+        Returns:
+            The client.
+        """
+        login = orchestrator_connection.get_credential(config.GO_CREDENTIALS)
+        return cls(login.username, login.password)
+
+    async def _run(self, func: Callable, **kwargs):
+        """Run a function from get_organized_api on the thread pool with a session of the client."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(self.client.call, func, **kwargs))
+
+    async def upload_document(self, *, file: bytes | BinaryIO | list[int], case: str, filename: str, agent_name: str | None = None,
+                              date_string: str | None = None, encoding: str = "base64", apiurl: str | None = None) -> str:
+        """Upload a document to Get Organized, see get_organized_api.upload_document.
+
+        Returns:
+            The response text.
+        """
+        text, _ = await self._run(get_organized_api.upload_document, apiurl=apiurl or config.GO_API, file=file, case=case, filename=filename,
+                                  agent_name=agent_name, date_string=date_string, encoding=encoding)
+        return text
+
+    async def delete_document(self, document_id: int, apiurl: str | None = None) -> str:
+        """Delete a document from GetOrganized, see get_organized_api.delete_document.
+
+        Returns:
+            The response text.
+        """
+        text, _ = await self._run(get_organized_api.delete_document, apiurl=apiurl or config.GO_API, document_id=document_id)
+        return text
+
+    async def finalize_document(self, doc_id: int, apiurl: str | None = None) -> str:
+        """Finalize a document in GetOrganized, see get_organized_api.finalize_document.
+
+        Returns:
+            The response text.
+        """
+        text, _ = await self._run(get_organized_api.finalize_document, apiurl=apiurl or config.GO_API, doc_id=doc_id)
+        return text
+
+    async def aclose(self) -> None:
+        """Wait for running calls. The sessions are kept open in the shared client for the next run."""
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+
+    async def __aenter__(self):
+        #  Authenticating blocks on NTLM handshakes, so it's done on the thread pool instead of the event loop
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.client.preauthenticate, self.max_workers)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
@@ -1,8 +1,16 @@
 """This module defines any initial processes to run when the robot starts."""
 
+import os
+
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 
 def initialize(orchestrator_connection: OrchestratorConnection) -> None:
     """Do all custom startup initializations of the robot."""
     orchestrator_connection.log_trace("Initializing.")
+
+    #  Set by main.py when it starts the robot
+    bootstrap_seconds = os.getenv("ROBOT_BOOTSTRAP_SECONDS")
+    if bootstrap_seconds:
+        rebuilt = os.getenv("ROBOT_BOOTSTRAP_REBUILT") == "True"
+        orchestrator_connection.log_info(f"Bootstrap took {bootstrap_seconds} seconds, {'rebuilt' if rebuilt else 'reused'} the virtual environment.")
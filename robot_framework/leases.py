@@ -0,0 +1,132 @@
+"""This module keeps leases on the queue elements of recordings being transferred in sharded mode."""
+
+import time
+from datetime import datetime, timedelta
+
+from OpenOrchestrator.database.queues import QueueElement
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection, QueueStatus
+
+from robot_framework import config
+from robot_framework import metrics
+
+# The start of the message of a leased queue element, followed by the id of the worker.
+LEASE_PREFIX = "Leased by "
+
+
+def lease_message(worker_id: str) -> str:
+    """Get the message marking a queue element as leased by a worker."""
+    return f"{LEASE_PREFIX}{worker_id}"
+
+
+def is_expired(queue_element: QueueElement, lease_seconds: float | None = None) -> bool:
+    """Check if the lease on an 'In Progress' queue element has run out.
+    The lease starts when the element was last set 'In Progress'.
+
+    Args:
+        queue_element: The queue element.
+        lease_seconds: The length of a lease. Defaults to config.LEASE_SECONDS.
+
+    Returns:
+        True if the element is 'In Progress' and hasn't been renewed within the lease.
+    """
+    if queue_element.status != QueueStatus.IN_PROGRESS:
+        return False
+    renewed = queue_element.start_date or queue_element.created_date
+    return renewed + timedelta(seconds=lease_seconds or config.LEASE_SECONDS) < datetime.now()
+
+
+class LeaseKeeper:
+    """Leases the queue elements a worker transfers by setting them 'In Progress' with the id of the worker as the message.
+    Leases are written to OpenOrchestrator right away, not through the batcher, so other workers see them at once.
+    An element that was 'In Progress' when it was listed is read again before it's taken, and is only taken
+    if no other worker holds a lease on it that hasn't expired. OpenOrchestrator has no conditional update,
+    so such an element is read once more config.LEASE_SETTLE_SECONDS after the lease is written, and is given up
+    if another worker has written its lease since. Of workers taking over the same lease, only the last to write keeps it.
+
+    Leases are renewed a third of the way into the lease. Each lease is checked in OpenOrchestrator before it's renewed,
+    since another worker may have taken it over while this worker was stalled.
+    Renewals happen when a recording starts or finishes, so a lease can only run out
+    if no recording starts or finishes for two thirds of config.LEASE_SECONDS.
+    """
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection, worker_id: str, lease_seconds: float | None = None,
+                 run_metrics: metrics.RunMetrics | None = None):
+        """Create a lease keeper.
+
+        Args:
+            orchestrator_connection: Connection to OpenOrchestrator, used to write and check leases.
+            worker_id: The id of this worker.
+            lease_seconds: The length of a lease. Defaults to config.LEASE_SECONDS.
+            run_metrics: The metrics to record the time spent updating OpenOrchestrator in.
+        """
+        self.orchestrator_connection = orchestrator_connection
+        self.message = lease_message(worker_id)
+        self.lease_seconds = lease_seconds or config.LEASE_SECONDS
+        self.run_metrics = run_metrics or metrics.RunMetrics()
+        #  The reference and the monotonic time of the last renewal of each held lease
+        self._held = {}
+
+    def is_held_by_other(self, queue_element: QueueElement) -> bool:
+        """Check if a queue element is leased by another worker and the lease hasn't expired."""
+        return (queue_element.status == QueueStatus.IN_PROGRESS and queue_element.message != self.message
+                and not is_expired(queue_element, self.lease_seconds))
+
+    def acquire(self, queue_element: QueueElement) -> bool:
+        """Lease a queue element, setting it 'In Progress'. An element that was 'In Progress' is read again first,
+        and isn't taken if another worker has leased it since, or has finished it. After its lease is written,
+        it's read once more and given up if another worker wrote a lease on it in the meantime.
+
+        Returns:
+            True if the lease was taken.
+        """
+        contested = queue_element.status == QueueStatus.IN_PROGRESS
+        if contested:
+            current = self._read(queue_element.id, queue_element.reference)
+            if current is None or current.status == QueueStatus.DONE or self.is_held_by_other(current):
+                return False
+        self._write(queue_element.id)
+        if contested:
+            #  Another worker taking over the same lease writes within the wait, and the last lease written is kept
+            time.sleep(config.LEASE_SETTLE_SECONDS)
+            current = self._read(queue_element.id, queue_element.reference)
+            if current is None or current.status != QueueStatus.IN_PROGRESS or current.message != self.message:
+                return False
+        self._held[queue_element.id] = (queue_element.reference, time.monotonic())
+        return True
+
+    def release(self, element_id: str) -> bool:
+        """Stop renewing the lease on a queue element.
+
+        Returns:
+            True if the lease was still held, False if it was lost to another worker.
+        """
+        return self._held.pop(element_id, None) is not None
+
+    def renew_due(self) -> list[str]:
+        """Renew the leases a third of the way into the lease, and drop the leases lost to other workers.
+
+        Returns:
+            The references of the queue elements whose leases were lost.
+        """
+        lost = []
+        now = time.monotonic()
+        for element_id, (reference, renewed) in list(self._held.items()):
+            if now - renewed < self.lease_seconds / 3:
+                continue
+            current = self._read(element_id, reference)
+            if current is None or current.status != QueueStatus.IN_PROGRESS or current.message != self.message:
+                del self._held[element_id]
+                lost.append(reference)
+                continue
+            self._write(element_id)
+            self._held[element_id] = (reference, now)
+        return lost
+
+    def _read(self, element_id: str, reference: str) -> QueueElement | None:
+        with self.run_metrics.time_stage("queue_update"):
+            queue_elements = self.orchestrator_connection.get_queue_elements(config.QUEUE_NAME, reference=reference)
+        return next((queue_element for queue_element in queue_elements if queue_element.id == element_id), None)
+
+    def _write(self, element_id: str) -> None:
+        with self.run_metrics.time_stage("queue_update"):
+            self.orchestrator_connection.set_queue_element_status(element_id, QueueStatus.IN_PROGRESS, self.message)
@@ -8,6 +8,7 @@ import sys
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 from robot_framework import initialize
+from robot_framework.error_reporter import ErrorReporter
 from robot_framework import reset
 from robot_framework.exceptions import BusinessError, handle_error, log_exception
 from robot_framework import process
@@ -22,6 +23,8 @@ def main():
     orchestrator_connection.log_trace("Robot Framework started.")
     initialize.initialize(orchestrator_connection)
 
+    #  Errors are mailed as one digest when the run ends
+    reporter = ErrorReporter(orchestrator_connection)
     error_count = 0
     for _ in range(config.MAX_RETRY_COUNT):
         try:
@@ -31,14 +34,16 @@ def main():
 
         # If any business rules are broken the robot should stop entirely.
         except BusinessError as error:
-            handle_error("Business Error", error, None, orchestrator_connection)
+            handle_error("Business Error", error, None, orchestrator_connection, reporter)
             break
 
         # We actually want to catch all exceptions possible here.
         # pylint: disable-next = broad-exception-caught
         except Exception as error:
             error_count += 1
-            handle_error(f"Process Error #{error_count}", error, None, orchestrator_connection)
+            handle_error(f"Process Error #{error_count}", error, None, orchestrator_connection, reporter)
+
+    reporter.send_digest()
 
     reset.clean_up(orchestrator_connection)
     reset.close_all(orchestrator_connection)
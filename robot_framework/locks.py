@@ -0,0 +1,151 @@
+"""This module contains a lock between processes, kept as a file naming the process that holds it.
+Only the standard library is used, since main.py takes a lock before the virtual environment exists.
+"""
+
+import ctypes
+import os
+import socket
+import time
+import uuid
+
+# Access right to query whether a process has exited, and the exit code of a process that hasn't, on Windows.
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+STILL_ACTIVE = 259
+ERROR_ACCESS_DENIED = 5
+
+
+def process_alive(pid: int) -> bool:
+    """Check if a process on this host is running."""
+    if os.name == "nt":
+        #  os.kill would end the process on Windows, so the process is looked up instead
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileLock:
+    """A lock between processes, held by creating a file with the host name and the process ID of the holder.
+    A lock whose holder has stopped is taken over. The holder of a lock taken on another host can't be checked,
+    so such a lock is taken over once it's older than 'stale_seconds', if given.
+    """
+
+    def __init__(self, path: str, stale_seconds: float | None = None):
+        """Create a lock. It isn't taken until acquire or try_acquire is called.
+
+        Args:
+            path: The path of the lock file.
+            stale_seconds: The age after which a lock held on another host is taken over. If None it never is.
+        """
+        self.path = path
+        self.stale_seconds = stale_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def try_acquire(self) -> bool:
+        """Take the lock if it's free or its holder has stopped.
+
+        Returns:
+            True if the lock was taken.
+        """
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._take_over_stale():
+                    return False
+                continue
+            except FileNotFoundError:
+                #  The folder of the lock was removed
+                return False
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write(self.owner)
+            return True
+
+    def acquire(self, timeout: float | None = None, poll_interval: float = 0.5) -> None:
+        """Take the lock, waiting while another process holds it.
+
+        Args:
+            timeout: The seconds to wait. If None the wait has no limit.
+            poll_interval: The seconds between attempts.
+
+        Raises:
+            TimeoutError: If the lock isn't taken within the timeout.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.try_acquire():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"The lock '{self.path}' is held by {self.holder()}.")
+            time.sleep(poll_interval)
+
+    def release(self) -> None:
+        """Release the lock, if this process still holds it."""
+        if self.holder() == self.owner:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def holder(self) -> str | None:
+        """Get the host name and process ID of the holder of the lock, or None if it's free."""
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self, holder: str) -> bool:
+        host, _, pid = holder.rpartition(":")
+        if host == socket.gethostname() and pid.isdigit():
+            return not process_alive(int(pid))
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return False
+        #  A lock that was just created may not have its holder written yet
+        return self.stale_seconds is not None and age > self.stale_seconds
+
+    def _take_over_stale(self) -> bool:
+        """Remove the lock if its holder has stopped. The lock is moved aside before it's removed,
+        so when several processes find the same stale lock, only one of them removes it.
+
+        Returns:
+            True if the lock may be free now.
+        """
+        holder = self.holder()
+        if holder is None:
+            return True
+        if not self._is_stale(holder):
+            return False
+        aside = f"{self.path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.replace(self.path, aside)
+        except FileNotFoundError:
+            return True
+        with open(aside, encoding="utf-8") as file:
+            moved = file.read().strip()
+        if moved != holder:
+            #  Another process took the lock in the meantime, so it's put back
+            os.replace(aside, self.path)
+            return False
+        os.remove(aside)
+        return True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
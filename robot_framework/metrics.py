@@ -0,0 +1,307 @@
+"""This module collects timings, bytes and retries of a run and reports a summary at the end of it."""
+
+import contextlib
+import cProfile
+import csv
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework import rate_limit
+
+# The backend responsible for each stage of a transfer.
+STAGE_BACKENDS = {
+    "listing": "Miralix",
+    "planning": "Miralix",
+    "download": "Miralix",
+    "upload": "GetOrganized",
+    "queue_update": "OpenOrchestrator"
+}
+
+PROFILE_MODES = ("cprofile", "tracemalloc")
+
+CSV_FIELDS = ("call_id", "queue", "bytes", "download_seconds", "upload_seconds", "retries", "skipped", "error")
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Get a percentile of a list of values using the nearest rank.
+
+    Args:
+        values: The values. Must not be empty.
+        fraction: The percentile as a fraction, eg. 0.99.
+
+    Returns:
+        The value at the percentile.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class RunMetrics:
+    """Collects the time spent in each stage, the bytes transferred and the retries of a run.
+    Times of downloads and uploads include their retries and backoff.
+    The methods can be called from several threads.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        self.stage_times = defaultdict(list)
+        self.retries = Counter()
+        self.recordings = {}
+        self.profile = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time_stage(self, stage: str, call_id: int | None = None):
+        """Time the code in the block as a stage of the run.
+
+        Args:
+            stage: The stage, one of STAGE_BACKENDS.
+            call_id: The call ID of the recording the stage belongs to, if any.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, call_id)
+
+    def add_time(self, stage: str, seconds: float, call_id: int | None = None) -> None:
+        """Add the time spent in a stage.
+
+        Args:
+            stage: The stage, one of STAGE_BACKENDS.
+            seconds: The time spent.
+            call_id: The call ID of the recording the stage belongs to, if any.
+        """
+        with self._lock:
+            self.stage_times[stage].append(seconds)
+            if call_id is not None:
+                recording = self._recording(call_id)
+                recording[f"{stage}_seconds"] = recording.get(f"{stage}_seconds", 0) + seconds
+
+    def add_bytes(self, call_id: int, size: int) -> None:
+        """Add the size of a downloaded recording."""
+        with self._lock:
+            self._recording(call_id)["bytes"] = size
+
+    def bytes_of(self, call_id: int) -> int | None:
+        """Get the size of a downloaded recording, or None if it hasn't been downloaded."""
+        with self._lock:
+            return self.recordings.get(call_id, {}).get("bytes")
+
+    def add_retry(self, stage: str, call_id: int | None = None) -> None:
+        """Count a retry of a call in a stage.
+
+        Args:
+            stage: The stage, one of STAGE_BACKENDS.
+            call_id: The call ID of the recording the retry belongs to, if any.
+        """
+        with self._lock:
+            self.retries[STAGE_BACKENDS[stage]] += 1
+            if call_id is not None:
+                recording = self._recording(call_id)
+                recording["retries"] = recording.get("retries", 0) + 1
+
+    def skip_upload(self, call_id: int) -> None:
+        """Note that the upload of a recording was skipped because it was already in GetOrganized."""
+        with self._lock:
+            self._recording(call_id)["skipped"] = True
+
+    def start_recording(self, recording: dict) -> None:
+        """Note that a recording is about to be transferred."""
+        with self._lock:
+            self._recording(recording["QueueCallId"])["queue"] = recording["QueueName"].strip()
+
+    def finish_recording(self, call_id: int, error: Exception | None) -> None:
+        """Note that the transfer of a recording has finished.
+
+        Args:
+            call_id: The call ID of the recording.
+            error: The error raised while transferring it, or None if it succeeded.
+        """
+        with self._lock:
+            self._recording(call_id)["error"] = repr(error) if error else None
+
+    def failed_call_ids(self) -> list[int]:
+        """Get the call IDs of the recordings that failed, sorted."""
+        with self._lock:
+            return sorted(call_id for call_id, recording in self.recordings.items() if recording.get("error"))
+
+    def _recording(self, call_id: int) -> dict:
+        if call_id not in self.recordings:
+            self.recordings[call_id] = {"call_id": call_id}
+        return self.recordings[call_id]
+
+    def summary(self) -> dict:
+        """Summarize the run so far.
+
+        Returns:
+            A dict with the throughput, the time per stage with percentiles,
+            the retries per backend, the current concurrency limits, the slowest recordings and any profile results.
+        """
+        with self._lock:
+            seconds = time.perf_counter() - self._started
+            recordings = [dict(recording) for recording in self.recordings.values()]
+            stage_times = {stage: list(times) for stage, times in self.stage_times.items()}
+            retries = dict(self.retries)
+
+        total_bytes = sum(recording.get("bytes", 0) for recording in recordings)
+        for recording in recordings:
+            recording["transfer_seconds"] = recording.get("download_seconds", 0) + recording.get("upload_seconds", 0)
+        slowest = sorted(recordings, key=lambda recording: recording["transfer_seconds"], reverse=True)[:config.METRICS_SLOWEST_COUNT]
+
+        return {
+            "started": self.started_at.isoformat(timespec="seconds"),
+            "seconds": round(seconds, 3),
+            "recordings": len(recordings),
+            "failed": sum(1 for recording in recordings if recording.get("error")),
+            "skipped": sum(1 for recording in recordings if recording.get("skipped")),
+            "bytes": total_bytes,
+            "recordings_per_second": round(len(recordings) / seconds, 3) if seconds else None,
+            "mb_per_second": round(total_bytes / 1024 / 1024 / seconds, 3) if seconds else None,
+            "stages": {
+                stage: {
+                    "backend": STAGE_BACKENDS[stage],
+                    "count": len(times),
+                    "total_seconds": round(sum(times), 3),
+                    "p50": round(percentile(times, 0.5), 3),
+                    "p95": round(percentile(times, 0.95), 3),
+                    "p99": round(percentile(times, 0.99), 3),
+                    "max": round(max(times), 3)
+                }
+                for stage, times in stage_times.items() if times
+            },
+            "retries": retries,
+            "limits": rate_limit.snapshots(),
+            "slowest": slowest,
+            "profile": dict(self.profile)
+        }
+
+    def report(self, orchestrator_connection: OrchestratorConnection, directory: str | None = None) -> dict:
+        """Log a summary of the run to OpenOrchestrator and write it to a JSON file,
+        with the timings of each recording in a CSV file next to it.
+
+        Args:
+            orchestrator_connection: Connection to OpenOrchestrator.
+            directory: The folder to write the files in. If None config.METRICS_DIR is used.
+
+        Returns:
+            The summary.
+        """
+        directory = directory or config.METRICS_DIR
+        summary = self.summary()
+        orchestrator_connection.log_info(format_summary(summary))
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(self.file_path(directory, "json"), "w", encoding="utf-8") as file:
+                json.dump(summary, file, indent=2)
+            with self._lock:
+                recordings = [dict(recording) for recording in self.recordings.values()]
+            with open(self.file_path(directory, "csv"), "w", encoding="utf-8", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=CSV_FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(recordings)
+        except OSError as error:
+            orchestrator_connection.log_error(f"Couldn't write run metrics to '{directory}': {error}")
+
+        return summary
+
+    def file_path(self, directory: str, extension: str) -> str:
+        """Get the path of a file belonging to this run, named by the start time of the run."""
+        return os.path.join(directory, f"run_{self.started_at:%Y%m%d_%H%M%S}.{extension}")
+
+
+def format_summary(summary: dict) -> str:
+    """Format a run summary as text for the OpenOrchestrator log.
+
+    Args:
+        summary: A summary from RunMetrics.summary.
+
+    Returns:
+        The summary as lines of text.
+    """
+    lines = [f"Run summary: {summary['recordings']} recordings ({summary['failed']} failed, {summary['skipped']} already uploaded), "
+             f"{summary['bytes'] / 1024 / 1024:.1f} MB in {summary['seconds']:.1f} s, "
+             f"{summary['recordings_per_second'] or 0:.2f} recordings/s, {summary['mb_per_second'] or 0:.2f} MB/s"]
+
+    for stage, stats in summary["stages"].items():
+        lines.append(f"{stage} ({stats['backend']}): n={stats['count']} total={stats['total_seconds']:.1f}s "
+                     f"p50={stats['p50']:.2f}s p95={stats['p95']:.2f}s p99={stats['p99']:.2f}s max={stats['max']:.2f}s")
+
+    if summary["retries"]:
+        lines.append("Retries: " + ", ".join(f"{backend} {count}" for backend, count in summary["retries"].items()))
+
+    for backend, limit in summary["limits"].items():
+        lines.append(f"Limit {backend}: {limit['limit']} concurrent (lowest {limit['lowest_limit']}, {limit['decreases']} decreases, "
+                     f"{limit['timeouts']} timeouts, {limit['retry_after_waits']} Retry-After waits), timeout {limit['timeout_seconds']:.0f}s")
+
+    for recording in summary["slowest"]:
+        lines.append(f"Slow: Call ID {recording['call_id']} {recording['transfer_seconds']:.1f}s "
+                     f"(download {recording.get('download_seconds', 0):.1f}s, upload {recording.get('upload_seconds', 0):.1f}s, "
+                     f"{recording.get('bytes', 0) / 1024 / 1024:.1f} MB, {recording.get('retries', 0)} retries)")
+
+    if "peak_memory_bytes" in summary["profile"]:
+        lines.append(f"Peak traced memory: {summary['profile']['peak_memory_bytes'] / 1024 / 1024:.1f} MB")
+    if "cprofile_file" in summary["profile"]:
+        lines.append(f"Profile written to {summary['profile']['cprofile_file']}")
+
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profiling(modes: str | list[str] | None, run_metrics: RunMetrics, directory: str | None = None):
+    """Profile the code in the block and add the results to the run metrics.
+
+    'cprofile' profiles the calling thread and writes the stats to a .prof file in 'directory'.
+    Work on pipeline threads is covered by the stage timings instead.
+    'tracemalloc' traces allocations on all threads and notes the peak and the largest allocation sites.
+
+    Args:
+        modes: 'cprofile', 'tracemalloc', a list of them, or None to profile nothing.
+        run_metrics: The metrics to add the results to.
+        directory: The folder to write profiles in. If None config.METRICS_DIR is used.
+
+    Raises:
+        ValueError: If a mode is unknown.
+    """
+    modes = {modes} if isinstance(modes, str) else set(modes or ())
+    if not modes <= set(PROFILE_MODES):
+        raise ValueError(f"Unknown profile modes {sorted(modes - set(PROFILE_MODES))}. Use {PROFILE_MODES}.")
+
+    profiler = cProfile.Profile() if "cprofile" in modes else None
+    if "tracemalloc" in modes:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            directory = directory or config.METRICS_DIR
+            os.makedirs(directory, exist_ok=True)
+            path = run_metrics.file_path(directory, "prof")
+            profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(20)
+            run_metrics.profile["cprofile_file"] = path
+            run_metrics.profile["cprofile_top"] = text.getvalue()
+
+        if "tracemalloc" in modes:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            run_metrics.profile["peak_memory_bytes"] = peak
+            run_metrics.profile["top_allocations"] = [str(stat) for stat in snapshot.statistics("lineno")[:10]]
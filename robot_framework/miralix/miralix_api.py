@@ -1,76 +1,457 @@
 """API wrappers for interacting with Miralix"""
 
+import contextlib
+import heapq
 import json
 import os
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Iterator, Mapping
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 from robot_framework import config
+from robot_framework import metrics
+from robot_framework import rate_limit
 
+# Chunk size when streaming a download.
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
 
-def recordings_for_process(orchestrator_connection: OrchestratorConnection, from_queue_call_id: int = 0) -> list[str]:
+# The fields of a listed call kept for the transfer: those used by get_filename and the upload, see compact_recording.
+RECORDING_FIELDS = ("QueueCallId", "QueueName", "ConversationStartedUtc", "AgentName", "Caller")
+# Fields kept if the listing has them: the length of the conversation, used by the planner to estimate the size.
+OPTIONAL_RECORDING_FIELDS = ("ConversationDuration",)
+
+
+class IncompleteDownloadError(Exception):
+    """Raised when a download is shorter or longer than announced by the server."""
+
+
+class MiralixClient:
+    """A client for the Miralix API.
+    Keeps a pool of keep-alive connections and retries connection errors. Throttling and server errors are raised,
+    after the limiter has seen them, and are retried by the caller: get_miralix_data for listings,
+    and retry.retry_call for downloads, so each call has one layer of retries.
+    Concurrent requests and their timeouts are adapted to the responses, see rate_limit.AdaptiveLimiter.
+    The client can be shared between threads.
+    """
+
+    def __init__(self, shared_key: str, base_url: str | None = None, pool_size: int = config.MIRALIX_POOL_SIZE,
+                 retries: int = config.MIRALIX_RETRIES, timeout: float = config.MIRALIX_TIMEOUT):
+        """Create a client.
+
+        Args:
+            shared_key: The Miralix shared secret.
+            base_url: URL of the Miralix API. If None config.MIRALIX_BASE_URL is used.
+            pool_size: The number of connections kept open. Defaults to config.MIRALIX_POOL_SIZE.
+            retries: The number of retries on connection errors. Defaults to config.MIRALIX_RETRIES.
+            timeout: Timeout of requests in seconds until the latency of Miralix is known. Defaults to config.MIRALIX_TIMEOUT.
+        """
+        self.base_url = base_url or config.MIRALIX_BASE_URL
+        self.limiter = rate_limit.get_limiter("Miralix", self.base_url, config.MIRALIX_INITIAL_CONCURRENCY, config.MIRALIX_MAX_CONCURRENCY, timeout)
+        self.session = requests.Session()
+        self.session.headers["X-Miralix-Shared-Secret"] = shared_key
+
+        #  Only connection errors are retried here, since the request never reached Miralix
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=config.MIRALIX_BACKOFF_FACTOR)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def from_orchestrator(cls, orchestrator_connection: OrchestratorConnection) -> "MiralixClient":
+        """Create a client using the shared key stored in OpenOrchestrator.
+
+        Args:
+            orchestrator_connection: Connection object to OpenOrchestrator.
+
+        Returns:
+            The client.
+        """
+        return cls(orchestrator_connection.get_credential(config.MIRALIX_SHARED_KEY).password)
+
+    def get(self, endpoint: str, params: dict | None = None, stream: bool = False) -> requests.Response:
+        """Send a GET request to a Miralix endpoint.
+
+        Args:
+            endpoint: URL after our Miralix ID for endpoint, eg. 'queues/'
+            params: Parameters for get request.
+            stream: Whether to leave the response body unread. Defaults to False.
+
+        Returns:
+            The response.
+        """
+        response = self.limiter.send(lambda timeout: self.session.get(f"{self.base_url}/{endpoint}", params=params, timeout=timeout, stream=stream))
+        response.raise_for_status()  # Raise an error for bad status codes
+        return response
+
+    def head(self, endpoint: str) -> requests.Response:
+        """Send a HEAD request to a Miralix endpoint.
+
+        Args:
+            endpoint: URL after our Miralix ID for endpoint, eg. 'queues/'
+
+        Returns:
+            The response.
+        """
+        response = self.limiter.send(lambda timeout: self.session.head(f"{self.base_url}/{endpoint}", timeout=timeout))
+        response.raise_for_status()
+        return response
+
+    @contextmanager
+    def stream(self, endpoint: str) -> Iterator[requests.Response]:
+        """Send a GET request to a Miralix endpoint and hold a slot of the limiter while the body is read.
+        The time to read the body is recorded with its size, so the timeouts follow the throughput of Miralix.
+
+        Args:
+            endpoint: URL after our Miralix ID for endpoint, eg. 'queues/'
+
+        Yields:
+            The response with the body unread.
+        """
+        with self.limiter.slot():
+            start = time.monotonic()
+            try:
+                response = self.session.get(f"{self.base_url}/{endpoint}", timeout=self.limiter.timeout(), stream=True)
+            except requests.Timeout:
+                self.limiter.record_timeout()
+                raise
+            with response:
+                if not response.ok:
+                    self.limiter.record(time.monotonic() - start, response.status_code, response.headers)
+                    response.raise_for_status()
+                yield response
+                self.limiter.record(time.monotonic() - start, response.status_code, response.headers,
+                                    int(response.headers.get("Content-Length", 0)) or None)
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def recordings_for_process(orchestrator_connection: OrchestratorConnection, from_queue_call_id: int | dict[str, int] = 0,
+                           client: MiralixClient | None = None) -> list[dict]:
     """Get list of recordings from queues specified in process_arguments,
     with an ID higher than the ID provided.
 
     Args:
         orchestrator_connection: Connection object to OpenOrchestrator.
-        from_queue_call_id: Call ID to start download from. Defaults to 0.
+        from_queue_call_id: Call ID to start download from, or a dict of call IDs per queue name. Defaults to 0.
+        client: Client for the Miralix API. If None a client is created from the credential in OpenOrchestrator.
 
     Return:
-        List of recordings.
+        List of recordings sorted by call ID.
+    """
+    return list(iter_recordings_for_process(orchestrator_connection, from_queue_call_id, client))
+
+
+def iter_recordings_for_process(orchestrator_connection: OrchestratorConnection, from_queue_call_id: int | dict[str, int] = 0,
+                                client: MiralixClient | None = None, run_metrics: metrics.RunMetrics | None = None,
+                                queue_names: list[str] | None = None) -> Iterator[dict]:
+    """Get recordings from queues specified in process_arguments, with an ID higher than the ID provided.
+    Each queue is listed in pages of config.MIRALIX_PAGE_SIZE recordings, and the next page of a queue is requested
+    as soon as the previous one arrives. The first pages of all queues are requested concurrently,
+    and the queues are merged into a single stream sorted by call ID, so recordings are yielded as soon as
+    the first pages have arrived instead of after the whole listing.
+
+    Args:
+        orchestrator_connection: Connection object to OpenOrchestrator.
+        from_queue_call_id: Call ID to start download from, or a dict of call IDs per queue name. Defaults to 0.
+        client: Client for the Miralix API. If None a client is created from the credential in OpenOrchestrator.
+        run_metrics: The metrics to record the time of each page in, if any.
+        queue_names: The queues to list. Defaults to "target_queues" in process_arguments.
+
+    Yields:
+        Compact recordings sorted by call ID, see compact_recording.
+    """
+    client = client or MiralixClient.from_orchestrator(orchestrator_connection)
+    queue_ids = get_queue_ids(orchestrator_connection, client, queue_names)
+
+    def list_page(queue_name: str, from_id: int) -> list[dict]:
+        with run_metrics.time_stage("listing") if run_metrics else contextlib.nullcontext():
+            return list_queue_page(queue_ids[queue_name], from_id, client)
+
+    with ThreadPoolExecutor(max_workers=config.MIRALIX_LISTING_WORKERS) as executor:
+        def list_queue(queue_name: str, page: Future) -> Iterator[dict]:
+            previous = []
+            while page is not None:
+                recordings = page.result()
+                if previous and recordings:
+                    note_page_length(previous, client.base_url)
+                page = executor.submit(list_page, queue_name, recordings[-1]["QueueCallId"]) if has_more_pages(recordings, client.base_url) else None
+                previous = recordings
+                yield from recordings
+
+        first_pages = {queue_name: executor.submit(list_page, queue_name, from_call_id(from_queue_call_id, queue_name))
+                       for queue_name in queue_ids}
+        yield from heapq.merge(*(list_queue(queue_name, page) for queue_name, page in first_pages.items()), key=call_id_key)
+
+
+def get_queue_ids(orchestrator_connection: OrchestratorConnection, client: MiralixClient,
+                  queue_names: list[str] | None = None) -> dict[str, str]:
+    """Get the IDs of the queues specified in process_arguments, or of the given queues, by queue name.
+    The cached queue index is refreshed if any queue is missing from it. Queues that aren't in Miralix are left out.
+
+    Args:
+        orchestrator_connection: Connection object to OpenOrchestrator.
+        client: Client for the Miralix API.
+        queue_names: The queues to get the IDs of. Defaults to "target_queues" in process_arguments.
+
+    Returns:
+        A dict of queue names to queue IDs.
     """
-    headers = {
-        "X-Miralix-Shared-Secret": orchestrator_connection.get_credential(config.MIRALIX_SHARED_KEY).password
-    }
+    queue_names = [queue.strip() for queue in queue_names or json.loads(orchestrator_connection.process_arguments)["target_queues"]]
+    queue_index = get_queue_index(client)
+    if any(queue_name not in queue_index for queue_name in queue_names):
+        queue_index = get_queue_index(client, refresh=True)
+    return {queue_name: queue_index[queue_name] for queue_name in queue_names if queue_name in queue_index}
 
-    queue_names = json.loads(orchestrator_connection.process_arguments)["target_queues"]
-    target_queues = get_miralix_data("queues", headers=headers)
 
-    params = {
-        "fromQueueCallId": from_queue_call_id
-    }
+def list_queue_page(queue_id: str, from_id: int, client: MiralixClient) -> list[dict]:
+    """Get a page of up to config.MIRALIX_PAGE_SIZE recordings in a queue, with an ID higher than 'from_id'.
 
-    recordings = []
-    for queue in queue_names:
-        queue_id = get_queue_id(queue, target_queues)
-        if queue_id:
-            calls = get_miralix_data(f"queues/{queue_id}/calls/recordings", headers=headers, params=params)
-            if calls:
-                recordings.extend(calls)
-    return recordings
+    Args:
+        queue_id: The ID of the queue.
+        from_id: The call ID to list from.
+        client: Client for the Miralix API.
+
+    Returns:
+        Compact recordings sorted by call ID, see compact_recording.
+    """
+    params = {"fromQueueCallId": from_id, config.MIRALIX_PAGE_SIZE_PARAMETER: config.MIRALIX_PAGE_SIZE}
+    calls = get_miralix_data(f"queues/{queue_id}/calls/recordings", client, params=params) or []
+    return sorted((compact_recording(call) for call in calls), key=call_id_key)
+
+
+_page_lengths: dict[str, int] = {}
+
+
+def has_more_pages(recordings: list[dict], base_url: str) -> bool:
+    """Check if there may be more recordings after a page of a queue listing.
+    Miralix may return shorter pages than asked for, so a short page only ends the listing once Miralix has been seen
+    to return longer pages, see note_page_length. Otherwise the next page is requested, and an empty page ends the listing.
+
+    Args:
+        recordings: The page.
+        base_url: The URL of the Miralix API listed.
+    """
+    page_length = _page_lengths.get(base_url)
+    return bool(recordings) and (page_length is None or len(recordings) >= min(page_length, config.MIRALIX_PAGE_SIZE))
+
+
+def note_page_length(recordings: list[dict], base_url: str) -> None:
+    """Note the length of a page that was followed by more recordings. Miralix returns at least that many recordings
+    on a page while it has more, so the longest such page is kept for the process.
+
+    Args:
+        recordings: The page.
+        base_url: The URL of the Miralix API listed.
+    """
+    _page_lengths[base_url] = max(_page_lengths.get(base_url, 0), len(recordings))
+
+
+def compact_recording(call: dict) -> dict:
+    """Keep only the fields of a listed call that the transfer uses, see RECORDING_FIELDS and OPTIONAL_RECORDING_FIELDS.
+    The listing of a call has many more fields, which add up on big listings.
+    """
+    recording = {field: call[field] for field in RECORDING_FIELDS}
+    recording.update({field: call[field] for field in OPTIONAL_RECORDING_FIELDS if field in call})
+    return recording
 
 
-def get_miralix_data(endpoint, headers, params=None, ) -> json:
+def from_call_id(from_queue_call_id: int | dict[str, int], queue_name: str) -> int:
+    """Get the call ID to list a queue from.
+
+    Args:
+        from_queue_call_id: Call ID to start download from, or a dict of call IDs per queue name.
+        queue_name: The name of the queue.
+
+    Returns:
+        The call ID, 0 if the queue isn't in the dict.
+    """
+    if isinstance(from_queue_call_id, dict):
+        return from_queue_call_id.get(queue_name, 0)
+    return from_queue_call_id
+
+
+def call_id_key(recording: dict) -> int:
+    """Get the call ID of a recording, used as a sort key."""
+    return recording["QueueCallId"]
+
+
+def get_queue_index(client: MiralixClient, refresh: bool = False) -> dict[str, str]:
+    """Get a dict of queue names to queue IDs.
+    The index is cached in a local file for config.MIRALIX_QUEUE_CACHE_TTL seconds.
+
+    Args:
+        client: Client for the Miralix API.
+        refresh: Whether to ignore the cache and fetch the queues from Miralix. Defaults to False.
+
+    Returns:
+        A dict of queue names to queue IDs.
+    """
+    queue_index = None if refresh else read_queue_cache()
+    if queue_index is None:
+        queue_index = {queue["Name"].strip(): queue["Id"] for queue in get_miralix_data("queues", client)}
+        write_queue_cache(queue_index)
+    return queue_index
+
+
+def read_queue_cache() -> dict[str, str] | None:
+    """Read the cached index of queue names to queue IDs.
+
+    Returns:
+        The index, or None if there is no cache or it's older than config.MIRALIX_QUEUE_CACHE_TTL.
+    """
+    if not os.path.exists(config.MIRALIX_QUEUE_CACHE_FILE):
+        return None
+    with open(config.MIRALIX_QUEUE_CACHE_FILE, encoding="utf-8") as file:
+        cache = json.load(file)
+    if time.time() - cache["created"] >= config.MIRALIX_QUEUE_CACHE_TTL:
+        return None
+    return cache["queues"]
+
+
+def write_queue_cache(queue_index: dict[str, str]) -> None:
+    """Replace the cached index of queue names to queue IDs.
+
+    Args:
+        queue_index: A dict of queue names to queue IDs.
+    """
+    directory = os.path.dirname(os.path.abspath(config.MIRALIX_QUEUE_CACHE_FILE))
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False) as file:
+        json.dump({"created": time.time(), "queues": queue_index}, file)
+    os.replace(file.name, config.MIRALIX_QUEUE_CACHE_FILE)
+
+
+def get_miralix_data(endpoint: str, client: MiralixClient, params: dict | None = None) -> json:
     """Contact Miralix API endpoint to receive JSON data.
+    Status 429 and 5xx are retried config.MIRALIX_RETRIES times with exponential backoff.
 
     Args:
         endpoint: URL after our Miralix ID for endpoint, eg. 'queues/'
+        client: Client for the Miralix API.
         params: Parameters for get request
-        headers: Header for get request. Requires an SSK from Miralix
 
     Returns:
         JSON formatted data.
     """
-    response = requests.get(f"{config.MIRALIX_BASE_URL}/{endpoint}", params=params, headers=headers, timeout=config.MIRALIX_TIMEOUT)
-    response.raise_for_status()  # Raise an error for bad status codes
-    return response.json()
+    attempt = 0
+    while True:
+        try:
+            return client.get(endpoint, params=params).json()
+        except requests.HTTPError as error:
+            status_code = error.response.status_code
+            if attempt == config.MIRALIX_RETRIES or (status_code != 429 and status_code < 500):
+                raise
+        #  The limiter holds back the next request until any Retry-After has passed
+        time.sleep(config.MIRALIX_BACKOFF_FACTOR * 2 ** attempt)
+        attempt += 1
 
 
-def download_file(call_id, password):
+def download_file(call_id: int, client: MiralixClient) -> bytes:
     """Download a specified file from Miralix.
 
     Args:
         call_id: ID of the call to download
-        password: password for Miralix
+        client: Client for the Miralix API.
 
     Returns:
         The file content downloaded.
     """
-    headers = {
-        "X-Miralix-Shared-Secret": password
-    }
-    return requests.get(f'{config.MIRALIX_BASE_URL}/queues/calls/recordings/{call_id}', headers=headers, timeout=config.MIRALIX_TIMEOUT).content
+    return client.get(f"queues/calls/recordings/{call_id}").content
+
+
+def recording_size(call_id: int, client: MiralixClient) -> int | None:
+    """Get the size of a recording from the Content-Length of a HEAD request, without downloading it.
+
+    Args:
+        call_id: ID of the call.
+        client: Client for the Miralix API.
+
+    Returns:
+        The size in bytes, or None if Miralix doesn't send a Content-Length.
+    """
+    size = client.head(f"queues/calls/recordings/{call_id}").headers.get("Content-Length")
+    return int(size) if size else None
+
+
+def download_file_stream(call_id: int, client: MiralixClient, spool_size: int = config.MIRALIX_SPOOL_SIZE,
+                         hasher: Any = None) -> BinaryIO:
+    """Download a specified file from Miralix in chunks.
+    The file is kept in memory up to 'spool_size' bytes and is moved to a temporary file on disk above that,
+    so memory use doesn't depend on the size of the recording.
+
+    Args:
+        call_id: ID of the call to download
+        client: Client for the Miralix API.
+        spool_size: The number of bytes kept in memory before spooling to disk. Defaults to config.MIRALIX_SPOOL_SIZE.
+        hasher: A hashlib object, eg. hashlib.sha256(), updated with the content as it's downloaded.
+
+    Returns:
+        A binary file object with the file content, positioned at the start. The caller should close it.
+
+    Raises:
+        IncompleteDownloadError: If the size of the download doesn't match the Content-Length of the response.
+    """
+    with spool_file(spool_size) as file:
+        with client.stream(f"queues/calls/recordings/{call_id}") as response:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                if hasher:
+                    hasher.update(chunk)
+            check_download_size(call_id, response.headers, file.tell())
+    return file
+
+
+@contextmanager
+def spool_file(spool_size: int) -> Iterator[BinaryIO]:
+    """Create a spooled temporary file to download into.
+    The file is closed if the block raises, and is otherwise left open and positioned at the start.
+
+    Args:
+        spool_size: The number of bytes kept in memory before spooling to disk.
+
+    Yields:
+        The file.
+    """
+    # The file is returned open to the caller.
+    # pylint: disable-next = consider-using-with
+    file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        yield file
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+
+
+def check_download_size(call_id: int, headers: Mapping[str, str], size: int) -> None:
+    """Check the size of a download against the Content-Length of the response.
+    The check is skipped if the response is compressed, since Content-Length is then the compressed size.
+
+    Args:
+        call_id: ID of the downloaded call.
+        headers: The headers of the response.
+        size: The number of bytes downloaded.
+
+    Raises:
+        IncompleteDownloadError: If the sizes don't match.
+    """
+    expected_size = headers.get("Content-Length")
+    if expected_size is not None and "Content-Encoding" not in headers and int(expected_size) != size:
+        raise IncompleteDownloadError(f"Download of call {call_id} was {size} bytes, expected {expected_size} bytes.")
 
 
 def get_filename(recording) -> str:
@@ -90,23 +471,6 @@ def get_filename(recording) -> str:
     return f"{queue}_{time_started}_{agent}_{caller}_{file_id}.mp3"
 
 
-def get_queue_id(queue_name: str, queues: object) -> str:
-    """Find the ID of the queue with 'queue_name' in the 'queue' json object.
-
-    Args:
-        queue_name: The name of the queue we are looking for.
-        queues: A JSON with a collection of queues.
-
-    Returns:
-        Return the ID of the queue.
-    """
-    queue_name = queue_name.strip()
-    for queue in queues:
-        if queue["Name"] == queue_name:
-            return queue["Id"]
-    return None
-
-
 if __name__ == "__main__":
     conn_string = os.getenv("OpenOrchestratorConnString")
     crypto_key = os.getenv("OpenOrchestratorKey")
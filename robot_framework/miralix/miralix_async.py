@@ -0,0 +1,290 @@
+"""Async API wrappers for interacting with Miralix, mirroring miralix_api."""
+
+# The async code mirrors the threaded code line for line in places.
+# pylint: disable=duplicate-code
+
+import asyncio
+import collections
+import contextlib
+import json
+import time
+from typing import Any, AsyncIterator, BinaryIO
+
+import httpx
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework import metrics
+from robot_framework import rate_limit
+from robot_framework.miralix import miralix_api
+from robot_framework.miralix.miralix_api import call_id_key, check_download_size, from_call_id
+
+
+class AsyncMiralixClient:
+    """An async client for the Miralix API with a pool of keep-alive connections.
+    Connection errors are retried by the transport. Throttling and server errors are raised, after the limiter has seen them,
+    and are retried by the caller like with miralix_api.MiralixClient: get_miralix_data for listings,
+    and retry.async_retry_call for downloads, so each call has one layer of retries.
+    Concurrent requests and their timeouts are adapted to the responses, see rate_limit.AdaptiveLimiter.
+    """
+
+    def __init__(self, shared_key: str, base_url: str | None = None, max_connections: int = config.ASYNC_MAX_TRANSFERS,
+                 retries: int = config.MIRALIX_RETRIES, timeout: float = config.MIRALIX_TIMEOUT):
+        """Create a client.
+
+        Args:
+            shared_key: The Miralix shared secret.
+            base_url: URL of the Miralix API. If None config.MIRALIX_BASE_URL is used.
+            max_connections: The maximum number of open connections. Defaults to config.ASYNC_MAX_TRANSFERS.
+            retries: The number of retries on connection errors. Defaults to config.MIRALIX_RETRIES.
+            timeout: Timeout of requests in seconds until the latency of Miralix is known. Defaults to config.MIRALIX_TIMEOUT.
+        """
+        self.base_url = base_url or config.MIRALIX_BASE_URL
+        #  The concurrency has its own ceiling, since the limiter is shared with the threaded client of later runs
+        self.limiter = rate_limit.get_limiter("Miralix", self.base_url, config.MIRALIX_INITIAL_CONCURRENCY, config.MIRALIX_MAX_CONCURRENCY, timeout)
+        self.client = httpx.AsyncClient(base_url=f"{self.base_url}/", headers={"X-Miralix-Shared-Secret": shared_key}, timeout=timeout,
+                                        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                                        transport=httpx.AsyncHTTPTransport(retries=retries))
+
+    @classmethod
+    def from_orchestrator(cls, orchestrator_connection: OrchestratorConnection) -> "AsyncMiralixClient":
+        """Create a client using the shared key stored in OpenOrchestrator.
+
+        Args:
+            orchestrator_connection: Connection object to OpenOrchestrator.
+
+        Returns:
+            The client.
+        """
+        return cls(orchestrator_connection.get_credential(config.MIRALIX_SHARED_KEY).password)
+
+    async def get(self, endpoint: str, params: dict | None = None) -> httpx.Response:
+        """Send a GET request to a Miralix endpoint.
+
+        Args:
+            endpoint: URL after our Miralix ID for endpoint, eg. 'queues/'
+            params: Parameters for get request.
+
+        Returns:
+            The response.
+        """
+        async with self.limiter.async_slot():
+            start = time.monotonic()
+            try:
+                response = await self.client.get(endpoint, params=params, timeout=self.limiter.timeout())
+            except httpx.TimeoutException:
+                self.limiter.record_timeout()
+                raise
+            self.limiter.record(time.monotonic() - start, response.status_code, response.headers)
+        response.raise_for_status()
+        return response
+
+    @contextlib.asynccontextmanager
+    async def stream(self, endpoint: str) -> AsyncIterator[httpx.Response]:
+        """Send a GET request to a Miralix endpoint and hold a slot of the limiter while the body is read,
+        like miralix_api.MiralixClient.stream.
+
+        Args:
+            endpoint: URL after our Miralix ID for endpoint, eg. 'queues/'
+
+        Yields:
+            The response with the body unread.
+        """
+        async with self.limiter.async_slot():
+            start = time.monotonic()
+            try:
+                async with self.client.stream("GET", endpoint, timeout=self.limiter.timeout()) as response:
+                    if not response.is_success:
+                        self.limiter.record(time.monotonic() - start, response.status_code, response.headers)
+                        response.raise_for_status()
+                    yield response
+                    self.limiter.record(time.monotonic() - start, response.status_code, response.headers,
+                                        int(response.headers.get("Content-Length", 0)) or None)
+            except httpx.TimeoutException:
+                self.limiter.record_timeout()
+                raise
+
+    async def aclose(self) -> None:
+        """Close all pooled connections."""
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+
+async def recordings_for_process(orchestrator_connection: OrchestratorConnection, from_queue_call_id: int | dict[str, int] = 0,
+                                 client: AsyncMiralixClient | None = None) -> list[dict]:
+    """Get list of recordings from queues specified in process_arguments,
+    with an ID higher than the ID provided. The queues are listed concurrently.
+
+    Args:
+        orchestrator_connection: Connection object to OpenOrchestrator.
+        from_queue_call_id: Call ID to start download from, or a dict of call IDs per queue name. Defaults to 0.
+        client: Client for the Miralix API. If None a client is created from the credential in OpenOrchestrator.
+
+    Return:
+        List of recordings sorted by call ID.
+    """
+    if client is None:
+        async with AsyncMiralixClient.from_orchestrator(orchestrator_connection) as new_client:
+            return await recordings_for_process(orchestrator_connection, from_queue_call_id, new_client)
+
+    return [recording async for page in iter_recording_pages(orchestrator_connection, from_queue_call_id, client) for recording in page]
+
+
+async def iter_recording_pages(orchestrator_connection: OrchestratorConnection, from_queue_call_id: int | dict[str, int],
+                               client: AsyncMiralixClient, run_metrics: metrics.RunMetrics | None = None) -> AsyncIterator[list[dict]]:
+    """Get recordings from queues specified in process_arguments, with an ID higher than the ID provided,
+    in pages of up to config.MIRALIX_PAGE_SIZE recordings sorted by call ID across the queues.
+    Like miralix_api.iter_recordings_for_process, each queue is listed in pages with the next page
+    requested as soon as the previous one arrives, and the first pages of all queues are requested concurrently.
+
+    Args:
+        orchestrator_connection: Connection object to OpenOrchestrator.
+        from_queue_call_id: Call ID to start download from, or a dict of call IDs per queue name.
+        client: Client for the Miralix API.
+        run_metrics: The metrics to record the time of each page in, if any.
+
+    Yields:
+        Pages of compact recordings, see miralix_api.compact_recording.
+    """
+    queue_ids = await get_queue_ids(orchestrator_connection, client)
+
+    async def list_page(queue_name: str, from_id: int) -> list[dict]:
+        with run_metrics.time_stage("listing") if run_metrics else contextlib.nullcontext():
+            params = {"fromQueueCallId": from_id, config.MIRALIX_PAGE_SIZE_PARAMETER: config.MIRALIX_PAGE_SIZE}
+            calls = await get_miralix_data(f"queues/{queue_ids[queue_name]}/calls/recordings", client, params=params) or []
+        return sorted((miralix_api.compact_recording(call) for call in calls), key=call_id_key)
+
+    #  The listed recordings of each queue, its last page, and the request for the next page of the queues that may have more
+    listed = {queue_name: collections.deque() for queue_name in queue_ids}
+    last_pages = dict.fromkeys(queue_ids, [])
+    next_pages = {queue_name: asyncio.create_task(list_page(queue_name, from_call_id(from_queue_call_id, queue_name)))
+                  for queue_name in queue_ids}
+    try:
+        page = []
+        while True:
+            #  A queue with nothing listed must get its next page before anything is merged past it
+            for queue_name in [queue_name for queue_name in next_pages if not listed[queue_name]]:
+                recordings = await next_pages.pop(queue_name)
+                if last_pages[queue_name] and recordings:
+                    miralix_api.note_page_length(last_pages[queue_name], client.base_url)
+                if miralix_api.has_more_pages(recordings, client.base_url):
+                    next_pages[queue_name] = asyncio.create_task(list_page(queue_name, recordings[-1]["QueueCallId"]))
+                last_pages[queue_name] = recordings
+                listed[queue_name].extend(recordings)
+
+            heads = [recordings for recordings in listed.values() if recordings]
+            if not heads:
+                break
+            page.append(min(heads, key=lambda recordings: recordings[0]["QueueCallId"]).popleft())
+            if len(page) >= config.MIRALIX_PAGE_SIZE:
+                yield page
+                page = []
+        if page:
+            yield page
+    finally:
+        for task in next_pages.values():
+            task.cancel()
+
+
+async def get_queue_ids(orchestrator_connection: OrchestratorConnection, client: AsyncMiralixClient) -> dict[str, str]:
+    """Get the IDs of the queues specified in process_arguments by queue name, see miralix_api.get_queue_ids.
+
+    Args:
+        orchestrator_connection: Connection object to OpenOrchestrator.
+        client: Client for the Miralix API.
+
+    Returns:
+        A dict of queue names to queue IDs.
+    """
+    queue_names = [queue.strip() for queue in json.loads(orchestrator_connection.process_arguments)["target_queues"]]
+    queue_index = await get_queue_index(client)
+    if any(queue_name not in queue_index for queue_name in queue_names):
+        queue_index = await get_queue_index(client, refresh=True)
+    return {queue_name: queue_index[queue_name] for queue_name in queue_names if queue_name in queue_index}
+
+
+async def get_queue_index(client: AsyncMiralixClient, refresh: bool = False) -> dict[str, str]:
+    """Get a dict of queue names to queue IDs, using the same cache as miralix_api.get_queue_index.
+
+    Args:
+        client: Client for the Miralix API.
+        refresh: Whether to ignore the cache and fetch the queues from Miralix. Defaults to False.
+
+    Returns:
+        A dict of queue names to queue IDs.
+    """
+    queue_index = None if refresh else miralix_api.read_queue_cache()
+    if queue_index is None:
+        queue_index = {queue["Name"].strip(): queue["Id"] for queue in await get_miralix_data("queues", client)}
+        miralix_api.write_queue_cache(queue_index)
+    return queue_index
+
+
+async def get_miralix_data(endpoint: str, client: AsyncMiralixClient, params: dict | None = None) -> json:
+    """Contact Miralix API endpoint to receive JSON data, like miralix_api.get_miralix_data.
+    Status 429 and 5xx are retried config.MIRALIX_RETRIES times with exponential backoff.
+
+    Args:
+        endpoint: URL after our Miralix ID for endpoint, eg. 'queues/'
+        client: Client for the Miralix API.
+        params: Parameters for get request
+
+    Returns:
+        JSON formatted data.
+    """
+    attempt = 0
+    while True:
+        try:
+            return (await client.get(endpoint, params=params)).json()
+        except httpx.HTTPStatusError as error:
+            status_code = error.response.status_code
+            if attempt == config.MIRALIX_RETRIES or (status_code != 429 and status_code < 500):
+                raise
+        #  The limiter holds back the next request until any Retry-After has passed
+        await asyncio.sleep(config.MIRALIX_BACKOFF_FACTOR * 2 ** attempt)
+        attempt += 1
+
+
+async def download_file(call_id: int, client: AsyncMiralixClient) -> bytes:
+    """Download a specified file from Miralix.
+
+    Args:
+        call_id: ID of the call to download
+        client: Client for the Miralix API.
+
+    Returns:
+        The file content downloaded.
+    """
+    return (await client.get(f"queues/calls/recordings/{call_id}")).content
+
+
+async def download_file_stream(call_id: int, client: AsyncMiralixClient, spool_size: int = config.MIRALIX_SPOOL_SIZE,
+                               hasher: Any = None) -> BinaryIO:
+    """Download a specified file from Miralix in chunks into a spooled temporary file,
+    like miralix_api.download_file_stream.
+
+    Args:
+        call_id: ID of the call to download
+        client: Client for the Miralix API.
+        spool_size: The number of bytes kept in memory before spooling to disk. Defaults to config.MIRALIX_SPOOL_SIZE.
+        hasher: A hashlib object, eg. hashlib.sha256(), updated with the content as it's downloaded.
+
+    Returns:
+        A binary file object with the file content, positioned at the start. The caller should close it.
+
+    Raises:
+        miralix_api.IncompleteDownloadError: If the size of the download doesn't match the Content-Length of the response.
+    """
+    with miralix_api.spool_file(spool_size) as file:
+        async with client.stream(f"queues/calls/recordings/{call_id}") as response:
+            async for chunk in response.aiter_bytes(miralix_api.DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                if hasher:
+                    hasher.update(chunk)
+            check_download_size(call_id, response.headers, file.tell())
+    return file
@@ -0,0 +1,432 @@
+"""This module contains a durable on-disk outbox between the download from Miralix and the upload to GetOrganized.
+It's selected with "outbox" in the process arguments.
+"""
+
+import contextlib
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, Callable, Iterator
+
+from OpenOrchestrator.database.queues import QueueStatus
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework import locks
+from robot_framework import pipeline
+from robot_framework import queue_util
+from robot_framework import retry
+from robot_framework import sharding
+from robot_framework import transfer
+from robot_framework import transfer_run
+
+# The number of seconds an idle upload worker waits for an entry before checking if it should stop.
+CLAIM_POLL_INTERVAL = 1.0
+
+# The characters of a case number that are replaced in the file names of the outbox.
+UNSAFE_CHARACTERS = re.compile(r"[^\w-]")
+
+# The lock file of a slot of the outbox, naming the process that holds the slot.
+LOCK_FILE = "outbox.lock"
+
+
+class OutboxFullError(Exception):
+    """Raised when a recording can't be stored because the outbox stays full."""
+
+
+@dataclass
+class OutboxEntry:
+    """A downloaded recording waiting in the outbox, with the SHA-256 hash of its content in recording["Sha256"]."""
+    recording: dict
+    case_number: str
+    size: int
+    stored_at: float
+
+    @property
+    def call_id(self) -> int:
+        """The call ID of the recording."""
+        return self.recording["QueueCallId"]
+
+    @property
+    def key(self) -> tuple[str, int]:
+        """The case and the call ID, which tell the entries of the outbox apart."""
+        return self.case_number, self.call_id
+
+
+class Outbox:
+    """Keeps downloaded recordings on disk until they are uploaded, so they survive a crash or a restart.
+    Each entry is a data file and a JSON file with the recording, the case and the size, named by the case and the call ID,
+    so the same recording can wait for several cases. Both are written to
+    temporary files and moved in place, the JSON file last, so an entry is either complete or left out when loaded.
+    Entries are evicted as soon as they are uploaded.
+
+    Several processes can share the folder of the outbox. Each process holds a numbered slot folder of its own,
+    and takes over the entries of slots whose process has stopped, so no entry is uploaded by two processes.
+
+    The outbox holds at most 'max_bytes', and storing a recording waits for space. Entries that fail to upload
+    are held back with exponential backoff. The methods can be called from several threads.
+    """
+
+    def __init__(self, directory: str | None = None, max_bytes: int | None = None):
+        """Open an outbox in a free slot of the folder, loading the entries left by earlier runs. Call close when done.
+
+        Args:
+            directory: The folder of the outbox. Defaults to config.OUTBOX_DIR.
+            max_bytes: The highest number of bytes in the outbox. Defaults to config.OUTBOX_MAX_BYTES.
+        """
+        root = directory or config.OUTBOX_DIR
+        self.max_bytes = max_bytes or config.OUTBOX_MAX_BYTES
+        self.lock = self._take_slot(root)
+        self._adopt(root)
+        self._entries = self._load()
+        #  Bytes being written, the entries being uploaded, and the failures and retry time of entries that failed
+        self._reserved = 0
+        self._claimed = set()
+        self._retry_at = {}
+        self._condition = threading.Condition()
+
+    @property
+    def directory(self) -> str:
+        """The slot folder of this process."""
+        return os.path.dirname(self.lock.path)
+
+    @staticmethod
+    def _take_slot(root: str) -> locks.FileLock:
+        """Lock the first slot folder that no running process holds."""
+        number = 0
+        while True:
+            directory = os.path.join(root, str(number))
+            os.makedirs(directory, exist_ok=True)
+            lock = locks.FileLock(os.path.join(directory, LOCK_FILE))
+            if lock.try_acquire():
+                return lock
+            number += 1
+
+    def _adopt(self, root: str) -> None:
+        """Move the entries of the slots no running process holds into the slot of this process, and remove those slots."""
+        for name in os.listdir(root):
+            other = os.path.join(root, name)
+            if not name.isdigit() or other == self.directory or not locks.FileLock(os.path.join(other, LOCK_FILE)).try_acquire():
+                continue
+            #  The data file is moved first, so an entry is never complete without its data
+            for metadata_name in [file_name for file_name in os.listdir(other) if file_name.endswith(".json")]:
+                data_name = f"{metadata_name.removesuffix('.json')}.mp3"
+                if not os.path.exists(os.path.join(self.directory, metadata_name)) and os.path.exists(os.path.join(other, data_name)):
+                    os.replace(os.path.join(other, data_name), os.path.join(self.directory, data_name))
+                    os.replace(os.path.join(other, metadata_name), os.path.join(self.directory, metadata_name))
+            shutil.rmtree(other, ignore_errors=True)
+
+    def close(self) -> None:
+        """Release the slot of the outbox, so its entries are taken over by the next process to open the outbox."""
+        self.lock.release()
+
+    def _paths(self, entry: OutboxEntry) -> tuple[str, str]:
+        name = f"{UNSAFE_CHARACTERS.sub('_', entry.case_number)}_{entry.call_id}"
+        return os.path.join(self.directory, f"{name}.mp3"), os.path.join(self.directory, f"{name}.json")
+
+    def _load(self) -> dict[tuple[str, int], OutboxEntry]:
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name), encoding="utf-8") as file:
+                    entry = OutboxEntry(**json.load(file))
+                if os.path.exists(self._paths(entry)[0]):
+                    entries[entry.key] = entry
+
+        #  Remove files of entries that were never completed
+        kept = {os.path.basename(path) for entry in entries.values() for path in self._paths(entry)} | {LOCK_FILE}
+        for name in set(os.listdir(self.directory)) - kept:
+            os.remove(os.path.join(self.directory, name))
+        return entries
+
+    def _bytes(self) -> int:
+        return sum(entry.size for entry in self._entries.values()) + self._reserved
+
+    def put(self, recording: dict, case_number: str, file_data: bytes | BinaryIO, timeout: float | None = None) -> OutboxEntry:
+        """Store a downloaded recording, waiting for space if the outbox is full.
+
+        Args:
+            recording: The recording, with the hash of its content in recording["Sha256"].
+            case_number: The GetOrganized case to upload to.
+            file_data: The file content.
+            timeout: The seconds to wait for space. Defaults to config.OUTBOX_FULL_TIMEOUT.
+
+        Returns:
+            The entry.
+
+        Raises:
+            OutboxFullError: If there's no space within the timeout.
+        """
+        size = pipeline.size_of(file_data)
+        deadline = time.monotonic() + (timeout if timeout is not None else config.OUTBOX_FULL_TIMEOUT)
+        with self._condition:
+            #  A recording bigger than the outbox is stored when the outbox is empty
+            while (self._entries or self._reserved) and self._bytes() + size > self.max_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise OutboxFullError(f"The outbox has no space for call ID {recording['QueueCallId']} ({size} bytes).")
+                self._condition.wait(remaining)
+            self._reserved += size
+
+        entry = OutboxEntry(recording, case_number, size, time.time())
+        data_path, metadata_path = self._paths(entry)
+        try:
+            if isinstance(file_data, bytes):
+                self._write(data_path, lambda file: file.write(file_data))
+            else:
+                file_data.seek(0)
+                self._write(data_path, lambda file: shutil.copyfileobj(file_data, file))
+            self._write(metadata_path, lambda file: file.write(json.dumps(asdict(entry)).encode("utf-8")))
+        except BaseException:
+            with self._condition:
+                self._reserved -= size
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            self._reserved -= size
+            self._entries[entry.key] = entry
+            self._condition.notify_all()
+        return entry
+
+    def _write(self, path: str, write: Callable[[BinaryIO], None]) -> None:
+        with tempfile.NamedTemporaryFile("wb", dir=self.directory, suffix=".tmp", delete=False) as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, path)
+
+    def claim(self, case_number: str, timeout: float) -> OutboxEntry | None:
+        """Take the entry of a case with the lowest call ID that isn't being uploaded or held back after a failure.
+
+        Args:
+            case_number: The case to take an entry of.
+            timeout: The seconds to wait for an entry.
+
+        Returns:
+            The entry, or None if there was none within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                ready = [key for key, entry in self._entries.items()
+                         if entry.case_number == case_number and key not in self._claimed and self._retry_at.get(key, (0, 0))[1] <= now]
+                if ready:
+                    key = min(ready)
+                    self._claimed.add(key)
+                    return self._entries[key]
+                if now >= deadline:
+                    return None
+                self._condition.wait(deadline - now)
+
+    def open(self, entry: OutboxEntry) -> BinaryIO:
+        """Open the data file of an entry."""
+        return open(self._paths(entry)[0], "rb")
+
+    def complete(self, entry: OutboxEntry) -> None:
+        """Evict an uploaded entry."""
+        for path in self._paths(entry)[::-1]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        with self._condition:
+            del self._entries[entry.key]
+            self._claimed.discard(entry.key)
+            self._retry_at.pop(entry.key, None)
+            self._condition.notify_all()
+
+    def release(self, entry: OutboxEntry) -> None:
+        """Give back an entry that failed to upload, holding it back with exponential backoff."""
+        with self._condition:
+            failures = self._retry_at.get(entry.key, (0, 0))[0]
+            self._retry_at[entry.key] = (failures + 1, time.monotonic() + retry.backoff_delay(failures))
+            self._claimed.discard(entry.key)
+            self._condition.notify_all()
+
+    def pending(self, case_number: str) -> int:
+        """Get the number of entries of a case."""
+        with self._condition:
+            return sum(1 for entry in self._entries.values() if entry.case_number == case_number)
+
+
+class OutboxUploader:
+    """Uploads the entries of a case from the outbox on its own threads, at the rate GetOrganized allows.
+    Entries stored by earlier runs are uploaded as well. An entry that fails is held back and tried again later.
+    """
+
+    def __init__(self, box: Outbox, case_number: str, upload: Callable[[dict, BinaryIO], None], workers: int | None = None):
+        """Create an uploader.
+
+        Args:
+            box: The outbox.
+            case_number: The case to upload the entries of.
+            upload: Function uploading a recording, e.g. RecordingTransfer.upload.
+            workers: The number of upload threads. Defaults to config.GO_UPLOAD_WORKERS.
+        """
+        self.outbox = box
+        self.case_number = case_number
+        self.upload = upload
+        self.results = queue.Queue()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers or config.GO_UPLOAD_WORKERS)]
+        self._stopping = threading.Event()
+        self._last_progress = time.monotonic()
+
+    def start(self) -> None:
+        """Start the upload threads."""
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self) -> None:
+        while not (self._stopping.is_set() and (self.outbox.pending(self.case_number) == 0
+                                                or time.monotonic() - self._last_progress > config.OUTBOX_DRAIN_TIMEOUT)):
+            entry = self.outbox.claim(self.case_number, CLAIM_POLL_INTERVAL)
+            if entry is None:
+                continue
+            try:
+                with self.outbox.open(entry) as file:
+                    self.upload(entry.recording, file)
+            # Any error is reported back for the entry, which stays in the outbox.
+            # pylint: disable-next = broad-exception-caught
+            except Exception as error:
+                self.outbox.release(entry)
+                self.results.put((entry, error))
+                continue
+            self.outbox.complete(entry)
+            self._last_progress = time.monotonic()
+            self.results.put((entry, None))
+
+    def finished(self) -> Iterator[tuple[OutboxEntry, Exception | None]]:
+        """Get the uploads finished so far without waiting.
+
+        Yields:
+            Each entry with the error raised while uploading it, or None if it was uploaded.
+        """
+        while True:
+            try:
+                yield self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def drain(self) -> Iterator[tuple[OutboxEntry, Exception | None]]:
+        """Keep uploading until the outbox has no entries of the case, or no upload has succeeded
+        for config.OUTBOX_DRAIN_TIMEOUT seconds, and stop the upload threads.
+
+        Yields:
+            Each entry with the error raised while uploading it, or None if it was uploaded.
+        """
+        self._last_progress = time.monotonic()
+        self._stopping.set()
+        while any(thread.is_alive() for thread in self._threads):
+            try:
+                yield self.results.get(timeout=CLAIM_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        yield from self.finished()
+
+
+def shard_directory(shard: sharding.Shard | None) -> str:
+    """Get the folder of the outbox of a shard, or config.OUTBOX_DIR if the robot isn't sharded.
+    Each shard has its own outbox, since it sets the statuses of its own queue elements.
+    """
+    return os.path.join(config.OUTBOX_DIR, shard.label) if shard else config.OUTBOX_DIR
+
+
+def transfer_through_outbox(orchestrator_connection: OrchestratorConnection, run: transfer_run.TransferRun,
+                            recording_transfer: transfer.RecordingTransfer, started: Iterator[dict],
+                            uploader: OutboxUploader | None = None) -> None:
+    """Transfer the started recordings through the outbox. Recordings are downloaded into the outbox at the rate of Miralix,
+    while the outbox is uploaded to GetOrganized on other threads. A recording counts as transferred for the watermark
+    once it's stored, and its queue element is set 'Done' when it's uploaded.
+
+    When the outbox stays full, the recordings not yet stored are left for the next run.
+    Uploads that fail don't fail the run, since the recordings stay in the outbox for the next run.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        run: The run of the recordings.
+        recording_transfer: The transfer to download and upload with.
+        started: The recordings to transfer, as given by run.start.
+        uploader: An uploader kept running between the polls of the daemon, which the run doesn't drain.
+            If None, an uploader of the outbox of the shard is started and drained when the downloads are done.
+    """
+    own_uploader = uploader is None
+    if own_uploader:
+        uploader = OutboxUploader(Outbox(shard_directory(run.shard)), recording_transfer.case_number, recording_transfer.upload)
+        uploader.start()
+    box = uploader.outbox
+    full = threading.Event()
+
+    def store(recording: dict, file_data: bytes | BinaryIO) -> None:
+        #  Once the outbox has stayed full, the recordings after it fail right away instead of each waiting for space
+        if full.is_set():
+            raise OutboxFullError(f"The outbox is full, call ID {recording['QueueCallId']} is left for the next run.")
+        try:
+            box.put(recording, recording_transfer.case_number, file_data)
+        except OutboxFullError:
+            full.set()
+            raise
+
+    def start() -> Iterator[dict]:
+        for recording in started:
+            if full.is_set():
+                run.postpone(recording, "The outbox is full.")
+                return
+            yield recording
+
+    def finish_uploads(uploads: Iterator[tuple[OutboxEntry, Exception | None]]) -> None:
+        for entry, error in uploads:
+            if error:
+                run.batcher.log_info(f"Call ID {entry.call_id} stays in the outbox after a failed upload: {error!r}")
+            else:
+                run.finish_stored(entry.recording)
+
+    try:
+        for recording, error in pipeline.run_pipeline(start(), recording_transfer.download, store,
+                                                      download_workers=config.MIRALIX_DOWNLOAD_WORKERS,
+                                                      upload_workers=config.MIRALIX_DOWNLOAD_WORKERS,
+                                                      max_bytes_in_flight=config.MAX_BYTES_IN_FLIGHT):
+            if isinstance(error, OutboxFullError):
+                run.postpone(recording, str(error))
+            elif error:
+                run.finish(recording, error)
+            else:
+                run.store(recording)
+            finish_uploads(uploader.finished())
+    finally:
+        if own_uploader:
+            finish_uploads(uploader.drain())
+            box.close()
+        else:
+            finish_uploads(uploader.finished())
+
+    if own_uploader and (pending := box.pending(recording_transfer.case_number)):
+        orchestrator_connection.log_info(f"{pending} recordings are left in the outbox for the next run.")
+
+
+def drain_uploader(orchestrator_connection: OrchestratorConnection, uploader: OutboxUploader, queue_index: queue_util.QueueIndex) -> None:
+    """Drain an uploader kept running between the polls of the daemon when the daemon stops, and close its outbox.
+    The queue elements of the recordings it uploads are set 'Done', and the rest stay in the outbox for the next run.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        uploader: The uploader.
+        queue_index: The index of the queue elements kept by the daemon.
+    """
+    try:
+        for entry, error in uploader.drain():
+            queue_index.load(orchestrator_connection)
+            queue_element = queue_index.queue_elements.get(str(entry.call_id))
+            if not error and queue_element:
+                orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.DONE)
+                queue_index.set_status(str(entry.call_id), QueueStatus.DONE)
+    finally:
+        uploader.outbox.close()
+
+    if pending := uploader.outbox.pending(uploader.case_number):
+        orchestrator_connection.log_info(f"{pending} recordings are left in the outbox for the next run.")
@@ -0,0 +1,158 @@
+"""This module contains a bounded producer/consumer pipeline that overlaps downloads and uploads."""
+
+import itertools
+import os
+import queue
+import threading
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
+
+# Marks the end of work on the internal queues.
+_STOP = object()
+
+
+class BytesBudget:
+    """Keeps track of the number of bytes downloaded but not yet uploaded.
+    New downloads wait while the number of bytes in flight is at or above the limit.
+    Since the size of a download isn't known before it's done, the limit can be exceeded
+    by at most one file per download worker.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def wait(self) -> None:
+        """Block until the number of bytes in flight is below the limit."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+
+    def add(self, size: int) -> None:
+        """Add a number of bytes to the bytes in flight."""
+        with self._condition:
+            self.in_flight += size
+
+    def release(self, size: int) -> None:
+        """Remove a number of bytes from the bytes in flight and wake up waiting downloads."""
+        with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
+
+def size_of(data: bytes | BinaryIO) -> int:
+    """Get the size of downloaded data, which is either bytes or a seekable binary file."""
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    position = data.tell()
+    size = data.seek(0, os.SEEK_END)
+    data.seek(position)
+    return size
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[list]:
+    """Split items into lists of 'size' items, the last one possibly shorter, consuming the items lazily.
+
+    Args:
+        items: The items.
+        size: The number of items in each list.
+
+    Yields:
+        Lists of items.
+    """
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def run_pipeline(items: Iterable[Any], download: Callable[[Any], bytes | BinaryIO], upload: Callable[[Any, bytes | BinaryIO], None], *,
+                 download_workers: int, upload_workers: int, max_bytes_in_flight: int) -> Iterator[tuple[Any, Exception | None]]:
+    """Download and upload items concurrently using separate pools of worker threads.
+    The items are consumed from the calling thread, so any work done while producing an item
+    (like creating queue elements) happens on the calling thread as well.
+
+    Args:
+        items: The items to transfer.
+        download: Function that downloads the data of an item as bytes or a seekable binary file.
+        upload: Function that uploads the data of an item. Files are closed by the pipeline afterwards.
+        download_workers: The number of threads downloading.
+        upload_workers: The number of threads uploading.
+        max_bytes_in_flight: The number of bytes downloaded but not uploaded before downloads pause.
+
+    Yields:
+        Each item with the exception raised while transferring it, or None if it succeeded,
+        in the order they finish.
+    """
+    download_queue = queue.Queue(maxsize=download_workers * 2)
+    upload_queue = queue.Queue(maxsize=upload_workers * 2)
+    results = queue.Queue()
+    budget = BytesBudget(max_bytes_in_flight)
+    stop_event = threading.Event()
+
+    def download_worker():
+        while (item := download_queue.get()) is not _STOP:
+            if stop_event.is_set():
+                continue
+            budget.wait()
+            try:
+                data = download(item)
+            # Any error is reported back for the item.
+            # pylint: disable-next = broad-exception-caught
+            except Exception as error:
+                results.put((item, error))
+                continue
+            size = size_of(data)
+            budget.add(size)
+            upload_queue.put((item, data, size))
+
+    def upload_worker():
+        while (work := upload_queue.get()) is not _STOP:
+            item, data, size = work
+            try:
+                if not stop_event.is_set():
+                    upload(item, data)
+                    results.put((item, None))
+            # Any error is reported back for the item.
+            # pylint: disable-next = broad-exception-caught
+            except Exception as error:
+                results.put((item, error))
+            finally:
+                if hasattr(data, "close"):
+                    data.close()
+                budget.release(size)
+
+    download_threads = [threading.Thread(target=download_worker, daemon=True) for _ in range(download_workers)]
+    upload_threads = [threading.Thread(target=upload_worker, daemon=True) for _ in range(upload_workers)]
+
+    def close_uploads():
+        for thread in download_threads:
+            thread.join()
+        for _ in upload_threads:
+            upload_queue.put(_STOP)
+        for thread in upload_threads:
+            thread.join()
+        results.put(_STOP)
+
+    def close():
+        for _ in download_threads:
+            download_queue.put(_STOP)
+        threading.Thread(target=close_uploads, daemon=True).start()
+
+    for thread in download_threads + upload_threads:
+        thread.start()
+
+    closed = False
+    try:
+        for item in items:
+            download_queue.put(item)
+            while not results.empty():
+                yield results.get()
+
+        close()
+        closed = True
+        while (result := results.get()) is not _STOP:
+            yield result
+    finally:
+        # If the consumer stops early the remaining work is skipped and the threads are shut down.
+        stop_event.set()
+        if not closed:
+            close()
@@ -0,0 +1,271 @@
+"""This module plans a run before the transfer: it estimates the size of each listed recording,
+orders the recordings largest first and estimates how long the run takes.
+It's selected with "plan" in the process arguments.
+"""
+
+import glob
+import json
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+import requests
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework.miralix import miralix_api
+from robot_framework import config
+from robot_framework import sharding
+from robot_framework import transfer_run
+
+# The ways of estimating the size of a recording.
+SIZE_ESTIMATES = ("duration", "head")
+
+# A duration as written by .NET, e.g. "00:05:00", "00:05:00.1234567" or "1.02:00:00".
+DURATION_PATTERN = re.compile(r"(?:(\d+)\.)?(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+MB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class PlanSettings:
+    """The settings of the planner, given by "plan" in the process arguments, e.g.
+    {"estimate": "head", "dry_run": true, "mb_per_second": 20}. "plan": true uses the defaults.
+    Sizes are estimated from the conversation duration ("duration") or by a HEAD request for each recording ("head").
+    A dry run logs the plan and writes it to a file without transferring anything.
+    """
+    estimate: str = "duration"
+    dry_run: bool = False
+    mb_per_second: float | None = None
+
+    def __post_init__(self):
+        if self.estimate not in SIZE_ESTIMATES:
+            raise ValueError(f"Unknown size estimate '{self.estimate}', expected one of {SIZE_ESTIMATES}.")
+
+    @classmethod
+    def from_arguments(cls, process_arguments: dict) -> "PlanSettings":
+        """Get the settings from the process arguments."""
+        arguments = process_arguments.get("plan")
+        return cls(**arguments) if isinstance(arguments, dict) else cls()
+
+
+def parse_duration(value: str | float | None) -> float | None:
+    """Get the number of seconds of a duration given as seconds or as a .NET TimeSpan, or None if it can't be read."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = DURATION_PATTERN.fullmatch(value.strip()) if isinstance(value, str) else None
+    if not match:
+        return None
+    days, hours, minutes, seconds = match.groups()
+    return int(days or 0) * 86400 + int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def duration_size(recording: dict) -> int:
+    """Estimate the size of a recording from the length of the conversation, or config.PLAN_DEFAULT_SIZE if it isn't known."""
+    seconds = parse_duration(recording.get("ConversationDuration"))
+    return int(seconds * config.PLAN_BYTES_PER_SECOND) if seconds is not None else config.PLAN_DEFAULT_SIZE
+
+
+def head_size(call_id: int, client: miralix_api.MiralixClient) -> int | None:
+    """Get the size of a recording with a HEAD request, or None if Miralix doesn't tell it."""
+    try:
+        return miralix_api.recording_size(call_id, client)
+    except requests.RequestException:
+        return None
+
+
+def estimate_sizes(recordings: list[dict], settings: PlanSettings, client: miralix_api.MiralixClient) -> dict[int, int]:
+    """Estimate the size of each recording. Recordings without a Content-Length are estimated from their duration.
+
+    Args:
+        recordings: The recordings.
+        settings: The settings of the planner.
+        client: Client for the Miralix API, for HEAD requests.
+
+    Returns:
+        A dict of call IDs to estimated sizes in bytes.
+    """
+    sizes = {recording["QueueCallId"]: duration_size(recording) for recording in recordings}
+    if settings.estimate == "head":
+        call_ids = list(sizes)
+        with ThreadPoolExecutor(max_workers=config.PLAN_HEAD_WORKERS) as executor:
+            for call_id, size in zip(call_ids, executor.map(lambda call_id: head_size(call_id, client), call_ids)):
+                if size is not None:
+                    sizes[call_id] = size
+    return sizes
+
+
+def previous_throughput(directory: str | None = None) -> float | None:
+    """Get the MB per second of the latest run that transferred anything, from the run summaries in config.METRICS_DIR."""
+    for path in sorted(glob.glob(os.path.join(directory or config.METRICS_DIR, "run_*.json")), reverse=True):
+        try:
+            with open(path, encoding="utf-8") as file:
+                summary = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if summary.get("recordings") and summary.get("mb_per_second"):
+            return summary["mb_per_second"]
+    return None
+
+
+class RunPlan:  # pylint: disable=too-many-instance-attributes
+    """The recordings of a run with their estimated sizes, and the progress of the run against the estimates.
+    Recordings are transferred largest first, see 'priority', so the biggest transfers start early next to the small ones
+    instead of being the tail of the run.
+
+    The ETA is the bytes left at the throughput of the run so far, or the expected throughput before anything has finished.
+    As recordings finish, the estimates of the rest are scaled by how far off the estimates of the finished recordings were.
+    """
+
+    def __init__(self, recordings: list[dict], sizes: dict[int, int], mb_per_second: float):
+        """Create a plan.
+
+        Args:
+            recordings: The recordings to transfer.
+            sizes: The estimated size of each recording by call ID.
+            mb_per_second: The expected throughput of the run.
+        """
+        self.recordings = recordings
+        self.sizes = sizes
+        self.mb_per_second = mb_per_second
+        self.total_bytes = sum(sizes.values())
+        self.started = time.monotonic()
+        self.finished = 0
+        #  The estimated and the actual sizes of the finished recordings
+        self.estimated_done = 0
+        self.actual_done = 0
+        self._last_progress = self.started
+
+    def priority(self, recording: dict) -> tuple[int, int]:
+        """Sort key of a recording: the largest first, and by call ID between recordings of the same size."""
+        return -self.sizes.get(recording["QueueCallId"], 0), recording["QueueCallId"]
+
+    def estimated_seconds(self) -> float:
+        """Estimate the length of the run: the time to transfer all bytes at the expected throughput,
+        or the time of the largest recording on one worker if that's longer.
+        """
+        bytes_per_second = self.mb_per_second * MB
+        workers = min(config.MIRALIX_DOWNLOAD_WORKERS, config.GO_UPLOAD_WORKERS)
+        largest = max(self.sizes.values(), default=0)
+        return max(self.total_bytes / bytes_per_second, largest * workers / bytes_per_second)
+
+    def summary(self) -> dict:
+        """Summarize the plan, with the largest recordings and the recordings and bytes of each queue."""
+        queues = Counter(recording["QueueName"].strip() for recording in self.recordings)
+        queue_bytes = Counter()
+        for recording in self.recordings:
+            queue_bytes[recording["QueueName"].strip()] += self.sizes[recording["QueueCallId"]]
+        largest = sorted(self.recordings, key=self.priority)[:config.METRICS_SLOWEST_COUNT]
+        return {
+            "recordings": len(self.recordings),
+            "bytes": self.total_bytes,
+            "mb_per_second": self.mb_per_second,
+            "estimated_seconds": round(self.estimated_seconds(), 1),
+            "queues": {queue_name: {"recordings": count, "bytes": queue_bytes[queue_name]} for queue_name, count in queues.items()},
+            "largest": [{"call_id": recording["QueueCallId"], "queue": recording["QueueName"].strip(),
+                         "bytes": self.sizes[recording["QueueCallId"]]} for recording in largest]
+        }
+
+    def save(self, directory: str | None = None) -> str:
+        """Write the summary and the planned order of the recordings to a JSON file in config.METRICS_DIR.
+
+        Returns:
+            The path of the file.
+        """
+        directory = directory or config.METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"plan_{datetime.now():%Y%m%d_%H%M%S}.json")
+        order = [{"call_id": recording["QueueCallId"], "queue": recording["QueueName"].strip(),
+                  "filename": miralix_api.get_filename(recording), "bytes": self.sizes[recording["QueueCallId"]]}
+                 for recording in sorted(self.recordings, key=self.priority)]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(dict(self.summary(), order=order), file, indent=2)
+        return path
+
+    def finish(self, recording: dict, size: int | None) -> None:
+        """Count a finished recording.
+
+        Args:
+            recording: The recording.
+            size: The actual size of the recording, if it was downloaded.
+        """
+        estimate = self.sizes.get(recording["QueueCallId"], 0)
+        self.finished += 1
+        self.estimated_done += estimate
+        self.actual_done += size if size is not None else estimate
+
+    def progress(self) -> dict:
+        """Get the recordings and bytes left and the ETA of the run."""
+        seconds = time.monotonic() - self.started
+        scale = self.actual_done / self.estimated_done if self.estimated_done else 1.0
+        remaining_bytes = round((self.total_bytes - self.estimated_done) * scale)
+        bytes_per_second = self.actual_done / seconds if self.actual_done and seconds else self.mb_per_second * MB
+        eta_seconds = remaining_bytes / bytes_per_second
+        return {
+            "finished": self.finished,
+            "remaining": len(self.recordings) - self.finished,
+            "remaining_bytes": remaining_bytes,
+            "mb_per_second": round(bytes_per_second / MB, 3),
+            "eta_seconds": round(eta_seconds, 1),
+            "eta": (datetime.now() + timedelta(seconds=eta_seconds)).isoformat(timespec="seconds")
+        }
+
+    def report_progress(self, log: Callable[[str], None], force: bool = False) -> None:
+        """Log the progress every config.PLAN_PROGRESS_INTERVAL seconds.
+
+        Args:
+            log: Function logging a line, e.g. QueueBatcher.log_info.
+            force: Log even if the interval hasn't passed.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_progress < config.PLAN_PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        progress = self.progress()
+        log(f"Plan progress: {progress['finished']}/{len(self.recordings)} recordings, "
+            f"{progress['remaining_bytes'] / MB:.1f} MB remaining at {progress['mb_per_second']:.2f} MB/s, ETA {progress['eta']}")
+
+
+def format_plan(summary: dict) -> str:
+    """Format a plan summary as text for the OpenOrchestrator log."""
+    lines = [f"Run plan: {summary['recordings']} recordings, {summary['bytes'] / MB:.1f} MB, "
+             f"about {summary['estimated_seconds'] / 60:.1f} minutes at {summary['mb_per_second']:.2f} MB/s"]
+    for queue_name, queue in summary["queues"].items():
+        lines.append(f"Queue {queue_name}: {queue['recordings']} recordings, {queue['bytes'] / MB:.1f} MB")
+    for recording in summary["largest"]:
+        lines.append(f"Largest: Call ID {recording['call_id']} {recording['bytes'] / MB:.1f} MB")
+    return "\n".join(lines)
+
+
+def plan_run(orchestrator_connection: OrchestratorConnection, run: transfer_run.TransferRun, listing: Iterable[dict],
+             client: miralix_api.MiralixClient, settings: PlanSettings) -> tuple[list[dict], RunPlan]:
+    """List the whole run and plan the recordings this worker transfers, leaving out those that are already done.
+    The plan is logged and written to a file, see RunPlan.save.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        run: The run the listing is transferred in.
+        listing: The listed recordings, sorted by call ID.
+        client: Client for the Miralix API.
+        settings: The settings of the planner.
+
+    Returns:
+        The whole listing, to transfer in place of 'listing', and the plan.
+    """
+    recordings = list(listing)
+    owned, _ = sharding.split_recordings(run.shard, recordings, run.last_downloads, run.rescued_watermarks)
+    planned = [recording for recording in owned if str(recording["QueueCallId"]) not in run.done_references]
+    with run.run_metrics.time_stage("planning"):
+        sizes = estimate_sizes(planned, settings, client)
+
+    plan = RunPlan(planned, sizes, settings.mb_per_second or previous_throughput() or config.PLAN_DEFAULT_MB_PER_SECOND)
+    orchestrator_connection.log_info(format_plan(plan.summary()))
+    try:
+        orchestrator_connection.log_info(f"Plan written to {plan.save()}")
+    except OSError as error:
+        orchestrator_connection.log_error(f"Couldn't write the plan to '{config.METRICS_DIR}': {error}")
+    return recordings, plan
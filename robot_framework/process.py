@@ -1,53 +1,135 @@
 """This module contains the main process of the robot."""
 
+import asyncio
 import os
 import json
 
-from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection, QueueStatus
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 from robot_framework.miralix import miralix_api
 from robot_framework.get_organized import get_organized_api
+from robot_framework import async_process
+from robot_framework import backfill
 from robot_framework import config
+from robot_framework import daemon
+from robot_framework import metrics
+from robot_framework import outbox
+from robot_framework import pipeline
+from robot_framework import planner
+from robot_framework import queue_util
+from robot_framework import sharding
+from robot_framework import transfer
+from robot_framework import transfer_run
+from robot_framework import watermark
+from robot_framework.exceptions import BusinessError
 
 
 def process(orchestrator_connection: OrchestratorConnection) -> None:
-    """Do the primary process of the robot."""
+    """Do the primary process of the robot and report the metrics of the run.
+    The engine and any profiling are selected with "engine" and "profile" in the process arguments,
+    and "backfill" runs a backfill of a range of recordings instead of the regular run.
+    With "journalize" the documents uploaded by the run are journalized when the transfers are done.
+    "outbox" transfers through the outbox, see outbox.py, with the threaded engine.
+    "daemon" keeps polling the queues instead of running once, see daemon.py, reporting the metrics of each poll.
+    "plan" plans the run largest first with an ETA, see planner.py, and only logs the plan with "dry_run".
+    The planner uses the threaded engine, and can't be combined with "backfill".
+
+    Raises:
+        BusinessError: If "plan" is combined with "backfill".
+    """
+    process_arguments = json.loads(orchestrator_connection.process_arguments)
+    if "plan" in process_arguments and "backfill" in process_arguments:
+        raise BusinessError("'plan' can't be combined with 'backfill', which transfers its range without a plan.")
+    if "daemon" in process_arguments:
+        daemon.run_daemon(orchestrator_connection, transfer_new_recordings)
+        return
+
+    run_metrics = metrics.RunMetrics()
+    try:
+        with metrics.profiling(process_arguments.get("profile"), run_metrics):
+            if "backfill" in process_arguments:
+                backfill.backfill(orchestrator_connection, run_metrics)
+            elif process_arguments.get("engine") == "async" and not process_arguments.get("outbox") and "plan" not in process_arguments:
+                asyncio.run(async_process.async_process(orchestrator_connection, run_metrics))
+            else:
+                threaded_process(orchestrator_connection, run_metrics)
+    finally:
+        run_metrics.report(orchestrator_connection)
+
+
+def threaded_process(orchestrator_connection: OrchestratorConnection, run_metrics: metrics.RunMetrics) -> None:
+    """Transfer the recordings with a pipeline of download and upload threads."""
     orchestrator_connection.log_trace("Running process.")
 
-    get_organized_login = orchestrator_connection.get_credential(config.GO_CREDENTIALS)
-    session = get_organized_api.create_session(get_organized_login.username, get_organized_login.password)
-    miralix_password = orchestrator_connection.get_credential(config.MIRALIX_SHARED_KEY).password
+    miralix_client = miralix_api.MiralixClient.from_orchestrator(orchestrator_connection)
     case_number = json.loads(orchestrator_connection.process_arguments)["case_number"]
+    recording_transfer = transfer.RecordingTransfer(orchestrator_connection, case_number, miralix_client, run_metrics)
+    run = transfer_new_recordings(orchestrator_connection, recording_transfer)
+
+    journal_results = transfer.journalize_uploads(orchestrator_connection, recording_transfer)
+    run.raise_for_failures()
+    get_organized_api.raise_for_failures("Journalizing", journal_results)
+
+
+def transfer_new_recordings(orchestrator_connection: OrchestratorConnection, recording_transfer: transfer.RecordingTransfer,
+                            queue_names: list[str] | None = None, queue_index: queue_util.QueueIndex | None = None,
+                            outbox_uploader: outbox.OutboxUploader | None = None) -> transfer_run.TransferRun:
+    """Transfer the recordings listed after the watermarks, recording in the metrics of the transfer.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        recording_transfer: The transfer to download and upload with.
+        queue_names: The queues to list. Defaults to "target_queues" in the process arguments.
+        queue_index: The index of the queue elements kept between the polls of the daemon, see queue_util.QueueIndex.
+        outbox_uploader: The outbox uploader kept running between the polls of the daemon, see outbox.transfer_through_outbox.
+
+    Returns:
+        The run, to check for failures.
+    """
+    run_metrics = recording_transfer.run_metrics
+
+    #  Get the highest call ID previously downloaded from each queue, by this shard and by the shard it takes over from
+    shard = sharding.Shard.from_arguments(json.loads(orchestrator_connection.process_arguments))
+    watermark_store = sharding.create_watermark_store(orchestrator_connection, shard)
+    target_queues = json.loads(orchestrator_connection.process_arguments)["target_queues"]
+    last_downloads = watermark.load_watermarks(watermark_store, target_queues, orchestrator_connection)
+    rescued_watermarks = sharding.load_rescued_watermarks(orchestrator_connection, shard)
+
+    #  List the recordings that have a higher ID than the previous highest, sorted by call ID, a page at a time
+    listing = miralix_api.iter_recordings_for_process(orchestrator_connection, sharding.listing_watermarks(last_downloads, rescued_watermarks),
+                                                      recording_transfer.miralix_client, run_metrics, queue_names)
+    run = transfer_run.TransferRun(orchestrator_connection, watermark_store, last_downloads, run_metrics,
+                                   shard=shard, rescued_watermarks=rescued_watermarks, queue_index=queue_index)
+
+    #  Plan the whole listing largest first if selected, and stop there in a dry run
+    process_arguments = json.loads(orchestrator_connection.process_arguments)
+    plan = None
+    if "plan" in process_arguments:
+        plan_settings = planner.PlanSettings.from_arguments(process_arguments)
+        listing, plan = planner.plan_run(orchestrator_connection, run, listing, recording_transfer.miralix_client, plan_settings)
+        if plan_settings.dry_run:
+            return run
 
-    #  Check queue elements for highest call ID previously downloaded
-    queue_elements = orchestrator_connection.get_queue_elements(config.QUEUE_NAME, status=QueueStatus.DONE)
-    last_download = max(int(queue_element.reference) for queue_element in queue_elements)
-
-    #  Get list of recordings that have a higher ID than the previous highest, and sort them
-    recordings = miralix_api.recordings_for_process(orchestrator_connection, last_download)
-    recordings.sort(key=lambda recording: recording["QueueCallId"])
-
-    #  Run through each recording, download file data and send to GetOrganized
-    for i, recording in enumerate(recordings):
-        call_id = recording["QueueCallId"]
-        filename = miralix_api.get_filename(recording)
-        orchestrator_connection.log_info(f"{i+1}/{len(recordings)} - Call ID {call_id} being saved as {filename}")
-
-        #  Set queue status
-        queue_element = orchestrator_connection.create_queue_element(config.QUEUE_NAME, call_id, data=filename)
-        orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.IN_PROGRESS)
-
-        #  Get file data and upload to GetOrganized as a list of bytes
-        file_data = list(miralix_api.download_file(call_id, miralix_password))
-        get_organized_api.upload_document(apiurl=config.GO_API,
-                                          session=session,
-                                          file=file_data,
-                                          case=case_number,
-                                          filename=filename,
-                                          agent_name=recording["AgentName"],
-                                          date_string=recording["ConversationStartedUtc"])
-
-        orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.DONE)
+    #  Run through each recording, download file data and send to GetOrganized, through the outbox if selected
+    started = run.start(listing, page_size=len(listing), key=plan.priority) if plan else run.start(listing)
+    try:
+        if process_arguments.get("outbox"):
+            outbox.transfer_through_outbox(orchestrator_connection, run, recording_transfer, started, outbox_uploader)
+        else:
+            for recording, error in pipeline.run_pipeline(started, recording_transfer.download, recording_transfer.upload,
+                                                          download_workers=config.MIRALIX_DOWNLOAD_WORKERS,
+                                                          upload_workers=config.GO_UPLOAD_WORKERS,
+                                                          max_bytes_in_flight=config.MAX_BYTES_IN_FLIGHT):
+                run.finish(recording, error)
+                if plan:
+                    plan.finish(recording, run_metrics.bytes_of(recording["QueueCallId"]))
+                    plan.report_progress(run.batcher.log_info)
+    finally:
+        run.flush()
+        recording_transfer.upload_index.save()
+    if plan:
+        plan.report_progress(orchestrator_connection.log_info, force=True)
+    return run
 
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+"""This module batches writes to the OpenOrchestrator job queue and log."""
+
+import time
+from datetime import datetime
+from typing import Callable
+
+from OpenOrchestrator.database.queues import QueueElement
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection, QueueStatus
+
+from robot_framework import config
+from robot_framework import metrics
+from robot_framework import queue_util
+
+# The maximum length of a log message in OpenOrchestrator.
+MAX_LOG_LENGTH = 8000
+
+
+class QueueBatcher:  # pylint: disable=too-many-instance-attributes
+    """Collects queue status changes and log lines and writes them to OpenOrchestrator in periodic flushes.
+    Only the latest status of each queue element is written, so an element that goes from
+    'In Progress' to 'Done' between two flushes is written once.
+
+    Pending changes are lost if the robot crashes, but the affected elements are left
+    'New' or 'In Progress' and are resumed on the next run. Anything depending on the
+    statuses being written, like saving the watermark, should happen in 'on_flush'.
+    """
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection, on_flush: Callable[[], None] | None = None,
+                 flush_interval: float = config.QUEUE_FLUSH_INTERVAL, flush_size: int = config.QUEUE_FLUSH_SIZE,
+                 run_metrics: metrics.RunMetrics | None = None):
+        """Create a batcher.
+
+        Args:
+            orchestrator_connection: Connection to OpenOrchestrator.
+            on_flush: Function called after each flush, once the statuses have been written.
+            flush_interval: The number of seconds between flushes. Defaults to config.QUEUE_FLUSH_INTERVAL.
+            flush_size: The number of pending changes that triggers a flush. Defaults to config.QUEUE_FLUSH_SIZE.
+            run_metrics: The metrics to record the time spent writing to OpenOrchestrator in.
+        """
+        self.orchestrator_connection = orchestrator_connection
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.run_metrics = run_metrics or metrics.RunMetrics()
+        self._statuses = {}
+        self._log_lines = []
+        self._last_flush = time.monotonic()
+
+    def create_queue_elements(self, references: list[str], data: list[str], created_by: str | None = None) -> dict[str, QueueElement]:
+        """Create queue elements in bulk with the status 'New'.
+
+        Args:
+            references: The reference of each element.
+            data: The data of each element.
+            created_by: The worker creating the elements, if any.
+
+        Returns:
+            A dict of references to the created queue elements.
+        """
+        if not references:
+            return {}
+
+        with self.run_metrics.time_stage("queue_update"):
+            created_after = datetime.now()
+            for i in range(0, len(references), queue_util.PAGE_SIZE):
+                self.orchestrator_connection.bulk_create_queue_elements(config.QUEUE_NAME, tuple(references[i:i+queue_util.PAGE_SIZE]),
+                                                                        tuple(data[i:i+queue_util.PAGE_SIZE]), created_by)
+
+            # Bulk creation doesn't return the elements, so they are read back
+            wanted = set(references)
+            return {
+                queue_element.reference: queue_element
+                for queue_element in queue_util.get_all_queue_elements(self.orchestrator_connection, QueueStatus.NEW, created_after)
+                if queue_element.reference in wanted
+            }
+
+    def set_queue_element_status(self, element_id: str, status: QueueStatus, message: str | None = None) -> None:
+        """Set the status of a queue element in the next flush.
+
+        Args:
+            element_id: The id of the queue element.
+            status: The new status of the queue element.
+            message: The message to attach to the queue element, if any.
+        """
+        self._statuses[element_id] = (status, message)
+        self._flush_if_due()
+
+    def log_info(self, message: str) -> None:
+        """Log a message to OpenOrchestrator in the next flush.
+
+        Args:
+            message: The message to log.
+        """
+        self._log_lines.append(message)
+        self._flush_if_due()
+
+    def _flush_if_due(self) -> None:
+        """Flush if there are enough pending changes or enough time has passed."""
+        if len(self._statuses) + len(self._log_lines) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all pending statuses and log lines to OpenOrchestrator and call 'on_flush'."""
+        with self.run_metrics.time_stage("queue_update"):
+            statuses, self._statuses = self._statuses, {}
+            for element_id, (status, message) in statuses.items():
+                self.orchestrator_connection.set_queue_element_status(element_id, status, message)
+
+            log_lines, self._log_lines = self._log_lines, []
+            message = ""
+            for line in log_lines:
+                if message and len(message) + len(line) + 1 > MAX_LOG_LENGTH:
+                    self.orchestrator_connection.log_info(message)
+                    message = ""
+                message = f"{message}\n{line}" if message else line
+            if message:
+                self.orchestrator_connection.log_info(message)
+
+            if self.on_flush:
+                self.on_flush()
+        self._last_flush = time.monotonic()
@@ -0,0 +1,118 @@
+"""This module contains helpers for reading the OpenOrchestrator job queue of the robot."""
+
+import re
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from OpenOrchestrator.database.queues import QueueElement
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection, QueueStatus
+
+from robot_framework import config
+
+# The number of queue elements fetched per request when paging through a queue.
+PAGE_SIZE = 1000
+
+# The start of the message of a failed queue element, with the number of failed attempts.
+ATTEMPT_PATTERN = re.compile(r"Attempt (\d+): ")
+
+
+def get_all_queue_elements(orchestrator_connection: OrchestratorConnection, status: QueueStatus, from_date: datetime | None = None) -> Iterator[QueueElement]:
+    """Page through all queue elements in the job queue with a given status.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        status: The status to filter by.
+        from_date: Only get elements created after this date, if given.
+
+    Yields:
+        The queue elements, newest first.
+    """
+    offset = 0
+    while queue_elements := orchestrator_connection.get_queue_elements(config.QUEUE_NAME, status=status, offset=offset, limit=PAGE_SIZE, from_date=from_date):
+        yield from queue_elements
+        offset += PAGE_SIZE
+
+
+def failed_attempts(queue_element: QueueElement) -> int:
+    """Get the number of failed attempts at the recording of a queue element, from the message of a 'Failed' element.
+    A 'Failed' element without a count has failed once.
+    """
+    if queue_element.status != QueueStatus.FAILED:
+        return 0
+    match = ATTEMPT_PATTERN.match(queue_element.message or "")
+    return int(match.group(1)) if match else 1
+
+
+def failure_status(queue_element: QueueElement, error: Exception) -> tuple[QueueStatus, str]:
+    """Get the status and the message of a queue element whose recording failed again, counting the attempts.
+    The recording is given up, 'Abandoned', after config.MAX_TRANSFER_ATTEMPTS attempts, if it was first listed
+    at least config.ABANDON_AFTER_HOURS ago. Otherwise it's 'Failed'.
+
+    Args:
+        queue_element: The queue element as it was before the attempt.
+        error: The error of the attempt.
+
+    Returns:
+        The status and the message.
+    """
+    attempts = failed_attempts(queue_element) + 1
+    if (attempts >= config.MAX_TRANSFER_ATTEMPTS
+            and queue_element.created_date <= datetime.now() - timedelta(hours=config.ABANDON_AFTER_HOURS)):
+        return QueueStatus.ABANDONED, f"Given up after {attempts} attempts: {error!r}"
+    return QueueStatus.FAILED, f"Attempt {attempts}: {error!r}"
+
+
+def reclaim_queue_elements(orchestrator_connection: OrchestratorConnection) -> tuple[dict[str, QueueElement], set[str]]:
+    """Find queue elements left NEW, IN_PROGRESS or FAILED by earlier runs within the last config.RECLAIM_DAYS days.
+    Since the watermark never moves past an unfinished recording, these recordings are listed again
+    and can reuse their queue elements.
+    Recordings listed again because they come after an unfinished one may already be DONE or ABANDONED, see failure_status,
+    so the references of those elements since the oldest reclaimed element are returned as done.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+
+    Returns:
+        A dict of references to reclaimed queue elements, and a set of references of DONE and ABANDONED elements.
+    """
+    from_date = datetime.now() - timedelta(days=config.RECLAIM_DAYS)
+    reclaimed = {}
+    for status in (QueueStatus.FAILED, QueueStatus.IN_PROGRESS, QueueStatus.NEW):
+        for queue_element in get_all_queue_elements(orchestrator_connection, status, from_date):
+            reclaimed.setdefault(queue_element.reference, queue_element)
+
+    if not reclaimed:
+        return reclaimed, set()
+
+    oldest = min(queue_element.created_date for queue_element in reclaimed.values())
+    done_references = {queue_element.reference for status in (QueueStatus.DONE, QueueStatus.ABANDONED)
+                       for queue_element in get_all_queue_elements(orchestrator_connection, status, oldest)}
+    return reclaimed, done_references
+
+
+class QueueIndex:
+    """The queue elements of unfinished recordings and the references of finished ones, see reclaim_queue_elements.
+    The index is loaded with a scan of the job queue when a run first uses it, and is then kept up to date by the run,
+    so the daemon scans the queue once instead of on every poll.
+    """
+
+    def __init__(self):
+        self.queue_elements: dict[str, QueueElement] = {}
+        self.done_references: set[str] = set()
+        self.loaded = False
+
+    def load(self, orchestrator_connection: OrchestratorConnection) -> None:
+        """Scan the job queue for the queue elements left by earlier runs, unless the index is loaded already."""
+        if not self.loaded:
+            self.queue_elements, self.done_references = reclaim_queue_elements(orchestrator_connection)
+            self.loaded = True
+
+    def set_status(self, reference: str, status: QueueStatus, message: str | None = None) -> None:
+        """Note the new status of a queue element. A finished element moves to the done references."""
+        if status in (QueueStatus.DONE, QueueStatus.ABANDONED):
+            self.queue_elements.pop(reference, None)
+            self.done_references.add(reference)
+        elif reference in self.queue_elements:
+            self.queue_elements[reference].status = status
+            if message is not None:
+                self.queue_elements[reference].message = message
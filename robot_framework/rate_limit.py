@@ -0,0 +1,246 @@
+"""This module adapts the concurrency and timeouts of the calls to each backend to how the backend responds."""
+
+import asyncio
+import contextlib
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Mapping
+from urllib.parse import urlsplit
+
+import requests
+
+from robot_framework import config
+
+# Statuses telling that the backend is overloaded.
+OVERLOAD_STATUSES = (429, 503)
+
+# The weight of a new observation in the moving averages of latency and throughput.
+EWMA_WEIGHT = 0.2
+
+# The number of seconds between checks for a free slot when waiting on the event loop.
+ASYNC_POLL_INTERVAL = 0.01
+
+
+def retry_after_seconds(headers: Mapping[str, str] | None) -> float | None:
+    """Get the number of seconds to wait from a Retry-After header, given as seconds or as an HTTP date.
+
+    Args:
+        headers: The headers of a response.
+
+    Returns:
+        The number of seconds, or None if there's no valid header.
+    """
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:  # pylint: disable=too-many-instance-attributes
+    """Limits the number of concurrent calls to a backend with additive increase, multiplicative decrease (AIMD).
+    The limit grows by one for each round of 'limit' successful calls, and is halved, at most once per round trip,
+    when the backend responds with status 429 or 503 or a call times out.
+    A Retry-After header holds back new calls until it has passed.
+
+    Timeouts follow the observed latency and throughput instead of a fixed value, see 'timeout'.
+    The limiter can be shared between threads, and used on the event loop with 'async_slot'.
+    """
+
+    def __init__(self, name: str, initial_limit: int, max_limit: int, initial_timeout: float):
+        """Create a limiter.
+
+        Args:
+            name: The name of the backend, used in the run metrics.
+            initial_limit: The number of concurrent calls to start from.
+            max_limit: The highest number of concurrent calls.
+            initial_timeout: The timeout of calls until latency has been observed.
+        """
+        self.name = name
+        self.limit = float(min(initial_limit, max_limit))
+        self.max_limit = max_limit
+        self.initial_timeout = initial_timeout
+        self.stats = {"decreases": 0, "retry_after_waits": 0, "timeouts": 0, "lowest_limit": int(self.limit)}
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        #  Moving averages of the seconds per call without a size, and of the bytes per second of calls with a size
+        self._latency = None
+        self._throughput = None
+        self._condition = threading.Condition()
+
+    def _can_start(self) -> bool:
+        return self._in_flight < int(self.limit) and time.monotonic() >= self._blocked_until
+
+    def _try_acquire(self) -> bool:
+        with self._condition:
+            if not self._can_start():
+                return False
+            self._in_flight += 1
+            return True
+
+    def _release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Wait for a free slot and hold it while the block runs."""
+        with self._condition:
+            while not self._can_start():
+                blocked = self._blocked_until - time.monotonic()
+                self._condition.wait(blocked if blocked > 0 else None)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self):
+        """Wait for a free slot without blocking the event loop, and hold it while the block runs."""
+        while not self._try_acquire():
+            await asyncio.sleep(max(ASYNC_POLL_INTERVAL, self._blocked_until - time.monotonic()))
+        try:
+            yield
+        finally:
+            self._release()
+
+    def record(self, seconds: float, status: int, headers: Mapping[str, str] | None = None, size: int | None = None) -> None:
+        """Record the response to a call.
+
+        Args:
+            seconds: The duration of the call.
+            status: The status code of the response.
+            headers: The headers of the response, checked for Retry-After.
+            size: The number of bytes sent or received, if the call transferred a file.
+        """
+        with self._condition:
+            if status in OVERLOAD_STATUSES:
+                self._decrease()
+                retry_after = retry_after_seconds(headers)
+                if retry_after:
+                    self.stats["retry_after_waits"] += 1
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + min(retry_after, config.RETRY_MAX_DELAY))
+                return
+
+            if size and seconds > 0:
+                self._throughput = self._average(self._throughput, size / seconds)
+            else:
+                self._latency = self._average(self._latency, seconds)
+            if status < 500:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def record_timeout(self) -> None:
+        """Record a call that timed out."""
+        with self._condition:
+            self.stats["timeouts"] += 1
+            self._decrease()
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(1.0, self.limit / 2)
+        self.stats["decreases"] += 1
+        self.stats["lowest_limit"] = min(self.stats["lowest_limit"], int(self.limit))
+
+    @staticmethod
+    def _average(average: float | None, value: float) -> float:
+        return value if average is None else (1 - EWMA_WEIGHT) * average + EWMA_WEIGHT * value
+
+    def timeout(self, size: int | None = None) -> float:
+        """Get the timeout of a call: config.TIMEOUT_FACTOR times the expected duration from the observed
+        latency, plus the time to transfer 'size' bytes at the observed throughput,
+        within config.MIN_TIMEOUT and config.MAX_TIMEOUT.
+
+        Args:
+            size: The number of bytes the call sends or receives, if known.
+
+        Returns:
+            The timeout in seconds. The initial timeout until a call has been observed.
+        """
+        with self._condition:
+            latency, throughput = self._latency, self._throughput
+        if latency is None and (throughput is None or not size):
+            return self.initial_timeout
+        expected = (latency or 0.0) + (size / throughput if size and throughput else 0.0)
+        return min(config.MAX_TIMEOUT, max(config.MIN_TIMEOUT, config.TIMEOUT_FACTOR * expected))
+
+    def send(self, request: Callable[[float], requests.Response], size: int | None = None) -> requests.Response:
+        """Make a call with requests in a slot, with an adaptive timeout, and record the response.
+
+        Args:
+            request: Function making the call with the given timeout.
+            size: The number of bytes the call sends, if it sends a file.
+
+        Returns:
+            The response.
+        """
+        with self.slot():
+            start = time.monotonic()
+            try:
+                response = request(self.timeout(size))
+            except requests.Timeout:
+                self.record_timeout()
+                raise
+            self.record(time.monotonic() - start, response.status_code, response.headers, size)
+        return response
+
+    def snapshot(self) -> dict:
+        """Get the current limit, timeout and counters, for the run metrics."""
+        with self._condition:
+            latency, throughput = self._latency, self._throughput
+            snapshot = dict(self.stats, limit=int(self.limit), in_flight=self._in_flight)
+        snapshot["latency_seconds"] = round(latency, 3) if latency is not None else None
+        snapshot["mb_per_second"] = round(throughput / 1024 / 1024, 3) if throughput is not None else None
+        snapshot["timeout_seconds"] = round(self.timeout(), 1)
+        return snapshot
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, url: str, initial_limit: int, max_limit: int, initial_timeout: float) -> AdaptiveLimiter:
+    """Get the limiter of the host of a URL, creating it on first use.
+    Limiters are shared by all clients of a host in the process and kept between runs.
+    A client asking for a higher maximum raises the maximum of an existing limiter.
+
+    Args:
+        name: The name of the backend.
+        url: A URL on the host.
+        initial_limit: The number of concurrent calls to start from.
+        max_limit: The highest number of concurrent calls.
+        initial_timeout: The timeout of calls until latency has been observed.
+
+    Returns:
+        The limiter.
+    """
+    host = urlsplit(url).netloc
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = AdaptiveLimiter(name, initial_limit, max_limit, initial_timeout)
+        limiter = _limiters[host]
+        limiter.max_limit = max(limiter.max_limit, max_limit)
+        return limiter
+
+
+def snapshots() -> dict[str, dict]:
+    """Get a snapshot of each limiter by the name of its backend, or its host if several limiters share a name."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    names = [limiter.name for limiter in limiters.values()]
+    return {limiter.name if names.count(limiter.name) == 1 else f"{limiter.name} ({host})": limiter.snapshot()
+            for host, limiter in limiters.items()}
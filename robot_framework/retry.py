@@ -0,0 +1,203 @@
+"""This module contains retry with backoff and circuit breakers for calls to the backends."""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Awaitable, Callable
+
+import httpx
+import requests
+
+from robot_framework import config
+from robot_framework import rate_limit
+from robot_framework.miralix.miralix_api import IncompleteDownloadError
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the circuit breaker of a backend is open."""
+
+
+class CircuitBreaker:
+    """Stops calls to a backend after a number of consecutive failures.
+    While open, calls fail immediately with CircuitOpenError. After 'reset_timeout' seconds
+    a single trial call is let through, and the breaker closes again if it succeeds.
+    The breaker can be shared between threads.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = config.CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = config.CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the breaker has opened after consecutive failures and not yet closed again."""
+        return self.opened_at is not None
+
+    def before_call(self) -> None:
+        """Check that a call may be made.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True
+                return
+            raise CircuitOpenError(f"Circuit breaker for {self.name} is open after {self.failures} failures.")
+
+    def record_success(self) -> None:
+        """Record a successful call and close the breaker."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        """Record a failed call and open the breaker if the threshold is reached."""
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def is_transient(error: Exception) -> bool:
+    """Check if an error is likely to go away when the call is retried.
+
+    Args:
+        error: The error raised by the call.
+
+    Returns:
+        True for connection errors, timeouts, incomplete downloads and status 429 and 5xx.
+    """
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+        return error.response is not None and (error.response.status_code == 429 or error.response.status_code >= 500)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                              httpx.TransportError, IncompleteDownloadError))
+
+
+def backoff_delay(attempt: int, base_delay: float = config.RETRY_BASE_DELAY, max_delay: float = config.RETRY_MAX_DELAY) -> float:
+    """Get the delay before a retry using exponential backoff with full jitter.
+
+    Args:
+        attempt: The number of the attempt that failed, starting from 0.
+        base_delay: The delay ceiling after the first attempt in seconds.
+        max_delay: The highest delay ceiling in seconds.
+
+    Returns:
+        The delay in seconds.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Get the delay before retrying a failed call: the backoff delay, or the Retry-After of the response if that's longer.
+
+    Args:
+        error: The error raised by the call.
+        attempt: The number of the attempt that failed, starting from 0.
+
+    Returns:
+        The delay in seconds, at most config.RETRY_MAX_DELAY unless the backoff is longer.
+    """
+    delay = backoff_delay(attempt)
+    response = getattr(error, "response", None)
+    retry_after = rate_limit.retry_after_seconds(response.headers) if response is not None else None
+    return max(delay, min(retry_after, config.RETRY_MAX_DELAY)) if retry_after else delay
+
+
+def retry_call(func: Callable, *args, breaker: CircuitBreaker | None = None, attempts: int = config.RETRY_ATTEMPTS,
+               on_retry: Callable[[Exception], None] | None = None, **kwargs):
+    """Call a function and retry it with backoff on transient errors.
+
+    Args:
+        func: The function to call.
+        *args: Positional arguments for the function.
+        breaker: The circuit breaker of the backend called, if any.
+        attempts: The maximum number of attempts. Defaults to config.RETRY_ATTEMPTS.
+        on_retry: Function called with the error before each retry, eg. to count retries.
+        **kwargs: Keyword arguments for the function.
+
+    Returns:
+        The return value of the function.
+
+    Raises:
+        CircuitOpenError: If the breaker is open.
+        Exception: The error of the last attempt, or the first error that isn't transient.
+    """
+    for attempt in range(attempts):
+        if breaker:
+            breaker.before_call()
+        try:
+            result = func(*args, **kwargs)
+        # Only transient errors are retried, the rest are raised again.
+        # pylint: disable-next = broad-exception-caught
+        except Exception as error:
+            transient = is_transient(error)
+            # Errors that aren't transient still show that the backend is responding.
+            if breaker and transient:
+                breaker.record_failure()
+            elif breaker:
+                breaker.record_success()
+            if not transient or attempt == attempts - 1:
+                raise
+            if on_retry:
+                on_retry(error)
+            time.sleep(retry_delay(error, attempt))
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+    raise ValueError("The number of attempts must be at least 1.")
+
+
+async def async_retry_call(func: Callable[..., Awaitable], *args, breaker: CircuitBreaker | None = None, attempts: int = config.RETRY_ATTEMPTS,
+                           on_retry: Callable[[Exception], None] | None = None, **kwargs):
+    """Await a coroutine function and retry it with backoff on transient errors, like retry_call.
+
+    Args:
+        func: The coroutine function to call.
+        *args: Positional arguments for the function.
+        breaker: The circuit breaker of the backend called, if any.
+        attempts: The maximum number of attempts. Defaults to config.RETRY_ATTEMPTS.
+        on_retry: Function called with the error before each retry, eg. to count retries.
+        **kwargs: Keyword arguments for the function.
+
+    Returns:
+        The return value of the function.
+
+    Raises:
+        CircuitOpenError: If the breaker is open.
+        Exception: The error of the last attempt, or the first error that isn't transient.
+    """
+    for attempt in range(attempts):
+        if breaker:
+            breaker.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        # Only transient errors are retried, the rest are raised again.
+        # pylint: disable-next = broad-exception-caught
+        except Exception as error:
+            transient = is_transient(error)
+            if breaker and transient:
+                breaker.record_failure()
+            elif breaker:
+                breaker.record_success()
+            if not transient or attempt == attempts - 1:
+                raise
+            if on_retry:
+                on_retry(error)
+            await asyncio.sleep(retry_delay(error, attempt))
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+    raise ValueError("The number of attempts must be at least 1.")
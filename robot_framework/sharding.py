@@ -0,0 +1,126 @@
+"""This module splits the recordings between several robot workers, each running one shard."""
+
+import os
+import socket
+import zlib
+from dataclasses import dataclass, field
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import watermark
+
+# The keys recordings can be sharded by.
+SHARD_KEYS = ("call_id", "queue")
+
+
+def default_worker_id() -> str:
+    """Get an id of this worker which is unique across hosts."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass(frozen=True)
+class Shard:
+    """One of 'count' shards of the recordings, selected with "shard" in the process arguments, e.g.
+    {"shard": {"index": 0, "count": 3, "by": "call_id"}}.
+    Recordings are split by call ID modulo the number of shards, or by a hash of the queue name,
+    so each recording belongs to exactly one shard. Each shard keeps its own watermarks.
+    Shard i+1 takes over the recordings of shard i whose leases have expired, see leases.py.
+    The rest of the backlog of a shard waits until the shard runs again.
+    """
+    index: int
+    count: int
+    by: str = "call_id"
+    worker_id: str = field(default_factory=default_worker_id)
+
+    def __post_init__(self):
+        if self.by not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard key '{self.by}'. Use one of {SHARD_KEYS}.")
+        if not 0 <= self.index < self.count:
+            raise ValueError(f"Shard index {self.index} is out of range for {self.count} shards.")
+
+    @classmethod
+    def from_arguments(cls, process_arguments: dict) -> "Shard | None":
+        """Create the shard given by "shard" in the process arguments.
+
+        Args:
+            process_arguments: The parsed process arguments.
+
+        Returns:
+            The shard, or None if the robot isn't sharded.
+        """
+        arguments = process_arguments.get("shard")
+        return cls(**arguments) if arguments else None
+
+    @property
+    def label(self) -> str:
+        """The name of the shard, e.g. '1-of-3'."""
+        return f"{self.index + 1}-of-{self.count}"
+
+    def shard_of(self, recording: dict) -> int:
+        """Get the index of the shard a recording belongs to."""
+        if self.by == "queue":
+            return zlib.crc32(recording["QueueName"].strip().encode("utf-8")) % self.count
+        return recording["QueueCallId"] % self.count
+
+    def owns(self, recording: dict) -> bool:
+        """Check if a recording belongs to this shard."""
+        return self.shard_of(recording) == self.index
+
+    def rescued_shard(self) -> "Shard | None":
+        """Get the shard whose expired leases this shard takes over, or None if there's only one shard."""
+        if self.count == 1:
+            return None
+        return Shard((self.index - 1) % self.count, self.count, self.by, self.worker_id)
+
+
+def create_watermark_store(orchestrator_connection: OrchestratorConnection, shard: Shard | None) -> watermark.WatermarkStore:
+    """Create the watermark store of a shard, or the shared store if the robot isn't sharded."""
+    return watermark.create_store(orchestrator_connection, shard.label if shard else "")
+
+
+def load_rescued_watermarks(orchestrator_connection: OrchestratorConnection, shard: Shard | None) -> dict[str, int]:
+    """Load the watermarks of the shard whose expired leases this shard takes over.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        shard: This shard, or None if the robot isn't sharded.
+
+    Returns:
+        A dict of queue names to the highest call ID transferred by the other shard. Empty if there's nothing to take over.
+    """
+    rescued = shard.rescued_shard() if shard else None
+    if rescued is None:
+        return {}
+    return create_watermark_store(orchestrator_connection, rescued).load()
+
+
+def listing_watermarks(watermarks: dict[str, int], rescued_watermarks: dict[str, int]) -> dict[str, int]:
+    """Get the call IDs to list each queue from, so one listing covers both this shard and the shard it takes over from."""
+    return {queue_name: min(call_id, rescued_watermarks.get(queue_name, call_id)) for queue_name, call_id in watermarks.items()}
+
+
+def split_recordings(shard: Shard | None, recordings: list[dict], watermarks: dict[str, int],
+                     rescued_watermarks: dict[str, int]) -> tuple[list[dict], list[dict]]:
+    """Split a listing into the recordings of this shard and those of the shard it takes over from.
+
+    Args:
+        shard: This shard, or None if the robot isn't sharded.
+        recordings: The recordings listed from listing_watermarks, sorted by call ID.
+        watermarks: The watermarks of this shard.
+        rescued_watermarks: The watermarks of the shard this shard takes over from.
+
+    Returns:
+        The recordings of this shard and the candidates for taking over, both sorted by call ID.
+    """
+    if shard is None:
+        return recordings, []
+
+    def after(recording: dict, marks: dict[str, int]) -> bool:
+        queue_name = recording["QueueName"].strip()
+        return queue_name in marks and recording["QueueCallId"] > marks[queue_name]
+
+    rescued = shard.rescued_shard()
+    owned = [recording for recording in recordings if shard.owns(recording) and after(recording, watermarks)]
+    candidates = [recording for recording in recordings
+                  if rescued and rescued.owns(recording) and after(recording, rescued_watermarks)]
+    return owned, candidates
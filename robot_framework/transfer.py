@@ -0,0 +1,191 @@
+"""This module contains the transfer of a single recording from Miralix to GetOrganized."""
+
+import hashlib
+import json
+from typing import Any, BinaryIO, Callable
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework.miralix import miralix_api
+from robot_framework.get_organized import get_organized_api
+from robot_framework import config
+from robot_framework import metrics
+from robot_framework import pipeline
+from robot_framework import retry
+from robot_framework import upload_index
+
+
+class TransferBase:
+    """The state and bookkeeping shared by RecordingTransfer and async_process.AsyncRecordingTransfer.
+    Each backend has a circuit breaker that stops calls to it when it keeps failing,
+    and uploads of recordings already in the case with the same content are skipped.
+    """
+
+    def __init__(self, case_number: str, miralix_client: Any, run_metrics: metrics.RunMetrics | None = None,
+                 index: upload_index.UploadIndex | None = None):
+        """Create a transfer.
+
+        Args:
+            case_number: The GetOrganized case to upload to.
+            miralix_client: Client for the Miralix API.
+            run_metrics: The metrics to record timings, sizes and retries in.
+            index: The index of uploaded documents. If None the index in config.GO_UPLOAD_INDEX_FILE is loaded.
+        """
+        self.case_number = case_number
+        self.miralix_client = miralix_client
+        self.run_metrics = run_metrics or metrics.RunMetrics()
+        self.upload_index = index or upload_index.UploadIndex()
+        self.miralix_breaker = retry.CircuitBreaker("Miralix")
+        self.get_organized_breaker = retry.CircuitBreaker("GetOrganized")
+        #  The IDs of the documents uploaded by this transfer, for journalizing them after the run
+        self.uploaded_doc_ids = []
+
+    def start_run(self, run_metrics: metrics.RunMetrics) -> None:
+        """Start a new run with the same clients, circuit breakers and index, e.g. the next poll of the daemon.
+
+        Args:
+            run_metrics: The metrics of the new run.
+        """
+        self.run_metrics = run_metrics
+        self.uploaded_doc_ids = []
+
+    def retry_counter(self, stage: str, call_id: int) -> Callable[[Exception], None]:
+        """Get a function counting the retries of a stage of a recording, for the 'on_retry' argument of retry_call."""
+        return lambda _: self.run_metrics.add_retry(stage, call_id)
+
+    def skip_identical_upload(self, recording: dict, size: int) -> bool:
+        """Check if a recording is already in the case with the same content, and note the skipped upload if so.
+        Always False unless config.GO_SKIP_IDENTICAL_UPLOADS is set.
+
+        Args:
+            recording: The downloaded recording, with the hash of its content in recording["Sha256"].
+            size: The size of the content in bytes.
+
+        Returns:
+            True if the upload should be skipped.
+        """
+        if config.GO_SKIP_IDENTICAL_UPLOADS and self.upload_index.is_uploaded(self.case_number, miralix_api.get_filename(recording),
+                                                                              recording["Sha256"], size):
+            self.run_metrics.skip_upload(recording["QueueCallId"])
+            return True
+        return False
+
+    def index_upload(self, recording: dict, size: int, doc_id: int | None) -> None:
+        """Add an uploaded recording to the index of uploaded documents."""
+        self.upload_index.add(self.case_number, miralix_api.get_filename(recording), recording["Sha256"], size, doc_id)
+        if doc_id is not None:
+            self.uploaded_doc_ids.append(doc_id)
+
+
+class RecordingTransfer(TransferBase):
+    """Downloads recordings from Miralix and uploads them to a case in GetOrganized.
+    Each call is retried on its own. The methods can be called from several threads.
+    """
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection, case_number: str, miralix_client: miralix_api.MiralixClient,
+                 run_metrics: metrics.RunMetrics | None = None, index: upload_index.UploadIndex | None = None):
+        """Create a transfer.
+
+        Args:
+            orchestrator_connection: Connection to OpenOrchestrator, used to get the GetOrganized login.
+            case_number: The GetOrganized case to upload to.
+            miralix_client: Client for the Miralix API.
+            run_metrics: The metrics to record timings, sizes and retries in.
+            index: The index of uploaded documents. If None the index in config.GO_UPLOAD_INDEX_FILE is loaded.
+        """
+        super().__init__(case_number, miralix_client, run_metrics, index)
+        self.get_organized_client = get_organized_api.GetOrganizedClient.from_orchestrator(orchestrator_connection)
+        self.get_organized_client.preauthenticate(config.GO_UPLOAD_WORKERS)
+
+    def download(self, recording: dict) -> bytes | BinaryIO:
+        """Download a recording from Miralix.
+        The SHA-256 hash of the content is computed during the download and kept in recording["Sha256"].
+
+        Args:
+            recording: The recording to download.
+
+        Returns:
+            The file content, as a spooled file if config.MIRALIX_STREAM_DOWNLOADS is set.
+        """
+        call_id = recording["QueueCallId"]
+        with self.run_metrics.time_stage("download", call_id):
+            file_data = retry.retry_call(self._download_attempt, recording, breaker=self.miralix_breaker,
+                                         on_retry=self.retry_counter("download", call_id))
+        self.run_metrics.add_bytes(call_id, pipeline.size_of(file_data))
+        return file_data
+
+    def _download_attempt(self, recording: dict) -> bytes | BinaryIO:
+        hasher = hashlib.sha256()
+        if config.MIRALIX_STREAM_DOWNLOADS:
+            file_data = miralix_api.download_file_stream(recording["QueueCallId"], self.miralix_client, hasher=hasher)
+        else:
+            file_data = miralix_api.download_file(recording["QueueCallId"], self.miralix_client)
+            hasher.update(file_data)
+        recording["Sha256"] = hasher.hexdigest()
+        return file_data
+
+    def upload(self, recording: dict, file_data: bytes | BinaryIO) -> None:
+        """Upload a recording to GetOrganized, unless an identical document is already in the case.
+
+        Args:
+            recording: The recording to upload.
+            file_data: The file content.
+        """
+        size = pipeline.size_of(file_data)
+        if self.skip_identical_upload(recording, size):
+            return
+        with self.run_metrics.time_stage("upload", recording["QueueCallId"]):
+            doc_id = retry.retry_call(self._upload_attempt, recording, file_data, breaker=self.get_organized_breaker,
+                                      on_retry=self.retry_counter("upload", recording["QueueCallId"]))
+        self.index_upload(recording, size, doc_id)
+
+    def _upload_attempt(self, recording: dict, file_data: bytes | BinaryIO) -> int | None:
+        if hasattr(file_data, "seek"):
+            file_data.seek(0)
+        text, _ = self.get_organized_client.call(get_organized_api.upload_document, apiurl=config.GO_API, file=file_data,
+                                                 **upload_arguments(recording, self.case_number))
+        return get_organized_api.get_document_id(text)
+
+
+def upload_arguments(recording: dict, case_number: str) -> dict:
+    """Get the arguments for get_organized_api.upload_document describing a recording, except the file.
+
+    Args:
+        recording: The recording to upload.
+        case_number: The GetOrganized case to upload to.
+
+    Returns:
+        A dict of keyword arguments.
+    """
+    return {
+        "case": case_number,
+        "filename": miralix_api.get_filename(recording),
+        "agent_name": recording["AgentName"],
+        "date_string": recording["ConversationStartedUtc"],
+        "encoding": config.GO_UPLOAD_ENCODING
+    }
+
+
+def journalize_uploads(orchestrator_connection: OrchestratorConnection, recording_transfer: TransferBase) -> list[get_organized_api.BulkResult]:
+    """Journalize the documents uploaded by a run if "journalize" is set in the process arguments.
+    The documents are finalized concurrently by config.GO_BULK_WORKERS threads over the pooled NTLM sessions of the GetOrganized client,
+    and each document that fails is logged. Documents skipped as identical uploads aren't journalized again.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        recording_transfer: The transfer of the run.
+
+    Returns:
+        A result for each document, empty if journalizing isn't enabled.
+    """
+    if not json.loads(orchestrator_connection.process_arguments).get("journalize") or not recording_transfer.uploaded_doc_ids:
+        return []
+
+    client = get_organized_api.GetOrganizedClient.from_orchestrator(orchestrator_connection)
+    results = get_organized_api.finalize_documents(client, recording_transfer.uploaded_doc_ids)
+
+    failures = [result for result in results if result.error is not None]
+    for failure in failures:
+        orchestrator_connection.log_error(f"Couldn't journalize document {failure.item}: {failure.error!r}")
+    orchestrator_connection.log_info(f"Journalized {len(results) - len(failures)} of {len(results)} uploaded documents.")
+    return results
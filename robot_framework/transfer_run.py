@@ -0,0 +1,223 @@
+"""This module contains the bookkeeping of a run of transfers: queue elements, statuses and watermarks."""
+
+import functools
+from typing import Any, Callable, Iterable, Iterator
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection, QueueStatus
+
+from robot_framework.miralix import miralix_api
+from robot_framework import config
+from robot_framework import leases
+from robot_framework import metrics
+from robot_framework import pipeline
+from robot_framework import queue_batcher
+from robot_framework import queue_util
+from robot_framework import sharding
+from robot_framework import watermark
+
+# The message of the queue element of a recording waiting in the outbox.
+OUTBOX_MESSAGE = "Waiting in outbox"
+
+
+class TransferRun:  # pylint: disable=too-many-instance-attributes
+    """Keeps OpenOrchestrator up to date while a listing of recordings is transferred.
+    The listing is consumed a page of config.MIRALIX_PAGE_SIZE recordings at a time, so transfers start with the first page.
+    Queue elements left unfinished by earlier runs are reused, and the rest are created in bulk for each page.
+    Statuses and log lines are batched, and the watermark is saved once the statuses behind it are written.
+    In sharded mode the queue elements are leased, and elements leased by other workers are skipped.
+    All methods must be called from the same thread.
+    """
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection, watermark_store: watermark.WatermarkStore,
+                 last_downloads: dict[str, int], run_metrics: metrics.RunMetrics | None = None,
+                 *, shard: sharding.Shard | None = None, rescued_watermarks: dict[str, int] | None = None,
+                 queue_index: queue_util.QueueIndex | None = None):
+        """Prepare a run, finding the queue elements left unfinished by earlier runs.
+
+        Args:
+            orchestrator_connection: Connection to OpenOrchestrator.
+            watermark_store: The store to save the watermarks in.
+            last_downloads: The current watermarks.
+            run_metrics: The metrics to record the recordings and the time spent updating OpenOrchestrator in.
+            shard: The shard this worker runs, if the robot is sharded. Queue elements are then leased, see leases.py.
+            rescued_watermarks: The watermarks of the shard this shard takes over from, if the robot is sharded.
+                Listed recordings of that shard with an expired lease are transferred as well.
+            queue_index: The index of the queue elements, kept between the polls of the daemon. A new one is loaded if None.
+        """
+        self.shard = shard
+        #  The watermarks the listing is split by, see sharding.split_recordings
+        self.last_downloads = dict(last_downloads)
+        self.rescued_watermarks = rescued_watermarks or {}
+        self.watermark_tracker = watermark.WatermarkTracker(last_downloads)
+        self.run_metrics = run_metrics or metrics.RunMetrics()
+        self.batcher = queue_batcher.QueueBatcher(orchestrator_connection, on_flush=functools.partial(self._save_watermark, watermark_store),
+                                                  run_metrics=self.run_metrics)
+        self.leases = leases.LeaseKeeper(orchestrator_connection, shard.worker_id, run_metrics=self.run_metrics) if shard else None
+        #  The number of recordings to transfer listed so far
+        self.listed = 0
+
+        #  Find queue elements left unfinished by earlier runs, so their recordings are resumed
+        self.queue_index = queue_index or queue_util.QueueIndex()
+        with self.run_metrics.time_stage("queue_update"):
+            self.queue_index.load(orchestrator_connection)
+        self.queue_elements, self.done_references = self.queue_index.queue_elements, self.queue_index.done_references
+
+    def _add_page(self, recordings: list[dict]) -> list[dict]:
+        """Add a page of the listing to the run, creating queue elements in bulk for the recordings that need them.
+
+        Returns:
+            The recordings of the page to transfer, sorted by call ID.
+        """
+        recordings, rescue_candidates = sharding.split_recordings(self.shard, recordings, self.last_downloads, self.rescued_watermarks)
+        self.watermark_tracker.add(recordings)
+
+        new_recordings = [recording for recording in recordings
+                          if str(recording["QueueCallId"]) not in self.done_references and str(recording["QueueCallId"]) not in self.queue_elements]
+        self.queue_elements.update(self.batcher.create_queue_elements([str(recording["QueueCallId"]) for recording in new_recordings],
+                                                                      [miralix_api.get_filename(recording) for recording in new_recordings],
+                                                                      created_by=self.shard.worker_id if self.shard else None))
+
+        #  Take over recordings of a stalled worker on the previous shard. They don't move the watermarks of this shard.
+        #  Each is read again and only taken if its lease is still expired, see LeaseKeeper.acquire.
+        rescued = [recording for recording in rescue_candidates
+                   if str(recording["QueueCallId"]) in self.queue_elements and leases.is_expired(self.queue_elements[str(recording["QueueCallId"])])]
+        if rescued:
+            self.batcher.log_info(f"Taking over {len(rescued)} recordings with expired leases from shard {self.shard.rescued_shard().label}.")
+            recordings = sorted(recordings + rescued, key=lambda recording: recording["QueueCallId"])
+        self.listed += len(recordings)
+        return recordings
+
+    def _save_watermark(self, watermark_store: watermark.WatermarkStore) -> None:
+        if self.watermark_tracker.changed:
+            watermark_store.save(self.watermark_tracker.watermarks)
+            self.watermark_tracker.changed = False
+
+    def start(self, listing: Iterable[dict], *, page_size: int | None = None,
+              key: Callable[[dict], Any] | None = None) -> Iterator[dict]:
+        """Mark each recording as in progress as it's consumed.
+        Recordings that are already done are skipped.
+        The listing is consumed a page at a time, and can be called with each page of a listing in turn.
+
+        Args:
+            listing: The listed recordings, sorted by call ID.
+            page_size: The number of recordings consumed at a time. Defaults to config.MIRALIX_PAGE_SIZE.
+            key: Sort key of the recordings within a page, e.g. RunPlan.priority. Defaults to call ID order.
+
+        Yields:
+            The recordings to transfer.
+        """
+        for page in pipeline.batched(listing, page_size or config.MIRALIX_PAGE_SIZE):
+            first = self.listed
+            recordings = self._add_page(page)
+            for i, recording in enumerate(sorted(recordings, key=key) if key else recordings, start=first):
+                call_id = recording["QueueCallId"]
+                if str(call_id) in self.done_references:
+                    self.watermark_tracker.complete(recording)
+                    continue
+
+                queue_element = self.queue_elements[str(call_id)]
+                if self.leases and (self.leases.is_held_by_other(queue_element) or not self.leases.acquire(queue_element)):
+                    self.batcher.log_info(f"{i+1}/{self.listed} listed - Call ID {call_id} is leased by another worker")
+                    continue
+
+                self.run_metrics.start_recording(recording)
+                filename = miralix_api.get_filename(recording)
+                self.batcher.log_info(f"{i+1}/{self.listed} listed - Call ID {call_id} being saved as {filename}")
+                if self.leases:
+                    self._renew_leases()
+                else:
+                    #  The index keeps the status before the attempt, which the attempts are counted from
+                    self.batcher.set_queue_element_status(queue_element.id, QueueStatus.IN_PROGRESS)
+                yield recording
+
+    def finish(self, recording: dict, error: Exception | None) -> None:
+        """Mark a recording as done or failed.
+
+        Args:
+            recording: The recording that was transferred.
+            error: The error raised while transferring it, or None if it succeeded.
+        """
+        call_id = recording["QueueCallId"]
+        self.run_metrics.finish_recording(call_id, error)
+        if not self._release_lease(call_id):
+            return
+        if error:
+            #  A recording that keeps failing is given up, so the watermark can move past it
+            status, message = queue_util.failure_status(self.queue_elements[str(call_id)], error)
+            self._set_status(call_id, status, message)
+            if status == QueueStatus.ABANDONED:
+                self.batcher.log_info(f"Call ID {call_id} is given up: {message}")
+                self.watermark_tracker.complete(recording)
+        else:
+            self._set_status(call_id, QueueStatus.DONE)
+            self.watermark_tracker.complete(recording)
+
+    def store(self, recording: dict) -> None:
+        """Mark a recording as stored in the outbox, see outbox.py. The watermark moves past it, since the outbox
+        keeps it for later runs, while its queue element stays 'In Progress' until it's uploaded.
+
+        Args:
+            recording: The recording that was stored.
+        """
+        call_id = recording["QueueCallId"]
+        if not self._release_lease(call_id):
+            return
+        self._set_status(call_id, QueueStatus.IN_PROGRESS, OUTBOX_MESSAGE)
+        self.watermark_tracker.complete(recording)
+
+    def finish_stored(self, recording: dict) -> None:
+        """Mark a recording uploaded from the outbox as done.
+        The queue elements of recordings stored by earlier runs are known if they were reclaimed.
+
+        Args:
+            recording: The recording that was uploaded.
+        """
+        call_id = recording["QueueCallId"]
+        self.run_metrics.finish_recording(call_id, None)
+        if str(call_id) in self.queue_elements:
+            self._set_status(call_id, QueueStatus.DONE)
+
+    def postpone(self, recording: dict, reason: str) -> None:
+        """Leave a started recording for the next run without failing it. The watermark doesn't move past it.
+
+        Args:
+            recording: The recording.
+            reason: Why the recording is left, set as the message of its queue element.
+        """
+        call_id = recording["QueueCallId"]
+        if self._release_lease(call_id):
+            self._set_status(call_id, QueueStatus.NEW, reason)
+
+    def _set_status(self, call_id: int, status: QueueStatus, message: str | None = None) -> None:
+        """Set the status of the queue element of a recording through the batcher, and note it in the index."""
+        self.batcher.set_queue_element_status(self.queue_elements[str(call_id)].id, status, message)
+        self.queue_index.set_status(str(call_id), status, message)
+
+    def _release_lease(self, call_id: int) -> bool:
+        """Release the lease on the queue element of a recording in sharded mode.
+
+        Returns:
+            False if the lease was lost, in which case the worker that took it over sets the status.
+        """
+        if not self.leases:
+            return True
+        self._renew_leases()
+        return self.leases.release(self.queue_elements[str(call_id)].id)
+
+    def _renew_leases(self) -> None:
+        for reference in self.leases.renew_due():
+            self.batcher.log_info(f"Call ID {reference} was taken over by another worker.")
+
+    def flush(self) -> None:
+        """Write all pending changes to OpenOrchestrator."""
+        self.batcher.flush()
+
+    def raise_for_failures(self) -> None:
+        """Raise an error if any recording failed to transfer.
+
+        Raises:
+            RuntimeError: If any recording failed.
+        """
+        failed_call_ids = self.run_metrics.failed_call_ids()
+        if failed_call_ids:
+            raise RuntimeError(f"{len(failed_call_ids)} recordings failed to transfer: {failed_call_ids}")
@@ -0,0 +1,122 @@
+"""This module keeps a local index of the documents uploaded to GetOrganized, so identical uploads can be skipped."""
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Iterator
+
+from robot_framework import config
+
+
+@contextlib.contextmanager
+def file_lock(path: str, timeout: float | None = None) -> Iterator[None]:
+    """Hold a lock between processes by creating a lock file, which is removed when the block ends.
+    A lock file older than the timeout is left by a process that crashed, and is removed.
+
+    Args:
+        path: The path of the lock file.
+        timeout: Seconds to wait for the lock. Defaults to config.GO_UPLOAD_INDEX_LOCK_SECONDS.
+
+    Raises:
+        TimeoutError: If the lock isn't free within the timeout.
+    """
+    timeout = timeout or config.GO_UPLOAD_INDEX_LOCK_SECONDS
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > timeout:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"The lock '{path}' wasn't released within {timeout} seconds.") from None
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.remove(path)
+
+
+class UploadIndex:
+    """An index of (case, filename) to the content hash, size and document ID of the uploaded document.
+    The index is kept in a local JSON file, which is replaced atomically on save. Several runs may share the file,
+    e.g. a backfill next to the regular run, so the entries added by a run are merged into the file under a lock.
+    The methods can be called from several threads.
+    """
+
+    def __init__(self, path: str | None = None):
+        """Load the index.
+
+        Args:
+            path: The path of the index file. If None config.GO_UPLOAD_INDEX_FILE is used.
+        """
+        self.path = path or config.GO_UPLOAD_INDEX_FILE
+        self.entries = self._read()
+        #  The entries added since the last save
+        self.added = {}
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+    @staticmethod
+    def key(case: str, filename: str) -> str:
+        """Get the key of a document in the index."""
+        return f"{case}/{filename}"
+
+    def is_uploaded(self, case: str, filename: str, sha256: str, size: int) -> bool:
+        """Check if an identical document has already been uploaded.
+
+        Args:
+            case: The GetOrganized case.
+            filename: The name of the document in the case.
+            sha256: The SHA-256 hex digest of the content.
+            size: The size of the content in bytes.
+
+        Returns:
+            True if the index has a document with the same name, hash and size in the case.
+        """
+        with self._lock:
+            entry = self.entries.get(self.key(case, filename))
+        return entry is not None and entry["sha256"] == sha256 and entry["size"] == size
+
+    def add(self, case: str, filename: str, sha256: str, size: int, doc_id: int | None) -> None:
+        """Add an uploaded document to the index, replacing any earlier version.
+
+        Args:
+            case: The GetOrganized case.
+            filename: The name of the document in the case.
+            sha256: The SHA-256 hex digest of the content.
+            size: The size of the content in bytes.
+            doc_id: The GetOrganized document ID, if known.
+        """
+        with self._lock:
+            entry = {"sha256": sha256, "size": size, "doc_id": doc_id}
+            self.entries[self.key(case, filename)] = entry
+            self.added[self.key(case, filename)] = entry
+
+    def save(self) -> None:
+        """Merge the entries added since the last save into the index file, keeping the entries other runs have written.
+        The entries of the file are loaded into the index as well.
+        """
+        with self._lock:
+            if not self.added:
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with file_lock(f"{self.path}.lock"):
+                self.entries = self._read() | self.added
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False) as file:
+                    json.dump(self.entries, file)
+                os.replace(file.name, self.path)
+            self.added = {}
@@ -0,0 +1,168 @@
+"""This module keeps track of the highest call ID transferred from each Miralix queue."""
+
+import json
+import os
+import tempfile
+from collections import deque
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection, QueueStatus
+
+from robot_framework import config
+from robot_framework import queue_util
+
+
+class WatermarkStore:
+    """Base class of stores that persist a watermark per Miralix queue."""
+
+    def load(self) -> dict[str, int]:
+        """Load the watermarks.
+
+        Returns:
+            A dict of queue names to the highest transferred call ID. Empty if nothing has been saved.
+        """
+        raise NotImplementedError
+
+    def save(self, watermarks: dict[str, int]) -> None:
+        """Replace the saved watermarks in a single write.
+
+        Args:
+            watermarks: A dict of queue names to the highest transferred call ID.
+        """
+        raise NotImplementedError
+
+
+class ConstantWatermarkStore(WatermarkStore):
+    """Stores the watermarks as JSON in a constant in OpenOrchestrator.
+    The constant must be created in OpenOrchestrator beforehand. It may be left empty.
+    """
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection, constant_name: str):
+        self.orchestrator_connection = orchestrator_connection
+        self.constant_name = constant_name
+
+    def load(self) -> dict[str, int]:
+        value = self.orchestrator_connection.get_constant(self.constant_name).value
+        return json.loads(value) if value.strip() else {}
+
+    def save(self, watermarks: dict[str, int]) -> None:
+        self.orchestrator_connection.update_constant(self.constant_name, json.dumps(watermarks))
+
+
+class JsonWatermarkStore(WatermarkStore):
+    """Stores the watermarks in a local JSON file.
+    The file is replaced atomically, so a crash never leaves a partial file behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict[str, int]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def save(self, watermarks: dict[str, int]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False) as file:
+            json.dump(watermarks, file)
+        os.replace(file.name, self.path)
+
+
+def create_store(orchestrator_connection: OrchestratorConnection, suffix: str = "") -> WatermarkStore:
+    """Create the watermark store selected in config.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+        suffix: Added to the name of the constant or file, so each shard keeps its own watermarks.
+
+    Returns:
+        The watermark store.
+    """
+    if config.WATERMARK_BACKEND == "constant":
+        return ConstantWatermarkStore(orchestrator_connection, f"{config.WATERMARK_CONSTANT} {suffix}" if suffix else config.WATERMARK_CONSTANT)
+    if config.WATERMARK_BACKEND == "json":
+        root, extension = os.path.splitext(config.WATERMARK_FILE)
+        return JsonWatermarkStore(f"{root}.{suffix}{extension}" if suffix else config.WATERMARK_FILE)
+    raise ValueError(f"Unknown watermark backend '{config.WATERMARK_BACKEND}'.")
+
+
+def load_watermarks(store: WatermarkStore, queue_names: list[str], orchestrator_connection: OrchestratorConnection) -> dict[str, int]:
+    """Load the watermark of each queue.
+    Queues missing from the store start at the highest watermark of the other queues.
+    If the store is empty the watermark is migrated once from the DONE queue elements in OpenOrchestrator.
+
+    Args:
+        store: The store to load from.
+        queue_names: The names of the Miralix queues to get watermarks for.
+        orchestrator_connection: Connection to OpenOrchestrator.
+
+    Returns:
+        A dict of queue names to the highest transferred call ID.
+    """
+    watermarks = store.load()
+    missing = [queue_name.strip() for queue_name in queue_names if queue_name.strip() not in watermarks]
+    if missing:
+        default = max(watermarks.values()) if watermarks else migrate_from_queue(orchestrator_connection)
+        watermarks.update({queue_name: default for queue_name in missing})
+        store.save(watermarks)
+    return watermarks
+
+
+def migrate_from_queue(orchestrator_connection: OrchestratorConnection) -> int:
+    """Find the highest call ID among the DONE queue elements.
+
+    Args:
+        orchestrator_connection: Connection to OpenOrchestrator.
+
+    Returns:
+        The highest call ID, or 0 if the queue has no DONE elements.
+    """
+    orchestrator_connection.log_info("Migrating watermark from queue elements.")
+    queue_elements = queue_util.get_all_queue_elements(orchestrator_connection, QueueStatus.DONE)
+    return max((int(queue_element.reference) for queue_element in queue_elements), default=0)
+
+
+class WatermarkTracker:  # pylint: disable=too-few-public-methods
+    """Advances the watermark of each queue as recordings complete.
+    A watermark only moves past a recording once it and every listed recording
+    before it in the same queue are done, so a failed recording is retried on the next run.
+    A recording that is given up after too many attempts counts as done, see queue_util.failure_message.
+    'changed' is set whenever a watermark moves, and can be reset once the watermarks are saved.
+    """
+
+    def __init__(self, watermarks: dict[str, int], recordings: list[dict] | None = None):
+        self.watermarks = dict(watermarks)
+        self.changed = False
+        self._pending = {}
+        self._done = set()
+        self.add(recordings or [])
+
+    def add(self, recordings: list[dict]) -> None:
+        """Add listed recordings behind those already added, e.g. the next page of a listing.
+
+        Args:
+            recordings: The recordings, with higher call IDs than those already added to their queues.
+        """
+        for recording in sorted(recordings, key=lambda recording: recording["QueueCallId"]):
+            self._pending.setdefault(recording["QueueName"].strip(), deque()).append(recording["QueueCallId"])
+
+    def complete(self, recording: dict) -> bool:
+        """Mark a recording as done.
+
+        Args:
+            recording: The recording that was transferred.
+
+        Returns:
+            True if a watermark moved.
+        """
+        self._done.add(recording["QueueCallId"])
+        queue_name = recording["QueueName"].strip()
+        pending = self._pending.get(queue_name, deque())
+        advanced = False
+        while pending and pending[0] in self._done:
+            self._done.discard(pending[0])
+            self.watermarks[queue_name] = pending.popleft()
+            advanced = True
+        self.changed |= advanced
+        return advanced